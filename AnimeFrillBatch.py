@@ -0,0 +1,205 @@
+import bpy, os, sys, json, time
+
+from .AnimeFrillTools import (
+    AHT_FRILL_OT_create_control_empty, AHT_FRILL_OT_remove_control_empty, AHT_FRILL_OT_transfer_empty_armature,
+    AFT_CACHE_NAME, AFT_EMPTY_ARMATURE_NAME, build_deform_bone_index, get_registered_control_empties, read_curve_input,
+)
+from .AnimeFrillPlan import plan_curves, get_input_digest, save_plan, load_plan
+from .AnimeFrillIntegrity import check_scene_integrity
+from .AnimeFrillRig import load_rig_file, import_rigs
+
+
+# バックグラウンド実行用
+# *************************************************************************************************
+# オペレータと違って選択状態や編集モードを使わず、Curveを名前/コレクションで指定して処理する
+# blender --background file.blend --python-expr ... -- '<job json>' から worker_main() を呼ぶ(tools/aft_batch.py参照)
+
+BATCH_REPORT_PREFIX = "AFT_BATCH_REPORT:"
+BATCH_STEPS = ("check", "repair", "import", "remove", "create", "weights")
+INTEGRITY_STEPS = ("check", "repair")
+SCENE_STEPS = INTEGRITY_STEPS + ("import",)
+
+
+# 名前とコレクション名からCurveを集める
+def find_batch_curves(scene, curve_names=(), collection_names=()):
+    curves = []
+    for name in curve_names:
+        obj = scene.objects.get(name)
+        if obj != None and obj.type == 'CURVE' and obj not in curves:
+            curves.append(obj)
+    for name in collection_names:
+        collection = bpy.data.collections.get(name)
+        if collection == None:
+            continue
+        for obj in collection.all_objects:
+            if obj.type == 'CURVE' and obj not in curves:
+                curves.append(obj)
+    return curves
+
+
+# 計画の保存先(ファイルごとにフォルダを分ける)
+def get_batch_plan_path(plan_dir, curve_name):
+    blend_name = bpy.path.clean_name(bpy.path.basename(bpy.data.filepath) or "untitled")
+    return os.path.join(bpy.path.abspath(plan_dir), blend_name, bpy.path.clean_name(curve_name) + ".json")
+
+
+# 保存済みの計画のうち、入力が今のCurveと同じものだけ使う(Noneのところは計算しなおす)
+def load_batch_plans(curve_inputs, plan_dir):
+    plans = [None] * len(curve_inputs)
+    if not plan_dir:
+        return plans
+    for no, curve_input in enumerate(curve_inputs):
+        try:
+            plan = load_plan(get_batch_plan_path(plan_dir, curve_input["curve"]))
+        except (OSError, ValueError):
+            continue  # ないか古い
+        if plan["input_digest"] == get_input_digest(curve_input):
+            plans[no] = plan
+    return plans
+
+
+# Curveごとに、指定されたステップを順に実行する
+# createは全Curveの計画を先にまとめて(スレッドプールで)計算してから、まとめてシーンに書き込む
+def process_batch_curves(context, curves, steps, mesh=None, options=None):
+    options = options or {}
+    timings = {step: 0.0 for step in steps}
+    skipped = []
+    targets = []
+
+    for curve in curves:
+        # キャッシュ再生中のCurveは触らない
+        if AFT_CACHE_NAME in curve:
+            skipped.append(curve.name)
+            continue
+
+        if "bind_mode" in options:
+            curve.aft_bind_mode = options["bind_mode"]
+        if "tilt_sync" in options:
+            curve.aft_tilt_sync = options["tilt_sync"]
+
+        # createは必ず一旦削除してから(オペレータと同じ)
+        if "remove" in steps or "create" in steps:
+            start = time.perf_counter()
+            AHT_FRILL_OT_remove_control_empty.remove(context, curve)
+            timings["remove" if "remove" in steps else "create"] += time.perf_counter() - start
+        targets.append(curve)
+
+    plans_cached = 0
+    if "create" in steps:
+        plan_dir = options.get("plan_dir")
+        start = time.perf_counter()
+        curve_inputs = [read_curve_input(curve) for curve in targets]
+        plans = load_batch_plans(curve_inputs, plan_dir)
+        missing = [no for no, plan in enumerate(plans) if plan == None]
+        plans_cached = len(plans) - len(missing)
+        for no, plan in zip(missing, plan_curves([curve_inputs[no] for no in missing], max_workers=options.get("plan_workers"))):
+            plans[no] = plan
+            if plan_dir:
+                filepath = get_batch_plan_path(plan_dir, plan["curve"])
+                os.makedirs(os.path.dirname(filepath), exist_ok=True)
+                save_plan(plan, filepath)
+        timings["plan"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for curve, plan in zip(targets, plans):
+            AHT_FRILL_OT_create_control_empty.apply(context, curve, plan)
+        timings["create"] += time.perf_counter() - start
+
+    # ウエイトはメッシュごとに1回で全Curveまとめて
+    if "weights" in steps:
+        if mesh == None:
+            raise ValueError("weights step needs a mesh")
+
+        start = time.perf_counter()
+        empties = []
+        for curve in curves:
+            if curve.name in skipped:
+                continue
+            curve_empties, hooks, armature = get_registered_control_empties(context, curve)
+            for empty in curve_empties:
+                for constraint in list(empty.constraints):
+                    if constraint.name.startswith(AFT_EMPTY_ARMATURE_NAME):
+                        empty.constraints.remove(constraint)
+            empties.extend(curve_empties)
+
+        scene = context.scene
+        bone_index = build_deform_bone_index(mesh, scene.aft_use_name_fallback)
+        AHT_FRILL_OT_transfer_empty_armature.transfer(mesh, empties, bone_index, scene.aft_max_influences, scene.aft_min_weight)
+        timings["weights"] += time.perf_counter() - start
+
+    return {"timings": timings, "curves": [curve.name for curve in targets], "skipped": skipped, "plans_cached": plans_cached}
+
+
+# リグファイルを読み込んで、同じ名前のCurveに作り直す
+def import_batch_rigs(context, rig_file, curves=None):
+    if not rig_file:
+        raise ValueError("import step needs a rig file")
+
+    start = time.perf_counter()
+    rigs = load_rig_file(rig_file)
+    if curves == None:
+        curves = [obj for obj in context.scene.objects if obj.type == 'CURVE']
+    curve_names = {curve.name: curve for curve in curves}
+    pairs = [(rig, curve_names[rig["curve"]]) for rig in rigs if rig["curve"] in curve_names]
+    skipped, replanned = import_rigs(context, [rig for rig, curve in pairs], [curve for rig, curve in pairs])
+    return {
+        "time": time.perf_counter() - start,
+        "imported": len(pairs) - len(skipped),
+        "replanned": replanned,
+        "skipped": skipped,
+        "missing": [rig["curve"] for rig in rigs if rig["curve"] not in curve_names],
+    }
+
+
+# 1ファイル分のジョブを実行してレポートを返す
+def run_batch_job(job):
+    context = bpy.context
+    scene = context.scene
+    report = {"file": bpy.data.filepath, "ok": False}
+    start = time.perf_counter()
+
+    try:
+        steps = [step for step in job.get("steps", ["create"]) if step in BATCH_STEPS]
+        curves = find_batch_curves(scene, job.get("curves", []), job.get("collections", []))
+
+        mesh = None
+        if job.get("mesh"):
+            mesh = scene.objects.get(job["mesh"])
+            if mesh == None or mesh.type != 'MESH':
+                raise ValueError("mesh not found: %s" % job["mesh"])
+
+        # 整合性チェックはシーン全体で1回(repairの時は直してから他のステップを行う)
+        if any(step in INTEGRITY_STEPS for step in steps):
+            report["integrity"] = check_scene_integrity(scene, "repair" in steps)
+
+        # リグファイルの読み込みは、ファイル中のリグを同じ名前のCurveに付ける(curves/collectionsの指定があればその中だけ)
+        if "import" in steps:
+            report["rig"] = import_batch_rigs(context, (job.get("options") or {}).get("rig_file"), curves if job.get("curves") or job.get("collections") else None)
+
+        curve_steps = [step for step in steps if step not in SCENE_STEPS]
+        report.update(process_batch_curves(context, curves, curve_steps, mesh, job.get("options")))
+
+        if job.get("save"):
+            save_start = time.perf_counter()
+            bpy.ops.wm.save_mainfile()
+            report["timings"]["save"] = time.perf_counter() - save_start
+
+        report["ok"] = True
+    except Exception as e:
+        report["error"] = "%s: %s" % (type(e).__name__, e)
+
+    report["total"] = time.perf_counter() - start
+    return report
+
+
+# blenderの "--" 以降の引数からジョブを受け取って実行し、レポートを1行で出力する
+def worker_main():
+    argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+    job = json.loads(argv[0]) if argv else {}
+
+    # アドオンが有効になっていない環境ではここで登録する
+    if not hasattr(bpy.types.Object, "aft_bind_mode"):
+        sys.modules[__package__].register()
+
+    report = run_batch_job(job)
+    print(BATCH_REPORT_PREFIX + json.dumps(report), flush=True)
@@ -0,0 +1,254 @@
+import bpy, os
+import numpy as np
+from bpy.app.handlers import persistent
+
+from .AnimeFrillTools import (
+    AFT_CACHE_NAME, AFT_EMPTY_ARMATURE_NAME, get_registered_control_empties, get_point_splines, read_curve_points, read_deformed_curve_points, write_curve_points,
+)
+
+
+# ポイントキャッシュ
+# *************************************************************************************************
+# 変形後のポイント位置とTiltをフレームごとにfloat32で保存する(.npy, (フレーム数, ポイント数, 4) = x, y, z, tilt)
+# ポイントは全スプラインの通し番号順
+# 再生中はHook/ドライバ/Armatureを止めて、キャッシュの値をCurveに直接書き込む
+
+def get_cache_filepath(scene, curve):
+    directory = bpy.path.abspath(scene.aft_cache_dir) if bpy.data.filepath else bpy.app.tempdir
+    return os.path.join(directory, bpy.path.clean_name(curve.name) + ".npy")
+
+
+# 読み込み済みのキャッシュ(パス → (memmap, 元のポイントのw))
+# IDプロパティの配列はステップ付きのスライスができないので、wは読み込み時に1回だけ取り出しておく
+cache_arrays = {}
+
+def load_cache_array(meta):
+    filepath = meta["filepath"]
+    cache = cache_arrays.get(filepath)
+    if cache is None:
+        cache = (np.load(filepath, mmap_mode='r'), np.asarray(meta["rest_co"], dtype=np.float32).reshape(-1, 4)[:, 3])
+        cache_arrays[filepath] = cache
+    return cache
+
+
+# キャッシュの1フレーム分をCurveに書き込む
+def apply_point_cache(curve, frame):
+    meta = curve[AFT_CACHE_NAME]
+    try:
+        array, rest_w = load_cache_array(meta)
+    except OSError:
+        return  # ファイルがなくなっていたら何もしない
+
+    num = sum(len(spline.points) for spline_no, spline in get_point_splines(curve.data))
+    if array.shape[1] != num:
+        return  # ポイント数が変わっていた
+
+    no = min(max(frame - meta["frame_start"], 0), array.shape[0] - 1)
+    point_co = np.empty((num, 4), dtype=np.float32)
+    point_co[:, :3] = array[no, :, :3]
+    point_co[:, 3] = rest_w
+    write_curve_points(curve.data, point_co, array[no, :, 3])
+    curve.data.update_tag()
+
+
+# Hook/Armatureモディファイア、Tiltドライバ、EmptyのArmatureコンストレイントを止める/戻す
+# 止める時は止める前の状態({"hooks": {名前: [show_viewport, show_render]}, "drivers": {パス: 1}, "constraints": {Empty名: 1}})を返す
+# 戻す時はそれを渡して、止める前の値に戻す(ユーザーが止めていたHookなどは止めたまま)
+# "hooks"/"drivers"がない時(前のバージョンで作ったキャッシュ)は全部有効にする
+def set_curve_evaluation(curve, enable, state=None):
+    empties, hooks, armature = get_registered_control_empties(bpy.context, curve)
+    drivers = curve.data.animation_data.drivers if curve.data.animation_data else []
+    drivers = [driver for driver in drivers if driver.data_path.endswith(".tilt")]
+
+    if not enable:
+        state = {"hooks": {}, "drivers": {}, "constraints": {}}
+        for hook in hooks:
+            state["hooks"][hook.name] = [int(hook.show_viewport), int(hook.show_render)]
+            hook.show_viewport = False
+            hook.show_render = False
+        for driver in drivers:
+            if not driver.mute:
+                state["drivers"][driver.data_path] = 1
+                driver.mute = True
+        for empty in empties:
+            for constraint in empty.constraints:
+                if constraint.name.startswith(AFT_EMPTY_ARMATURE_NAME) and constraint.enabled:
+                    constraint.enabled = False
+                    state["constraints"][empty.name] = 1
+        return state
+
+    hook_flags = state.get("hooks")
+    for hook in hooks:
+        flags = hook_flags.get(hook.name) if hook_flags != None else (True, True)
+        if flags != None:
+            hook.show_viewport = bool(flags[0])
+            hook.show_render = bool(flags[1])
+
+    muted_drivers = state.get("drivers")
+    for driver in drivers:
+        if muted_drivers == None or driver.data_path in muted_drivers:
+            driver.mute = False
+
+    for empty in empties:
+        if empty.name not in state["constraints"]:
+            continue
+        for constraint in empty.constraints:
+            if constraint.name.startswith(AFT_EMPTY_ARMATURE_NAME):
+                constraint.enabled = True
+
+
+# キャッシュ再生中のCurve名一覧(Noneの時は次に使う時に作り直す)
+cached_curve_names = None
+
+def invalidate_cached_curves():
+    global cached_curve_names
+    cached_curve_names = None
+    cache_arrays.clear()
+
+
+@persistent
+def point_cache_frame_change_pre(scene, depsgraph=None):
+    global cached_curve_names
+    if cached_curve_names == None:
+        cached_curve_names = [obj.name for obj in scene.objects if obj.type == 'CURVE' and AFT_CACHE_NAME in obj]
+
+    for name in cached_curve_names:
+        curve = scene.objects.get(name)
+        if curve == None or AFT_CACHE_NAME not in curve:
+            cached_curve_names = None  # 名前変更や削除があった
+            continue
+        apply_point_cache(curve, scene.frame_current)
+
+
+@persistent
+def point_cache_load_post(dummy):
+    invalidate_cached_curves()
+
+
+# ベイクボタン
+# *************************************************************************************************
+class AHT_FRILL_OT_bake_point_cache(bpy.types.Operator):
+    bl_idname = "aht_frill.bake_point_cache"
+    bl_label = "Bake Cache"
+
+    # execute
+    def execute(self, context):
+        scene = context.scene
+        curves = [obj for obj in context.selected_objects if obj.type == 'CURVE' and AFT_CACHE_NAME not in obj]
+        if len(curves) == 0:
+            self.report({'ERROR'}, "ベイクするCurveを選択してください")
+            return{'FINISHED'}
+
+        frame_current = scene.frame_current
+        frame_start = scene.frame_start
+        frames = range(frame_start, scene.frame_end + 1)
+
+        # 書き込み先のファイルを直接memmapで開いておく(長いショットでもメモリに載せない)
+        invalidate_cached_curves()
+        arrays = []
+        for curve in curves:
+            filepath = get_cache_filepath(scene, curve)
+            os.makedirs(os.path.dirname(filepath), exist_ok=True)
+            num = sum(len(spline.points) for spline_no, spline in get_point_splines(curve.data))
+            arrays.append(np.lib.format.open_memmap(filepath, mode='w+', dtype=np.float32, shape=(len(frames), num, 4)))
+
+        # 全Curveまとめて1回ずつフレームを進める
+        for no, frame in enumerate(frames):
+            scene.frame_set(frame)
+            depsgraph = context.evaluated_depsgraph_get()
+            for curve, array in zip(curves, arrays):
+                point_co, point_tilt = read_deformed_curve_points(curve, depsgraph)
+                array[no, :, :3] = point_co[:, :3]
+                array[no, :, 3] = point_tilt
+
+        scene.frame_set(frame_current)
+
+        for curve, array in zip(curves, arrays):
+            array.flush()
+            AHT_FRILL_OT_bake_point_cache.bake(curve, array.filename, frame_start)
+        del arrays
+
+        invalidate_cached_curves()
+        point_cache_frame_change_pre(scene)
+        return{'FINISHED'}
+
+    @classmethod
+    def bake(cls, curve, filepath, frame_start):
+        # Unbake用に元のポイントを保存しておく
+        rest_co, rest_tilt = read_curve_points(curve.data)
+
+        curve[AFT_CACHE_NAME] = {
+            "filepath": filepath,
+            "frame_start": frame_start,
+            "rest_co": rest_co.ravel().tolist(),
+            "rest_tilt": rest_tilt.tolist(),
+            "evaluation": set_curve_evaluation(curve, False),
+        }
+
+
+# Unbakeボタン
+# *************************************************************************************************
+class AHT_FRILL_OT_unbake_point_cache(bpy.types.Operator):
+    bl_idname = "aht_frill.unbake_point_cache"
+    bl_label = "Unbake"
+
+    # execute
+    def execute(self, context):
+        for obj in context.selected_objects:
+            if obj.type == 'CURVE' and AFT_CACHE_NAME in obj:
+                AHT_FRILL_OT_unbake_point_cache.unbake(obj)
+        invalidate_cached_curves()
+        return{'FINISHED'}
+
+    @classmethod
+    def unbake(cls, curve):
+        meta = curve[AFT_CACHE_NAME]
+
+        # 元のポイントに戻す
+        if len(meta["rest_tilt"]) == sum(len(spline.points) for spline_no, spline in get_point_splines(curve.data)):
+            write_curve_points(curve.data, np.array(meta["rest_co"], dtype=np.float32).reshape(-1, 4), np.array(meta["rest_tilt"], dtype=np.float32))
+            curve.data.update_tag()
+
+        state = meta.get("evaluation")
+        if state == None:
+            state = {"constraints": meta["muted_constraints"]}  # 前のバージョンで作ったキャッシュ
+        set_curve_evaluation(curve, True, state)
+        del curve[AFT_CACHE_NAME]
+
+
+# UI
+# =================================================================================================
+class AHT_FRILL_PT_point_cache(bpy.types.Panel):
+    bl_label = "Point Cache"
+    bl_parent_id = "APT_FRILL_PT_UI"
+    bl_space_type = "VIEW_3D"
+    bl_region_type = "UI"
+    bl_category = "AHT"
+    bl_options = {'DEFAULT_CLOSED'}
+
+    def draw(self, context):
+        layout = self.layout
+        layout.prop(context.scene, "aft_cache_dir")
+
+        box = layout.box()
+        active = context.view_layer.objects.active
+        if active == None or active.type != "CURVE" or context.mode != "OBJECT":  # Curve選択時のみ
+            box.enabled = False
+        row = box.row()
+        row.operator("aht_frill.bake_point_cache")
+        row.operator("aht_frill.unbake_point_cache")
+
+
+# 設定用データ
+# =================================================================================================
+def register():
+    bpy.types.Scene.aft_cache_dir = bpy.props.StringProperty(name="Directory", description="ポイントキャッシュの保存先", default="//aft_cache/", subtype='DIR_PATH')
+
+    bpy.app.handlers.frame_change_pre.append(point_cache_frame_change_pre)
+    bpy.app.handlers.load_post.append(point_cache_load_post)
+
+def unregister():
+    bpy.app.handlers.frame_change_pre.remove(point_cache_frame_change_pre)
+    bpy.app.handlers.load_post.remove(point_cache_load_post)
+
+    del bpy.types.Scene.aft_cache_dir
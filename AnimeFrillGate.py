@@ -0,0 +1,305 @@
+import bpy
+import numpy as np
+from bpy.app.handlers import persistent
+
+from .AnimeFrillTools import (
+    AFT_CACHE_NAME, AFT_REGISTRY_EMPTIES, AFT_EMPTY_ARMATURE_NAME, frozen_curve_names, read_curve_points, read_deformed_curve_points, write_curve_points,
+)
+from .AnimeFrillCache import set_curve_evaluation
+
+
+# 評価の間引き(ゲート)
+# *************************************************************************************************
+# 再生中、カメラに映っていない/遠い/動かしているボーンが止まっているリグを凍結する
+# 凍結中は最後に評価されたポイントをCurveに直接書き込んで、Hook/ドライバ/コンストレイントを止める
+# レンダリング、保存、Undoの前と、再生していない時は全部元に戻す
+# (自動保存ではハンドラが呼ばれないので、再生中の自動保存には凍結中のポイントと止めたHookが残ることがある)
+
+# 凍結中のリグ(Curve名 → (元のポイント座標, 元のTilt, 止める前の評価の状態(set_curve_evaluation)))
+frozen_rigs = {}
+
+# 動かしているボーンの前フレームの行列(Curve名 → 配列)と、ボーンの一覧(Curve名 → {Armature名: [ボーン名]})
+driver_signatures = {}
+rig_driving_bones = {}
+
+# ゲート対象のCurve名一覧(Noneの時は次に使う時に作り直す)
+gate_curve_names = None
+gate_object_count = 0
+
+gate_rendering = False
+
+
+def invalidate_gate_curves(self=None, context=None):
+    global gate_curve_names
+    gate_curve_names = None
+    driver_signatures.clear()
+    rig_driving_bones.clear()
+
+
+def get_gate_curves(scene):
+    global gate_curve_names, gate_object_count
+
+    # オブジェクトの数が変わった時(Create/Removeなど)も作り直す
+    if gate_curve_names == None or gate_object_count != len(scene.objects):
+        gate_curve_names = [obj.name for obj in scene.objects if obj.type == 'CURVE' and obj.get(AFT_REGISTRY_EMPTIES)]
+        gate_object_count = len(scene.objects)
+
+    curves = []
+    for name in gate_curve_names:
+        curve = scene.objects.get(name)
+        if curve == None or not curve.get(AFT_REGISTRY_EMPTIES):
+            invalidate_gate_curves()  # 名前変更や削除があった
+            continue
+        if AFT_CACHE_NAME in curve:  # キャッシュ再生中のCurveは対象外
+            continue
+        curves.append(curve)
+    return curves
+
+
+# 全リグのバウンディングボックスをまとめて判定する
+# corners: (リグ数, 8, 3) ワールド座標 / view_proj: カメラのビュー x 射影行列(なければNone)
+# 戻り値はリグごとの「評価が必要か」
+def test_rig_bounds(corners, view_proj, camera_pos, margin, max_distance):
+    active = np.ones(len(corners), dtype=bool)
+    if len(corners) == 0:
+        return active
+
+    # 視錐台: 8頂点すべてが同じ面の外側にあれば映っていない
+    if view_proj is not None:
+        clip = np.concatenate([corners, np.ones(corners.shape[:2] + (1,))], axis=2) @ view_proj.T
+        w = clip[:, :, 3:4] * (1 + margin)
+        outside = np.any(np.all(clip[:, :, :3] < -w, axis=1) | np.all(clip[:, :, :3] > w, axis=1), axis=1)
+        active &= ~outside
+
+    # 距離: バウンディング球の一番近いところが指定距離より遠い
+    if max_distance > 0 and camera_pos is not None:
+        center = corners.mean(axis=1)
+        radius = np.linalg.norm(corners - center[:, None, :], axis=2).max(axis=1)
+        active &= np.linalg.norm(center - camera_pos, axis=1) - radius <= max_distance
+
+    return active
+
+
+# Curveのバウンディングボックス(8頂点)をワールド座標でまとめて取得する
+def get_rig_corners(curves, depsgraph):
+    if len(curves) == 0:
+        return np.zeros((0, 8, 3))
+    evaluated = [curve.evaluated_get(depsgraph) for curve in curves]
+    local = np.array([obj.bound_box for obj in evaluated], dtype=np.float64).reshape(-1, 8, 3)
+    world = np.array([obj.matrix_world for obj in evaluated], dtype=np.float64).reshape(-1, 4, 4)
+    return np.einsum("rij,rkj->rki", world[:, :3, :3], local) + world[:, None, :3, 3]
+
+
+# シーンカメラのビュー x 射影行列と位置
+def get_camera_view_proj(scene, depsgraph):
+    camera = scene.camera
+    if camera == None:
+        return (None, None)
+    camera = camera.evaluated_get(depsgraph)
+    render = scene.render
+    projection = camera.calc_matrix_camera(depsgraph, x=render.resolution_x, y=render.resolution_y, scale_x=render.pixel_aspect_x, scale_y=render.pixel_aspect_y)
+    view_proj = np.array(projection @ camera.matrix_world.inverted(), dtype=np.float64)
+    return (view_proj, np.array(camera.matrix_world.translation, dtype=np.float64))
+
+
+# リグを動かしているボーン(EmptyのArmatureコンストレイントのターゲット)の一覧({Armature名: [ボーン名]})
+def get_rig_driving_bones(curve):
+    bones = rig_driving_bones.get(curve.name)
+    if bones == None:
+        bones = {}
+        for empty in curve[AFT_REGISTRY_EMPTIES].values():
+            if empty == None:
+                continue
+            for constraint in empty.constraints:
+                if not constraint.name.startswith(AFT_EMPTY_ARMATURE_NAME):
+                    continue
+                for target in constraint.targets:
+                    if target.target != None and target.subtarget not in bones.setdefault(target.target.name, []):
+                        bones[target.target.name].append(target.subtarget)
+        rig_driving_bones[curve.name] = bones
+    return bones
+
+
+# 動かしているボーン、Curve、Emptyの行列が、前のフレームから変わっていなければTrue
+# Emptyはキーやジグルで動くので、コンストレイントを掛ける前の行列(matrix_basis)を見る
+# (凍結中はArmatureコンストレイントを止めるので、matrix_worldだと凍結するたびに変わってしまう。ボーンの分は下で見る)
+def is_rig_still(curve, depsgraph):
+    matrices = [curve.evaluated_get(depsgraph).matrix_world]
+    matrices.extend(empty.evaluated_get(depsgraph).matrix_basis for empty in curve[AFT_REGISTRY_EMPTIES].values() if empty != None)
+    for name, bone_names in get_rig_driving_bones(curve).items():
+        armature = bpy.data.objects.get(name)
+        if armature == None or armature.pose == None:
+            continue
+        armature = armature.evaluated_get(depsgraph)
+        matrices.append(armature.matrix_world)
+        for bone_name in bone_names:
+            bone = armature.pose.bones.get(bone_name)
+            if bone != None:
+                matrices.append(bone.matrix)
+
+    signature = np.array(matrices, dtype=np.float32)
+    previous = driver_signatures.get(curve.name)
+    driver_signatures[curve.name] = signature
+    return previous is not None and np.array_equal(previous, signature)
+
+
+# 凍結: 今のHook/Armatureで変形したポイントをCurveに書き込んでから評価を止める
+def freeze_rig(curve, depsgraph):
+    rest_co, rest_tilt = read_curve_points(curve.data)
+    point_co, point_tilt = read_deformed_curve_points(curve, depsgraph)
+    if len(point_co) != len(rest_co):
+        return
+
+    point_co[:, 3] = rest_co[:, 3]
+    evaluation = set_curve_evaluation(curve, False)
+    write_curve_points(curve.data, point_co, point_tilt)
+    curve.data.update_tag()
+    frozen_rigs[curve.name] = (rest_co, rest_tilt, evaluation)
+    frozen_curve_names.add(curve.name)
+
+
+# 凍結解除: 元のポイントに戻して評価を再開する
+def thaw_rig(curve):
+    rest_co, rest_tilt, evaluation = frozen_rigs.pop(curve.name)
+    frozen_curve_names.discard(curve.name)
+    write_curve_points(curve.data, rest_co, rest_tilt)
+    curve.data.update_tag()
+    set_curve_evaluation(curve, True, evaluation)
+
+
+def thaw_all_rigs(scene=None):
+    for name in list(frozen_rigs.keys()):
+        curve = bpy.data.objects.get(name)
+        if curve == None:
+            del frozen_rigs[name]  # 凍結中に削除された
+            frozen_curve_names.discard(name)
+            continue
+        thaw_rig(curve)
+
+
+# 1フレーム分のゲート処理
+def update_rig_gates(scene, depsgraph):
+    curves = get_gate_curves(scene)
+
+    # 視錐台と距離の判定は全リグまとめて1回
+    view_proj, camera_pos = (None, None)
+    if scene.aft_gate_frustum or scene.aft_gate_distance > 0:
+        view_proj, camera_pos = get_camera_view_proj(scene, depsgraph)
+    if not scene.aft_gate_frustum:
+        view_proj = None
+    active = test_rig_bounds(get_rig_corners(curves, depsgraph), view_proj, camera_pos, scene.aft_gate_margin, scene.aft_gate_distance)
+
+    for curve, is_active in zip(curves, active.tolist()):
+        # 映っていても、動かしているボーンが止まっていれば凍結
+        if is_active and scene.aft_gate_still:
+            is_active = not is_rig_still(curve, depsgraph)
+
+        if is_active and curve.name in frozen_rigs:
+            thaw_rig(curve)
+        elif not is_active and curve.name not in frozen_rigs:
+            freeze_rig(curve, depsgraph)
+
+
+@persistent
+def gate_frame_change_post(scene, depsgraph):
+    # 再生中以外(コマ送り、編集、バックグラウンド)は凍結しない
+    screen = bpy.context.screen
+    playing = screen != None and screen.is_animation_playing
+    if not scene.aft_gate_enabled or not playing or gate_rendering:
+        if frozen_rigs:
+            thaw_all_rigs()
+        invalidate_gate_curves()  # 再生していない間に編集されたかもしれない
+        return
+    update_rig_gates(scene, depsgraph)
+
+
+@persistent
+def gate_render_init(scene, depsgraph=None):
+    global gate_rendering
+    gate_rendering = True
+    thaw_all_rigs()
+
+
+@persistent
+def gate_render_end(scene, depsgraph=None):
+    global gate_rendering
+    gate_rendering = False
+
+
+# 保存とUndoの前は元のポイントに戻しておく(凍結中の値をファイルやUndo履歴に残さない)
+@persistent
+def gate_thaw_pre(scene, depsgraph=None):
+    thaw_all_rigs()
+
+
+@persistent
+def gate_load_pre(dummy, depsgraph=None):
+    frozen_rigs.clear()
+    frozen_curve_names.clear()
+    invalidate_gate_curves()
+
+
+def update_gate_enabled(self, context):
+    invalidate_gate_curves()
+    if not self.aft_gate_enabled:
+        thaw_all_rigs()
+
+
+# UI
+# =================================================================================================
+class AHT_FRILL_PT_gate(bpy.types.Panel):
+    bl_label = "Evaluation Gate"
+    bl_parent_id = "APT_FRILL_PT_UI"
+    bl_space_type = "VIEW_3D"
+    bl_region_type = "UI"
+    bl_category = "AHT"
+    bl_options = {'DEFAULT_CLOSED'}
+
+    def draw(self, context):
+        layout = self.layout
+        scene = context.scene
+        layout.prop(scene, "aft_gate_enabled")
+
+        box = layout.box()
+        box.enabled = scene.aft_gate_enabled
+        row = box.row()
+        row.prop(scene, "aft_gate_frustum")
+        row.prop(scene, "aft_gate_margin")
+        box.prop(scene, "aft_gate_distance")
+        box.prop(scene, "aft_gate_still")
+        box.label(text="Frozen: %d" % len(frozen_rigs))
+
+
+# 設定用データ
+# =================================================================================================
+def register():
+    bpy.types.Scene.aft_gate_enabled = bpy.props.BoolProperty(name="Gate", description="再生中、評価しなくてよいリグを凍結する(保存とUndoの前には戻すが、再生中の自動保存には凍結中のポイントが残ることがある)", default=False, update=update_gate_enabled)
+    bpy.types.Scene.aft_gate_frustum = bpy.props.BoolProperty(name="Camera", description="シーンカメラに映っていないリグを凍結する", default=True)
+    bpy.types.Scene.aft_gate_margin = bpy.props.FloatProperty(name="Margin", description="画面外と判定する余白(画面の大きさに対する割合)", default=0.1, min=0)
+    bpy.types.Scene.aft_gate_distance = bpy.props.FloatProperty(name="Distance", description="カメラからこれより遠いリグを凍結する(0なら判定しない)", default=0, min=0, subtype='DISTANCE')
+    bpy.types.Scene.aft_gate_still = bpy.props.BoolProperty(name="Still Bones", description="動かしているボーンが前のフレームから変わっていないリグを凍結する", default=False)
+
+    bpy.app.handlers.frame_change_post.append(gate_frame_change_post)
+    bpy.app.handlers.render_init.append(gate_render_init)
+    bpy.app.handlers.render_complete.append(gate_render_end)
+    bpy.app.handlers.render_cancel.append(gate_render_end)
+    bpy.app.handlers.save_pre.append(gate_thaw_pre)
+    bpy.app.handlers.undo_pre.append(gate_thaw_pre)
+    bpy.app.handlers.load_pre.append(gate_load_pre)
+
+def unregister():
+    thaw_all_rigs()
+
+    bpy.app.handlers.frame_change_post.remove(gate_frame_change_post)
+    bpy.app.handlers.render_init.remove(gate_render_init)
+    bpy.app.handlers.render_complete.remove(gate_render_end)
+    bpy.app.handlers.render_cancel.remove(gate_render_end)
+    bpy.app.handlers.save_pre.remove(gate_thaw_pre)
+    bpy.app.handlers.undo_pre.remove(gate_thaw_pre)
+    bpy.app.handlers.load_pre.remove(gate_load_pre)
+
+    del bpy.types.Scene.aft_gate_still
+    del bpy.types.Scene.aft_gate_distance
+    del bpy.types.Scene.aft_gate_margin
+    del bpy.types.Scene.aft_gate_frustum
+    del bpy.types.Scene.aft_gate_enabled
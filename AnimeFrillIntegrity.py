@@ -0,0 +1,280 @@
+import bpy, re, time
+from bpy.app.handlers import persistent
+
+from .AnimeFrillTools import (
+    AFT_EMPTY_HOOK_NAME, AFT_BONES_NAME, AFT_REGISTRY_EMPTIES, AFT_REGISTRY_HOOKS, AFT_REGISTRY_BONES,
+    get_curve_point_layout, is_control_empties_registry_valid, register_control_empties, invalidate_tilt_sync_curves,
+)
+
+
+# 整合性チェック
+# *************************************************************************************************
+# 手でEmptyを消したりCurveを複製したりして壊れたAFTのデータを、シーン全体から探してまとめて直す
+# オブジェクト、モディファイア、ドライバをそれぞれ1回ずつ見て、名前をキーにした辞書で突き合わせる(ループを入れ子にしない)
+
+# 問題の種類と説明
+INTEGRITY_ISSUES = {
+    "orphan_hook": "対象のEmptyがなくなったHook",
+    "foreign_hook": "別のCurveのEmptyを使っているHook",
+    "broken_driver": "対象のEmptyがなくなったTiltドライバ",
+    "foreign_driver": "別のCurveのEmptyを使っているTiltドライバ",
+    "wrong_target": "親と違うCurveを対象にしているEmpty",
+    "orphan_empty": "対象のCurveがなくなったEmpty",
+    "duplicate_empty": "同じポイントに重複しているEmpty",
+    "stale_registry": "シーンと一致しない登録情報",
+}
+
+TILT_PATH = re.compile(r"splines\[(\d+)\]\.points\[(\d+)\]\.tilt$")
+
+
+# シーン全体を走査して問題の一覧を返す
+# 問題は (種類, Curve名, 対象の名前, ポイント番号) で、ドライバのポイント番号は [(変数名, ポイント番号)] (分からない時は-1)
+# 直す時に使うので、Curveごとの正しいEmpty({(Curve名, ポイント番号): Empty})も一緒に返す
+def scan_scene_integrity(scene):
+    objects = {}
+    curves = []
+    armatures = {}
+    candidates = []
+    issues = []
+
+    # オブジェクトは1回だけ見る
+    for obj in scene.objects:
+        objects[obj.name] = obj
+        if obj.type == 'CURVE':
+            curves.append(obj)
+        elif obj.type == 'EMPTY':
+            point_no = obj.get("AFT_point_no")
+            if point_no != None:
+                candidates.append((obj, obj.get("AFT_target_curve"), point_no))
+        elif obj.type == 'ARMATURE':
+            target = obj.get("AFT_target_curve")
+            if target != None:
+                armatures[target.name] = obj
+    curve_names = {curve.name: curve for curve in curves}
+
+    # Emptyを(Curve名, ポイント番号)で引けるようにする
+    # 複製したCurveの子なのに複製元を対象にしているEmptyは、親のCurveのものとして扱う
+    control_empties = {}
+    owners = {}  # Empty名 → Curve名
+    for empty, target, point_no in candidates:
+        parent = empty.parent
+        if parent != None and parent.type == 'CURVE' and parent.name in curve_names and target != parent:
+            issues.append(("wrong_target", parent.name, empty.name, point_no))
+            target = parent
+        elif target == None or curve_names.get(target.name) != target:
+            issues.append(("orphan_empty", "", empty.name, point_no))
+            continue
+
+        # 同じポイントに2つある時は、Curveに登録されている方を残す
+        key = (target.name, point_no)
+        other = control_empties.get(key)
+        if other != None:
+            registry = target.get(AFT_REGISTRY_EMPTIES) or {}
+            if empty.name in registry and other.name not in registry:
+                empty, other = other, empty
+            issues.append(("duplicate_empty", target.name, empty.name, point_no))
+            owners.pop(empty.name, None)
+            empty = other
+        control_empties[key] = empty
+        owners[empty.name] = target.name
+
+    # Curveごとにモディファイアとドライバを1回ずつ見る
+    aft_curve_names = {target_name for target_name, point_no in control_empties.keys()}
+    for curve in curves:
+        hooks = [mod for mod in curve.modifiers if mod.type == 'HOOK' and mod.name.startswith(AFT_EMPTY_HOOK_NAME)]
+        # データを共有している(リンク複製した)Curveのドライバは、どちらのEmptyにつなぐか決められないので見ない
+        drivers = []
+        if curve.data.animation_data and curve.data.users == 1:
+            drivers = [driver for driver in curve.data.animation_data.drivers if TILT_PATH.match(driver.data_path)]
+        registered = AFT_REGISTRY_EMPTIES in curve
+        if not registered and not hooks and not drivers and curve.name not in aft_curve_names:
+            continue  # AFTを使っていないCurve
+
+        registry_hooks = curve.get(AFT_REGISTRY_HOOKS) or {}
+        for hook in hooks:
+            empty = hook.object
+            if empty == None or objects.get(empty.name) != empty:
+                issues.append(("orphan_hook", curve.name, hook.name, registry_hooks.get(hook.name, -1)))
+            elif owners.get(empty.name) != curve.name:
+                issues.append(("foreign_hook", curve.name, hook.name, empty.get("AFT_point_no", -1)))
+
+        # ドライバのパスからポイント番号を引く表は、ドライバがある時だけ作る
+        path_point_nos = None
+        for driver in drivers:
+            bad = []
+            broken = False
+            for var in driver.driver.variables:
+                empty = var.targets[0].id
+                if empty == None or objects.get(empty.name) != empty:
+                    broken = True
+                    bad.append((var.name, -1))
+                elif owners.get(empty.name) != curve.name:
+                    bad.append((var.name, empty.get("AFT_point_no", -1)))
+            if not bad:
+                continue
+
+            # 1つしか変数がないドライバ(LODでない)は、パスのポイントのEmptyにつなぎ直せる
+            if path_point_nos == None:
+                spline_nos, local_nos = get_curve_point_layout(curve.data)[:2]
+                path_point_nos = {(spline_no, local_no): no for no, (spline_no, local_no) in enumerate(zip(spline_nos.tolist(), local_nos.tolist()))}
+            if len(driver.driver.variables) == 1:
+                match = TILT_PATH.match(driver.data_path)
+                bad = [(bad[0][0], path_point_nos.get((int(match.group(1)), int(match.group(2))), -1))]
+            issues.append(("broken_driver" if broken else "foreign_driver", curve.name, driver.data_path, bad))
+
+        if registered and not is_control_empties_registry_valid(curve):
+            issues.append(("stale_registry", curve.name, curve.name, -1))
+
+    return (issues, control_empties, armatures)
+
+
+# 見つかった問題をまとめて直す
+# Hookとドライバは同じCurveの同じポイントのEmptyがあればつなぎ直し、なければ削除する
+# 最後に問題のあったCurveの登録情報を作り直す(Curveごとにシーンを走査しないように、走査結果から作る)
+def repair_scene_integrity(scene, issues, control_empties, armatures):
+    objects = scene.objects
+    remove_objects = []
+    touched = set()
+
+    for kind, curve_name, name, point_no in issues:
+        curve = objects.get(curve_name)
+        touched.add(curve_name)
+
+        if kind == "wrong_target":
+            objects[name]["AFT_target_curve"] = curve
+
+        elif kind in ("orphan_empty", "duplicate_empty"):
+            remove_objects.append(objects[name])
+
+        elif kind in ("orphan_hook", "foreign_hook"):
+            hook = curve.modifiers[name]
+            empty = control_empties.get((curve_name, point_no))
+            if empty != None:
+                hook.object = empty
+            else:
+                curve.modifiers.remove(hook)
+
+        elif kind in ("broken_driver", "foreign_driver"):
+            drivers = curve.data.animation_data.drivers
+            driver = drivers.find(name)
+            targets = [control_empties.get((curve_name, var_point_no)) for var_name, var_point_no in point_no]
+            if None in targets:
+                drivers.remove(driver)
+                continue
+            variables = driver.driver.variables
+            for (var_name, var_point_no), empty in zip(point_no, targets):
+                variables[var_name].targets[0].id = empty
+
+    # 削除はまとめて1回で
+    if remove_objects:
+        bpy.data.batch_remove(remove_objects)
+
+    # 登録情報はポイント番号順のEmptyと、残ったHookから作り直す
+    curve_empties = {}
+    for (curve_name, point_no), empty in control_empties.items():
+        if curve_name in touched:
+            curve_empties.setdefault(curve_name, []).append((point_no, empty))
+    for curve_name in touched:
+        curve = objects.get(curve_name)
+        if curve == None:
+            continue
+        empties = [empty for point_no, empty in sorted(curve_empties.get(curve_name, []), key=lambda item: item[0])]
+        hooks = [mod for mod in curve.modifiers if mod.name.startswith((AFT_EMPTY_HOOK_NAME, AFT_BONES_NAME))]
+        hooks.sort(key=lambda hook: hook.object.get("AFT_point_no", -1) if hook.type == 'HOOK' and hook.object else -1)
+        armature = armatures.get(curve_name) if AFT_REGISTRY_BONES in curve else None
+        register_control_empties(curve, empties, hooks, armature)
+
+    invalidate_tilt_sync_curves()
+    return len(issues)
+
+
+# 種類ごとの件数と、先頭から何件かの問題(レポート用)
+def summarize_integrity_issues(issues, limit=100):
+    counts = {}
+    for issue in issues:
+        counts[issue[0]] = counts.get(issue[0], 0) + 1
+    return {"counts": counts, "items": [list(issue) for issue in issues[:limit]]}
+
+
+# 走査して、fixなら直してもう一度走査する(オペレータとバッチ処理から使う)
+def check_scene_integrity(scene, fix=False):
+    start = time.perf_counter()
+    issues, control_empties, armatures = scan_scene_integrity(scene)
+    report = summarize_integrity_issues(issues)
+    report["scan"] = time.perf_counter() - start
+
+    if fix and issues:
+        start = time.perf_counter()
+        report["fixed"] = repair_scene_integrity(scene, issues, control_empties, armatures)
+        report["remaining"] = summarize_integrity_issues(scan_scene_integrity(scene)[0])["counts"]
+        report["repair"] = time.perf_counter() - start
+    return report
+
+
+# 最後のチェック結果(パネル表示用)
+integrity_report = None
+
+
+@persistent
+def integrity_load_post(dummy):
+    global integrity_report
+    integrity_report = None
+
+
+# チェック/修復ボタン
+# *************************************************************************************************
+class AHT_FRILL_OT_check_integrity(bpy.types.Operator):
+    bl_idname = "aht_frill.check_integrity"
+    bl_label = "Check"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    fix: bpy.props.BoolProperty(name="Fix", description="見つかった問題を直す", default=False)
+
+    # execute
+    def execute(self, context):
+        global integrity_report
+        integrity_report = check_scene_integrity(context.scene, self.fix)
+
+        total = sum(integrity_report["counts"].values())
+        if self.fix and total:
+            self.report({'INFO'}, "%d件の問題を修復しました(残り%d件)" % (total, sum(integrity_report["remaining"].values())))
+        else:
+            self.report({'INFO'}, "%d件の問題が見つかりました" % total)
+        return{'FINISHED'}
+
+
+# UI
+# =================================================================================================
+class AHT_FRILL_PT_integrity(bpy.types.Panel):
+    bl_label = "Integrity"
+    bl_parent_id = "APT_FRILL_PT_UI"
+    bl_space_type = "VIEW_3D"
+    bl_region_type = "UI"
+    bl_category = "AHT"
+    bl_options = {'DEFAULT_CLOSED'}
+
+    def draw(self, context):
+        layout = self.layout
+        row = layout.row()
+        row.enabled = context.mode == "OBJECT"
+        row.operator("aht_frill.check_integrity", text="Check").fix = False
+        row.operator("aht_frill.check_integrity", text="Fix").fix = True
+
+        if integrity_report != None:
+            box = layout.box()
+            counts = integrity_report.get("remaining", integrity_report["counts"])
+            if not counts:
+                box.label(text="問題なし (%.2f ms)" % (integrity_report["scan"] * 1000))
+            for kind, count in sorted(counts.items()):
+                row = box.row()
+                row.label(text=INTEGRITY_ISSUES[kind])
+                row.label(text=str(count))
+
+
+# 設定用データ
+# =================================================================================================
+def register():
+    bpy.app.handlers.load_post.append(integrity_load_post)
+
+def unregister():
+    bpy.app.handlers.load_post.remove(integrity_load_post)
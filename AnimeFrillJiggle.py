@@ -0,0 +1,349 @@
+import bpy, math
+import numpy as np
+from bpy.app.handlers import persistent
+
+from .AnimeFrillTools import AFT_REGISTRY_EMPTIES, AFT_REST_POSE, get_curve_point_layout, get_control_pose
+from .AnimeFrillKeying import KEY_CHANNELS, write_keyframes
+
+
+# 揺れ(スプリング/ダンパ)ソルバ
+# *************************************************************************************************
+# Curveのスプラインごとに、Emptyをポイント番号順に並べたチェーンとして扱う
+# 全CurveのEmptyを1つの配列にまとめて、全チェーンを同時にNumPyで計算する
+class FrillJiggleChains:
+    def __init__(self, curves):
+        self.curve_names = []
+        self.empties = []
+        org_pos = []
+        org_tilt = []
+        edges = []
+
+        for curve in curves:
+            registered = curve.get(AFT_REGISTRY_EMPTIES)
+            if not registered:
+                continue
+
+            # ポイント番号順に並べる
+            chain = [empty for empty in registered.values() if empty != None and empty.get("AFT_point_no") != None]
+            chain.sort(key=lambda empty: empty["AFT_point_no"])
+            if len(chain) == 0:
+                continue
+
+            # スプラインごとに、となり同士をバネでつなぐ(閉じたスプラインなら最後と最初もつなぐ)
+            spline_nos = get_curve_point_layout(curve.data)[0]
+            chain_splines = [int(spline_nos[empty["AFT_point_no"]]) if empty["AFT_point_no"] < len(spline_nos) else -1 for empty in chain]
+            offset = len(self.empties)
+            start = 0
+            for no in range(1, len(chain) + 1):
+                if no < len(chain) and chain_splines[no] == chain_splines[start]:
+                    continue
+                for i in range(start, no - 1):
+                    edges.append((offset + i, offset + i + 1))
+                if chain_splines[start] >= 0 and curve.data.splines[chain_splines[start]].use_cyclic_u and no - start > 2:
+                    edges.append((offset + no - 1, offset + start))
+                start = no
+
+            # restはCurveに保存したレストポーズ(なければ今の位置)
+            rest_pose = get_control_pose(curve, AFT_REST_POSE)
+            for empty in chain:
+                point_no = empty["AFT_point_no"]
+                if rest_pose is not None and point_no < len(rest_pose):
+                    org_pos.append(rest_pose[point_no, :3].tolist())
+                    org_tilt.append(float(rest_pose[point_no, 3]))
+                else:
+                    org_pos.append(list(empty.location))
+                    org_tilt.append(empty.rotation_euler[2])
+
+            self.curve_names.append(curve.name)
+            self.empties.extend(chain)
+
+        self.org_pos = np.array(org_pos, dtype=np.float64).reshape(-1, 3)
+        self.org_tilt = np.array(org_tilt, dtype=np.float64)
+        self.edges = np.array(edges, dtype=np.int64).reshape(-1, 2)
+
+        # 状態はreset()で初期化する
+        self.pos = None
+        self.vel = None
+        self.rest_length = None
+        self.frame = None
+        self.twist = 0
+
+    def __len__(self):
+        return len(self.empties)
+
+    # Emptyの評価済み行列から、rest(レストポーズ)の時のワールド座標を求める
+    # world = A @ basis なので、A = world @ basis^-1 として basisだけrestに差し替える
+    def read_rest(self, depsgraph):
+        world = np.array([empty.evaluated_get(depsgraph).matrix_world for empty in self.empties], dtype=np.float64).reshape(-1, 4, 4)
+        basis = np.array([empty.matrix_basis for empty in self.empties], dtype=np.float64).reshape(-1, 4, 4)
+        self.parent_mat = world @ np.linalg.inv(basis)
+        return np.einsum("nij,nj->ni", self.parent_mat[:, :3, :3], self.org_pos) + self.parent_mat[:, :3, 3]
+
+    # restの位置・静止状態から始める
+    def reset(self, rest, frame):
+        self.pos = rest.copy()
+        self.vel = np.zeros_like(rest)
+        if len(self.edges) > 0:
+            self.rest_length = np.linalg.norm(rest[self.edges[:, 1]] - rest[self.edges[:, 0]], axis=1)
+        else:
+            self.rest_length = np.zeros(0)
+        self.frame = frame
+
+    # 1フレーム進める
+    def step(self, rest, frame, settings, dt):
+        step_jiggle(self.pos, self.vel, rest, self.edges, self.rest_length, settings, dt)
+        self.frame = frame
+
+    # 計算結果をEmptyのlocationとrotation_euler[2]に戻す
+    def result(self, rest):
+        # チェーン方向の移動量をねじれ(Tilt)にする
+        tangent = np.zeros_like(rest)
+        if len(self.edges) > 0:
+            chord = rest[self.edges[:, 1]] - rest[self.edges[:, 0]]
+            np.add.at(tangent, self.edges[:, 0], chord)
+            np.add.at(tangent, self.edges[:, 1], chord)
+        tangent /= np.maximum(np.linalg.norm(tangent, axis=1, keepdims=True), 1e-12)
+
+        location = np.einsum("nij,nj->ni", np.linalg.inv(self.parent_mat)[:, :3, :], np.concatenate([self.pos, np.ones((len(self.pos), 1))], axis=1))
+        tilt = self.org_tilt + self.twist * np.einsum("ij,ij->i", self.pos - rest, tangent)
+        return (location, tilt)
+
+    def write(self, location, tilt):
+        for empty, loc, rot in zip(self.empties, location.tolist(), tilt.tolist()):
+            empty.location = loc
+            empty.rotation_euler[2] = rot
+
+
+# 揺れの計算本体(bpyは使わない)
+# pos, velは全チェーンの全ポイントの配列で、その場で更新する
+def step_jiggle(pos, vel, rest, edges, rest_length, settings, dt):
+    substeps = max(1, settings["substeps"])
+    h = dt / substeps
+    damping = math.exp(-settings["damping"] * h)
+    gravity = np.asarray(settings["gravity"], dtype=np.float64)
+    collider = settings.get("collider")
+
+    for _ in range(substeps):
+        # restに戻ろうとする力と重力
+        force = settings["stiffness"] * (rest - pos) + gravity
+
+        # となりのポイントとの距離を保とうとする力
+        if len(edges) > 0:
+            delta = pos[edges[:, 1]] - pos[edges[:, 0]]
+            length = np.linalg.norm(delta, axis=1)
+            link = (settings["link_stiffness"] * (length - rest_length) / np.maximum(length, 1e-12))[:, None] * delta
+            np.add.at(force, edges[:, 0], link)
+            np.add.at(force, edges[:, 1], -link)
+
+        vel += force * h
+        vel *= damping
+        pos += vel * h
+
+        # 体の球に入り込んだら表面に押し出して、めり込む方向の速度を消す
+        if collider != None:
+            center, radius = collider
+            offset = pos - center
+            dist = np.linalg.norm(offset, axis=1)
+            inside = dist < radius
+            if np.any(inside):
+                normal = offset[inside] / np.maximum(dist[inside], 1e-12)[:, None]
+                pos[inside] = center + normal * radius
+                inward = np.minimum(np.einsum("ij,ij->i", vel[inside], normal), 0)
+                vel[inside] -= normal * inward[:, None]
+
+
+# シーンの設定をソルバ用にまとめる
+def get_jiggle_settings(scene):
+    settings = {
+        "stiffness": scene.aft_jiggle_stiffness,
+        "link_stiffness": scene.aft_jiggle_link_stiffness,
+        "damping": scene.aft_jiggle_damping,
+        "gravity": np.array(scene.gravity) * scene.aft_jiggle_gravity,
+        "substeps": scene.aft_jiggle_substeps,
+        "collider": None,
+    }
+
+    collider = scene.aft_jiggle_collider
+    if collider != None:
+        settings["collider"] = (np.array(collider.matrix_world.translation), scene.aft_jiggle_collider_radius * max(collider.matrix_world.to_scale()))
+    return settings
+
+
+# 揺らすCurveの一覧(Noneの時は次に使う時に作り直す)
+jiggle_chains = None
+
+def invalidate_jiggle_chains(self=None, context=None):
+    global jiggle_chains
+    jiggle_chains = None
+
+
+def get_jiggle_chains(scene):
+    global jiggle_chains
+    if jiggle_chains == None:
+        jiggle_chains = FrillJiggleChains([obj for obj in scene.objects if obj.type == 'CURVE' and obj.aft_jiggle])
+    else:
+        # Emptyが作り直されていたら作り直す
+        for empty in jiggle_chains.empties:
+            try:
+                empty.name
+            except ReferenceError:
+                jiggle_chains = FrillJiggleChains([obj for obj in scene.objects if obj.type == 'CURVE' and obj.aft_jiggle])
+                break
+    return jiggle_chains
+
+
+# 1フレーム分揺らす。連続したフレームでなければrestからやり直す
+def run_jiggle_frame(scene, depsgraph, chains):
+    if len(chains) == 0:
+        return None
+
+    frame = scene.frame_current
+    rest = chains.read_rest(depsgraph)
+    chains.twist = scene.aft_jiggle_twist
+    if chains.frame == None or frame != chains.frame + 1:
+        chains.reset(rest, frame)
+    else:
+        fps = scene.render.fps / scene.render.fps_base
+        chains.step(rest, frame, get_jiggle_settings(scene), 1 / fps)
+
+    location, tilt = chains.result(rest)
+    chains.write(location, tilt)
+    return (location, tilt)
+
+
+# ベイク中はハンドラで揺らさない
+jiggle_baking = False
+
+@persistent
+def jiggle_frame_change_post(scene, depsgraph):
+    if jiggle_baking or not scene.aft_jiggle_live:
+        return
+    run_jiggle_frame(scene, depsgraph, get_jiggle_chains(scene))
+
+
+@persistent
+def jiggle_load_post(dummy):
+    invalidate_jiggle_chains()
+
+
+# ベイクボタン
+# *************************************************************************************************
+# 揺れを計算してEmptyのlocationとrotation_euler[2]にキーフレームとして焼き込む
+# シーンのフレーム範囲のキーだけ置き換えて、範囲外のキーやF-Curveの設定は残す
+class AHT_FRILL_OT_bake_jiggle(bpy.types.Operator):
+    bl_idname = "aht_frill.bake_jiggle"
+    bl_label = "Bake"
+
+    # execute
+    def execute(self, context):
+        global jiggle_baking
+
+        scene = context.scene
+        chains = FrillJiggleChains([obj for obj in context.selected_objects if obj.type == 'CURVE'])
+        if len(chains) == 0:
+            self.report({'ERROR'}, "Emptyを作成済みのCurveを選択してください")
+            return{'FINISHED'}
+
+        # 前にベイクしたキーで動くとrestの計算がずれるので、ベイク中はF-Curveをミュートして、restの位置と回転から始める
+        muted = []
+        for no, empty in enumerate(chains.empties):
+            if empty.animation_data and empty.animation_data.action:
+                fcurves = empty.animation_data.action.fcurves
+                for data_path, index in KEY_CHANNELS:
+                    fcurve = fcurves.find(data_path, index=index)
+                    if fcurve != None:
+                        muted.append((fcurve, fcurve.mute))
+                        fcurve.mute = True
+            empty.location = chains.org_pos[no]
+            empty.rotation_euler[2] = chains.org_tilt[no]
+
+        frame_current = scene.frame_current
+        frames = list(range(scene.frame_start, scene.frame_end + 1))
+        locations = np.empty((len(frames), len(chains), 3), dtype=np.float32)
+        tilts = np.empty((len(frames), len(chains)), dtype=np.float32)
+
+        jiggle_baking = True
+        try:
+            for no, frame in enumerate(frames):
+                scene.frame_set(frame)
+                locations[no], tilts[no] = run_jiggle_frame(scene, context.evaluated_depsgraph_get(), chains)
+        finally:
+            jiggle_baking = False
+            for fcurve, mute in muted:
+                fcurve.mute = mute
+
+        # Emptyごとにまとめて書き込む
+        for no, empty in enumerate(chains.empties):
+            for index in range(3):
+                write_keyframes(empty, "location", index, frames, locations[:, no, index])
+            write_keyframes(empty, "rotation_euler", 2, frames, tilts[:, no])
+
+        scene.frame_set(frame_current)
+        return{'FINISHED'}
+
+
+# UI
+# =================================================================================================
+class AHT_FRILL_PT_jiggle(bpy.types.Panel):
+    bl_label = "Jiggle"
+    bl_parent_id = "APT_FRILL_PT_UI"
+    bl_space_type = "VIEW_3D"
+    bl_region_type = "UI"
+    bl_category = "AHT"
+    bl_options = {'DEFAULT_CLOSED'}
+
+    def draw(self, context):
+        layout = self.layout
+        scene = context.scene
+
+        active = context.view_layer.objects.active
+        if active != None and active.type == "CURVE":
+            layout.prop(active, "aft_jiggle")
+
+        box = layout.box()
+        box.prop(scene, "aft_jiggle_stiffness")
+        box.prop(scene, "aft_jiggle_link_stiffness")
+        box.prop(scene, "aft_jiggle_damping")
+        box.prop(scene, "aft_jiggle_gravity")
+        box.prop(scene, "aft_jiggle_twist")
+        box.prop(scene, "aft_jiggle_substeps")
+        box.prop(scene, "aft_jiggle_collider")
+        box.prop(scene, "aft_jiggle_collider_radius")
+
+        row = layout.row()
+        row.prop(scene, "aft_jiggle_live")
+        row.operator("aht_frill.bake_jiggle")
+
+
+# 設定用データ
+# =================================================================================================
+def register():
+    bpy.types.Object.aft_jiggle = bpy.props.BoolProperty(name="Jiggle", description="再生中にこのCurveのEmptyを揺らす", default=False, update=invalidate_jiggle_chains)
+
+    bpy.types.Scene.aft_jiggle_live = bpy.props.BoolProperty(name="Live", description="フレーム変更時に揺れを計算する", default=False, update=invalidate_jiggle_chains)
+    bpy.types.Scene.aft_jiggle_stiffness = bpy.props.FloatProperty(name="Stiffness", description="restの位置に戻ろうとする強さ", default=200, min=0)
+    bpy.types.Scene.aft_jiggle_link_stiffness = bpy.props.FloatProperty(name="Link Stiffness", description="となりのポイントとの距離を保とうとする強さ", default=400, min=0)
+    bpy.types.Scene.aft_jiggle_damping = bpy.props.FloatProperty(name="Damping", description="速度の減衰(1秒あたり)", default=5, min=0)
+    bpy.types.Scene.aft_jiggle_gravity = bpy.props.FloatProperty(name="Gravity", description="シーンの重力にかける倍率", default=1, min=0)
+    bpy.types.Scene.aft_jiggle_twist = bpy.props.FloatProperty(name="Twist", description="チェーン方向の移動量をTiltにする倍率", default=0)
+    bpy.types.Scene.aft_jiggle_substeps = bpy.props.IntProperty(name="Substeps", description="1フレームあたりの計算回数", default=4, min=1, max=64)
+    bpy.types.Scene.aft_jiggle_collider = bpy.props.PointerProperty(name="Collider", description="体の当たり判定用の球(オブジェクトの位置とスケール)", type=bpy.types.Object)
+    bpy.types.Scene.aft_jiggle_collider_radius = bpy.props.FloatProperty(name="Radius", description="当たり判定用の球の半径", default=0.1, min=0)
+
+    bpy.app.handlers.frame_change_post.append(jiggle_frame_change_post)
+    bpy.app.handlers.load_post.append(jiggle_load_post)
+
+def unregister():
+    bpy.app.handlers.frame_change_post.remove(jiggle_frame_change_post)
+    bpy.app.handlers.load_post.remove(jiggle_load_post)
+
+    del bpy.types.Scene.aft_jiggle_collider_radius
+    del bpy.types.Scene.aft_jiggle_collider
+    del bpy.types.Scene.aft_jiggle_substeps
+    del bpy.types.Scene.aft_jiggle_twist
+    del bpy.types.Scene.aft_jiggle_gravity
+    del bpy.types.Scene.aft_jiggle_damping
+    del bpy.types.Scene.aft_jiggle_link_stiffness
+    del bpy.types.Scene.aft_jiggle_stiffness
+    del bpy.types.Scene.aft_jiggle_live
+    del bpy.types.Object.aft_jiggle
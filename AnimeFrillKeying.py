@@ -0,0 +1,382 @@
+import bpy, mathutils
+import numpy as np
+
+from .AnimeFrillTools import AFT_REGISTRY_EMPTIES, AFT_EMPTY_ARMATURE_NAME, get_registered_control_empties, group_control_empties
+from .AnimeFrillProfile import profile_phase, profile_count
+
+
+# まとめてキーフレームを打つ
+# *************************************************************************************************
+# AFTのEmptyのlocationとrotation_euler[2]に、1つずつkeyframe_insertせず、F-Curveのキーの配列をforeach_setで書き込む
+# 値は(フレーム数, Emptyの数, 4)の配列で扱う(4 = location x, y, z, rotation z)
+KEY_CHANNELS = (("location", 0), ("location", 1), ("location", 2), ("rotation_euler", 2))
+
+
+# 対象のEmpty(SELECTED: 選択中のCurveと、選択中のEmptyのCurve / SCENE: シーン中の全Curve)
+def get_keying_empties(context, scope):
+    if scope == 'SCENE':
+        curves = [obj for obj in context.scene.objects if obj.type == 'CURVE' and AFT_REGISTRY_EMPTIES in obj]
+    else:
+        curves = [obj for obj in context.selected_objects if obj.type == 'CURVE' and AFT_REGISTRY_EMPTIES in obj]
+        curves += [curve for curve, empties in group_control_empties(context.selected_objects).values()]
+
+    empties = []
+    curve_names = set()
+    for curve in curves:
+        if curve.name in curve_names:
+            continue
+        curve_names.add(curve.name)
+        empties.extend(get_registered_control_empties(context, curve)[0])
+    return empties
+
+
+# Emptyの今の値を(Emptyの数, 4)の配列で取得する
+def read_key_values(empties):
+    return np.array([(*empty.location, empty.rotation_euler[2]) for empty in empties], dtype=np.float32).reshape(-1, 4)
+
+
+# キーの属性(名前, 要素数, 型)。並べ替える時は全部まとめて動かす
+KEYFRAME_ATTRIBUTES = (
+    ("co", 2, np.float32),
+    ("handle_left", 2, np.float32),
+    ("handle_right", 2, np.float32),
+    ("interpolation", 1, np.int32),
+    ("handle_left_type", 1, np.int32),
+    ("handle_right_type", 1, np.int32),
+)
+
+
+# キーの全属性を読む({名前: (キーの数, 要素数)の配列})
+def read_keyframe_attributes(points):
+    num = len(points)
+    arrays = {}
+    for name, size, dtype in KEYFRAME_ATTRIBUTES:
+        array = np.empty(num * size, dtype=dtype)
+        points.foreach_get(name, array)
+        arrays[name] = array.reshape(num, size) if size > 1 else array
+    return arrays
+
+
+def get_keyframe_fcurve(obj, data_path, index):
+    anim = obj.animation_data
+    if anim == None:
+        anim = obj.animation_data_create()
+    if anim.action == None:
+        anim.action = bpy.data.actions.new(obj.name + "Action")
+    fcurve = anim.action.fcurves.find(data_path, index=index)
+    if fcurve == None:
+        fcurve = anim.action.fcurves.new(data_path, index=index, action_group="Object Transforms")
+    return fcurve
+
+
+# フレーム順のframesの範囲(最初から最後のフレームまで)のキーを、まとめて書き込むキーで置き換える(1つずつkeyframe_insertしない)
+# F-Curveは作り直さないので、範囲外のキー、モディファイア、グループ、外挿の設定はそのまま残る
+def write_keyframes(obj, data_path, index, frames, values):
+    fcurve = get_keyframe_fcurve(obj, data_path, index)
+    points = fcurve.keyframe_points
+    old = len(points)
+    frames = np.asarray(frames, dtype=np.float32)
+
+    # 追加したキーは末尾に入るので、全属性を読んでから範囲内の古いキーを除いてフレーム順に並べる
+    points.add(len(frames))
+    arrays = read_keyframe_attributes(points)
+    arrays["co"][old:, 0] = frames
+    arrays["co"][old:, 1] = values
+    arrays["handle_left"][old:] = arrays["co"][old:]
+    arrays["handle_right"][old:] = arrays["co"][old:]
+
+    old_frames = arrays["co"][:old, 0]
+    outside = np.flatnonzero((old_frames < frames[0]) | (old_frames > frames[-1]))
+    rows = np.concatenate([outside, np.arange(old, old + len(frames))])
+    set_keyframe_rows(fcurve, arrays, rows[np.argsort(arrays["co"][rows, 0], kind='stable')])
+    return fcurve
+
+
+# 既存のキーを残したまま、キーを追加する(同じフレームのキーは値だけ置き換える)
+# 追加したキーも含めてフレーム順に並べ替えて、属性ごとに1回ずつforeach_setで書き戻す
+def insert_keyframes(obj, data_path, index, frames, values):
+    fcurve = get_keyframe_fcurve(obj, data_path, index)
+    points = fcurve.keyframe_points
+    old = len(points)
+    co = np.empty(old * 2, dtype=np.float32)
+    points.foreach_get("co", co)
+    co = co.reshape(-1, 2)
+
+    frames = np.asarray(frames, dtype=np.float32)
+    values = np.asarray(values, dtype=np.float32)
+    pos = np.minimum(np.searchsorted(co[:, 0], frames), max(old - 1, 0))
+    same = (co[pos, 0] == frames) if old else np.zeros(len(frames), dtype=bool)
+    co[pos[same], 1] = values[same]
+
+    added = np.flatnonzero(~same)
+    if len(added) == 0:
+        points.foreach_set("co", co.ravel())
+        fcurve.update()
+        return fcurve
+
+    # 追加したキーは末尾に入るので、全属性を読んでからフレーム順に並べ替える
+    points.add(len(added))
+    arrays = read_keyframe_attributes(points)
+    arrays["co"][:old] = co
+    arrays["co"][old:, 0] = frames[added]
+    arrays["co"][old:, 1] = values[added]
+    arrays["handle_left"][old:] = arrays["co"][old:]
+    arrays["handle_right"][old:] = arrays["co"][old:]
+
+    order = np.argsort(arrays["co"][:, 0], kind='stable')
+    for name, size, dtype in KEYFRAME_ATTRIBUTES:
+        points.foreach_set(name, np.ascontiguousarray(arrays[name][order]).ravel())
+    fcurve.update()
+    return fcurve
+
+
+# (フレーム数, Emptyの数, 4)の値を、Emptyのチャンネルごとにまとめて書き込む(framesの範囲の既存のキーは置き換える)
+# tolerance > 0 の時は、全部書き込んでから書き込んだキーだけ間引く(thin_fcurve)
+def write_control_keys(empties, frames, values, tolerance=0):
+    frames = np.asarray(frames, dtype=np.float32)
+    keep = None
+    if tolerance > 0:
+        with profile_phase("keys.thin"):
+            keep = thin_keyframes(frames, values.reshape(len(frames), -1), tolerance).reshape(values.shape)
+
+    count = 0
+    with profile_phase("keys.write"):
+        for no, empty in enumerate(empties):
+            for channel, (data_path, index) in enumerate(KEY_CHANNELS):
+                fcurve = write_keyframes(empty, data_path, index, frames, values[:, no, channel])
+                count += len(frames)
+                if keep is not None and not keep[:, no, channel].all():
+                    count -= thin_fcurve(fcurve, frames, keep[:, no, channel], tolerance)
+    profile_count("keys_written", count)
+    return count
+
+
+# 前後に残したキーの直線補間からのずれ(値の差)がtolerance以下のキーを間引く(チャンネルごとのDouglas-Peucker)
+# ベジェのハンドルは考えないので、これは間引く候補(実際に消す時はthin_fcurveでF-Curveを評価して確かめる)
+# valuesは(フレーム数, チャンネル数)で、残すキーをTrueにした同じ形の配列を返す(両端は必ず残す)
+def thin_keyframes(frames, values, tolerance):
+    frames = np.asarray(frames, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    num = len(frames)
+    keep = np.zeros(values.shape, dtype=bool)
+    if num <= 2:
+        keep[:] = True
+        return keep
+    keep[0] = True
+    keep[-1] = True
+
+    stack = [(channel, 0, num - 1) for channel in range(values.shape[1])]
+    while stack:
+        channel, start, end = stack.pop()
+        if end - start < 2:
+            continue
+        t = (frames[start + 1:end] - frames[start]) / (frames[end] - frames[start])
+        line = values[start, channel] + t * (values[end, channel] - values[start, channel])
+        error = np.abs(values[start + 1:end, channel] - line)
+        i = int(np.argmax(error))
+        if error[i] > tolerance:
+            mid = start + 1 + i
+            keep[mid, channel] = True
+            stack.append((channel, start, mid))
+            stack.append((channel, mid, end))
+    return keep
+
+
+# F-Curveのキーを、キーの属性(arrays)のrowsの行だけにする
+# F-Curve自体はそのままなので、モディファイアやグループは残り、残したキーの補間とハンドルの種類も変わらない
+def set_keyframe_rows(fcurve, arrays, rows):
+    points = fcurve.keyframe_points
+    num = len(points)
+    for no in range(num - 1, len(rows) - 1, -1):
+        points.remove(points[no], fast=True)
+    if len(rows) > num:
+        points.add(len(rows) - num)
+    for name, size, dtype in KEYFRAME_ATTRIBUTES:
+        points.foreach_set(name, np.ascontiguousarray(arrays[name][rows]).ravel())
+    fcurve.update()  # 自動ハンドルは残したキーで計算しなおされる
+
+
+# framesに書き込んだキーのうち、keep(thin_keyframesの結果)のキーだけ残して、消したキーの数を返す(範囲外のキーは消さない)
+# 残したキーの間はベジェのハンドルで直線にならないので、消した後のF-Curveを元のキーのフレームで評価して、
+# 間引く前の値(モディファイア込み)からtoleranceより離れたキーは戻す(戻すと前後の自動ハンドルも変わるので、収まるまで繰り返す)
+def thin_fcurve(fcurve, frames, keep, tolerance):
+    arrays = read_keyframe_attributes(fcurve.keyframe_points)
+    key_frames = arrays["co"][:, 0]
+    written = keep
+    keep = np.ones(len(key_frames), dtype=bool)
+    keep[np.searchsorted(key_frames, frames)] = written
+    frames = key_frames.tolist()
+    expected = np.array([fcurve.evaluate(frame) for frame in frames])
+    while True:
+        set_keyframe_rows(fcurve, arrays, np.flatnonzero(keep))
+        error = np.abs(np.array([fcurve.evaluate(frame) for frame in frames]) - expected)
+        error[keep] = 0
+        if not (error > tolerance).any():
+            return len(frames) - int(keep.sum())
+        keep |= error > tolerance
+
+
+# キーボタン
+# *************************************************************************************************
+# 今のフレームに、対象のEmpty全部の今の値でキーを打つ
+class AHT_FRILL_OT_key_control_empty(bpy.types.Operator):
+    bl_idname = "aht_frill.key_control_empty"
+    bl_label = "Key"
+
+    # execute
+    def execute(self, context):
+        empties = get_keying_empties(context, context.scene.aft_key_scope)
+        if len(empties) == 0:
+            self.report({'ERROR'}, "Emptyを作成済みのCurveかEmptyを選択してください")
+            return{'FINISHED'}
+
+        AHT_FRILL_OT_key_control_empty.key(empties, context.scene.frame_current)
+        return{'FINISHED'}
+
+    @classmethod
+    def key(cls, empties, frame):
+        values = read_key_values(empties)
+        with profile_phase("keys.insert"):
+            for no, empty in enumerate(empties):
+                for channel, (data_path, index) in enumerate(KEY_CHANNELS):
+                    insert_keyframes(empty, data_path, index, [frame], values[no, channel:channel + 1])
+        profile_count("keys_written", len(empties) * len(KEY_CHANNELS))
+
+
+# ベイクボタン
+# *************************************************************************************************
+# コンストレイントやドライバで動いている評価後の位置を、シーンのフレーム範囲でキーにする
+class AHT_FRILL_OT_bake_control_keys(bpy.types.Operator):
+    bl_idname = "aht_frill.bake_control_keys"
+    bl_label = "Bake Keys"
+
+    # execute
+    def execute(self, context):
+        scene = context.scene
+        empties = get_keying_empties(context, scene.aft_key_scope)
+        if len(empties) == 0:
+            self.report({'ERROR'}, "Emptyを作成済みのCurveかEmptyを選択してください")
+            return{'FINISHED'}
+
+        frames = list(range(scene.frame_start, scene.frame_end + 1, scene.aft_key_step))
+        values = AHT_FRILL_OT_bake_control_keys.bake(context, empties, frames)
+        count = write_control_keys(empties, frames, values, scene.aft_key_tolerance)
+
+        # キーとArmatureコンストレイントで二重に動かないように止める
+        if scene.aft_key_mute_constraints:
+            for empty in empties:
+                for constraint in empty.constraints:
+                    if constraint.name.startswith(AFT_EMPTY_ARMATURE_NAME):
+                        constraint.enabled = False
+
+        self.report({'INFO'}, "%d keys" % count)
+        return{'FINISHED'}
+
+    # 評価後のワールド行列を、親と親の逆行列を外したEmpty自身の値(location, rotation z)に戻す
+    @classmethod
+    def bake(cls, context, empties, frames):
+        scene = context.scene
+        frame_current = scene.frame_current
+        identity = mathutils.Matrix()
+        parent_inverse = np.array([empty.matrix_parent_inverse for empty in empties], dtype=np.float64)
+        values = np.empty((len(frames), len(empties), 4), dtype=np.float32)
+
+        with profile_phase("keys.bake"):
+            for no, frame in enumerate(frames):
+                scene.frame_set(frame)
+                depsgraph = context.evaluated_depsgraph_get()
+                parents = {}  # 同じCurveの親は1回だけ取得する
+                for empty in empties:
+                    if empty.parent != None and empty.parent.name not in parents:
+                        parents[empty.parent.name] = empty.parent.evaluated_get(depsgraph).matrix_world
+                world = np.array([empty.evaluated_get(depsgraph).matrix_world for empty in empties], dtype=np.float64)
+                parent = np.array([parents[empty.parent.name] if empty.parent != None else identity for empty in empties], dtype=np.float64)
+                basis = np.linalg.inv(parent @ parent_inverse) @ world
+                values[no, :, :3] = basis[:, :3, 3]
+                values[no, :, 3] = np.arctan2(basis[:, 1, 0], basis[:, 0, 0])
+            scene.frame_set(frame_current)
+
+        # 回転は±πで折り返さないようにつなげる
+        values[:, :, 3] = np.unwrap(values[:, :, 3], axis=0)
+        return values
+
+
+# 間引きボタン
+# *************************************************************************************************
+# 対象のEmptyに打ってあるキーを、今の設定のtoleranceで間引く
+class AHT_FRILL_OT_thin_control_keys(bpy.types.Operator):
+    bl_idname = "aht_frill.thin_control_keys"
+    bl_label = "Thin"
+
+    # execute
+    def execute(self, context):
+        scene = context.scene
+        empties = get_keying_empties(context, scene.aft_key_scope)
+        removed = AHT_FRILL_OT_thin_control_keys.thin(empties, scene.aft_key_tolerance)
+        self.report({'INFO'}, "%d keys removed" % removed)
+        return{'FINISHED'}
+
+    @classmethod
+    def thin(cls, empties, tolerance):
+        removed = 0
+        for empty in empties:
+            if empty.animation_data == None or empty.animation_data.action == None:
+                continue
+            fcurves = empty.animation_data.action.fcurves
+            for data_path, index in KEY_CHANNELS:
+                fcurve = fcurves.find(data_path, index=index)
+                if fcurve == None or len(fcurve.keyframe_points) <= 2:
+                    continue
+                co = np.empty(len(fcurve.keyframe_points) * 2, dtype=np.float32)
+                fcurve.keyframe_points.foreach_get("co", co)
+                co = co.reshape(-1, 2)
+                keep = thin_keyframes(co[:, 0], co[:, 1:], tolerance)[:, 0]
+                if keep.all():
+                    continue
+                removed += thin_fcurve(fcurve, co[:, 0], keep, tolerance)  # 作り直さずにキーを消す
+        return removed
+
+
+# UI
+# =================================================================================================
+class AHT_FRILL_PT_keying(bpy.types.Panel):
+    bl_label = "Keyframes"
+    bl_parent_id = "APT_FRILL_PT_UI"
+    bl_space_type = "VIEW_3D"
+    bl_region_type = "UI"
+    bl_category = "AHT"
+    bl_options = {'DEFAULT_CLOSED'}
+
+    def draw(self, context):
+        layout = self.layout
+        scene = context.scene
+        layout.enabled = context.mode == "OBJECT"
+        layout.prop(scene, "aft_key_scope", expand=True)
+        layout.operator("aht_frill.key_control_empty")
+
+        box = layout.box()
+        row = box.row()
+        row.prop(scene, "aft_key_step")
+        row.prop(scene, "aft_key_tolerance")
+        box.prop(scene, "aft_key_mute_constraints")
+        row = box.row()
+        row.operator("aht_frill.bake_control_keys")
+        row.operator("aht_frill.thin_control_keys")
+
+
+# 設定用データ
+# =================================================================================================
+def register():
+    bpy.types.Scene.aft_key_scope = bpy.props.EnumProperty(name="Scope", description="キーを打つEmpty", items=[
+        ('SELECTED', "Selected", "選択中のCurve(とEmptyのCurve)の全Empty"),
+        ('SCENE', "Scene", "シーン中の全CurveのEmpty"),
+    ], default='SELECTED')
+    bpy.types.Scene.aft_key_step = bpy.props.IntProperty(name="Step", description="ベイクするフレームの間隔", default=1, min=1)
+    bpy.types.Scene.aft_key_tolerance = bpy.props.FloatProperty(name="Tolerance", description="間引いた後のF-Curveの値のずれがこれ以下になるようにキーを間引く(0なら間引かない)", default=0, min=0, precision=4)
+    bpy.types.Scene.aft_key_mute_constraints = bpy.props.BoolProperty(name="Mute Constraints", description="ベイク後にEmptyのArmatureコンストレイントを止める", default=True)
+
+def unregister():
+    del bpy.types.Scene.aft_key_mute_constraints
+    del bpy.types.Scene.aft_key_tolerance
+    del bpy.types.Scene.aft_key_step
+    del bpy.types.Scene.aft_key_scope
@@ -0,0 +1,381 @@
+import json, hashlib, struct, zlib
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+
+# 作成の計画(plan)
+# *************************************************************************************************
+# Createを「計算」と「bpyへの書き込み」の2段階に分ける
+# このモジュールはbpyを使わない(NumPyと普通のlist/dictだけ)ので、何本ものCurveをスレッドプールで同時に計算でき、Blenderの外でも動かせる
+# 入力は AnimeFrillTools.read_curve_input()、書き込みは AHT_FRILL_OT_create_control_empty.apply()
+# 計画はJSONに保存できるので、差分を見たり、キャッシュして再生したりできる
+PLAN_VERSION = 2
+
+
+# Curve 1本分の計画を作る(indicesを渡した時はそのポイントの分だけ。Syncでの追加用で、登録情報は含まない)
+def plan_control_empties(curve_input, indices=None):
+    point_co = np.asarray(curve_input["point_co"], dtype=np.float32)
+    point_tilt = np.asarray(curve_input["point_tilt"], dtype=np.float32)
+    spline_nos = np.asarray(curve_input["spline_nos"], dtype=np.int64)
+    local_nos = np.asarray(curve_input["local_nos"], dtype=np.int64)
+    vertex_nos = np.asarray(curve_input["vertex_nos"], dtype=np.int64)
+    num = len(point_co)
+    partial = indices is not None
+
+    # LODの時はコントロールを置くポイントを間引く(間のポイントは前後のコントロールで補間して動かす)
+    lod = None
+    if not partial:
+        indices, lod = select_curve_control_points(point_co[:, :3], curve_input["counts"], curve_input["cyclic"], curve_input["lod_mode"], curve_input["lod_step"], curve_input["lod_tolerance"])
+    controls = np.asarray(list(indices), dtype=np.int64)
+
+    # ワールド座標への変換もまとめて1回で(Resetで戻すレストポーズもそのまま保存する)
+    rest_pose = transform_rest_pose(curve_input["matrix_world"], point_co, point_tilt)
+    tilts = point_tilt.astype(np.float64)
+
+    plan = {
+        "version": PLAN_VERSION,
+        "curve": curve_input["curve"],
+        "input_digest": get_input_digest(curve_input),
+        "partial": partial,
+        "bind_mode": curve_input["bind_mode"],
+        "tilt_sync": curve_input["tilt_sync"],
+        "controls": controls,
+        "locations": rest_pose[controls, :3].astype(np.float64),
+        "rotations": tilts[controls],
+        "control_co": point_co[controls, :3].astype(np.float64),
+        "lod_blend": lod is not None,
+        "hooks": None,  # Noneの時はArmature
+        "control_drivers": None,  # Noneの時はハンドラでTiltを書き込む
+        "lod_drivers": None,
+    }
+
+    # Hook(LODの時は前後のコントロールまでのポイントも含めて、距離で減衰させる)
+    if curve_input["bind_mode"] != 'ARMATURE' or partial:  # ボーンは全ポイント分まとめてしか作らない
+        radii = None
+        if lod is not None:
+            influences = get_lod_hook_influences(point_co[:, :3], controls.tolist(), lod)
+            vertices = [vertex_nos[point_nos].tolist() for point_nos, radius in influences]
+            radii = np.array([radius for point_nos, radius in influences], dtype=np.float64)
+        else:
+            vertices = vertex_nos[controls, None].tolist()
+        plan["hooks"] = {
+            "inverse_matrices": get_hook_inverse_matrices(plan["locations"], plan["rotations"]),  # matrix_inverse
+            "vertices": vertices,
+            "radii": radii,
+        }
+
+    # Tiltのドライバ(スプライン番号, スプライン内の番号)
+    if curve_input["tilt_sync"] != 'HANDLER':
+        plan["control_drivers"] = np.stack([spline_nos[controls], local_nos[controls]], axis=1)
+
+        # 間のポイントは前後のEmptyの回転の変化量を補間する(Pythonを使わない単純な式にしておく)
+        if lod is not None:
+            prev_nos, next_nos, weights = lod
+            slots = np.full(num, -1, dtype=np.int64)
+            slots[controls] = np.arange(len(controls))
+            points = np.flatnonzero(slots < 0)
+            a, b, w = prev_nos[points], next_nos[points], weights[points]
+            offsets = tilts[points] - (1 - w) * tilts[a] - w * tilts[b]
+            plan["lod_drivers"] = {
+                "paths": np.stack([spline_nos[points], local_nos[points]], axis=1),
+                "slots": np.stack([slots[a], slots[b]], axis=1),  # 変数a, bのEmpty(controlsの何番目か)
+                "expressions": ["%.9g + %.9g * a + %.9g * b" % (offset, 1 - weight, weight) for offset, weight in zip(offsets.tolist(), w.tolist())],
+            }
+
+    # 登録用(Syncで差分を取る用のポイント位置とレストポーズ)
+    if not partial:
+        plan["rest_pose"] = rest_pose
+        plan["bind"] = make_control_bind(point_co[:, :3], curve_input["counts"], curve_input["layout"], curve_input["bind_mode"], curve_input["tilt_sync"], point_tilt if lod is not None else None, lod)
+
+    return plan
+
+
+# 複数のCurveの計画をまとめて作る(executorを渡さなければスレッドプール)
+# ProcessPoolExecutorを使う時は、子プロセスでこのモジュールをbpyなしでimportできるようにしておくこと
+def plan_curves(curve_inputs, executor=None, max_workers=None):
+    curve_inputs = list(curve_inputs)
+    if executor is not None:
+        return list(executor.map(plan_control_empties, curve_inputs))
+    if len(curve_inputs) <= 1:
+        return [plan_control_empties(curve_input) for curve_input in curve_inputs]
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(plan_control_empties, curve_inputs))
+
+
+# HookのEmptyの作成時の行列(Curve空間で Translation(location) @ Rotation(tilt, Z))の逆行列
+# Hookの変形はこれを掛けた分なので、作成時は全ポイントが動かない(LODで複数ポイントを持つHookもTiltで回らない)
+def get_hook_inverse_matrices(locations, rotations):
+    cos, sin = np.cos(rotations), np.sin(rotations)
+    matrices = np.zeros((len(locations), 4, 4), dtype=np.float64)
+    matrices[:, 0, 0] = cos
+    matrices[:, 0, 1] = sin
+    matrices[:, 1, 0] = -sin
+    matrices[:, 1, 1] = cos
+    matrices[:, 2, 2] = 1
+    matrices[:, 3, 3] = 1
+    matrices[:, :3, 3] = -np.einsum("kij,kj->ki", matrices[:, :3, :3], np.asarray(locations, dtype=np.float64).reshape(-1, 3))
+    return matrices
+
+
+# ポイントの座標(Curveローカル)とTiltからレストポーズ(ワールド座標, Tilt)を作る
+def transform_rest_pose(matrix_world, point_co, point_tilt):
+    matrix_world = np.asarray(matrix_world, dtype=np.float64)
+    pose = np.empty((len(point_co), 4), dtype=np.float32)
+    pose[:, :3] = (np.asarray(point_co, dtype=np.float64) @ matrix_world.T)[:, :3]
+    pose[:, 3] = point_tilt
+    return pose
+
+
+# Curveに保存する作成時の情報(AFT_bind)
+# LODの時は間のポイントの補間情報(前後のコントロール番号と重み、元のTilt)も保存する(ハンドラでのTilt補間用)
+def make_control_bind(point_co, counts, layout, bind_mode, tilt_sync, point_tilt=None, lod=None):
+    bind = {
+        "co": np.asarray(point_co, dtype=np.float32).ravel().tolist(),
+        "counts": list(counts),
+        "layout": list(layout),
+        "bind_mode": bind_mode,
+        "tilt_sync": tilt_sync,
+    }
+    if lod is not None:
+        prev_nos, next_nos, weights = lod
+        bind["lod"] = {
+            "prev": prev_nos.tolist(),
+            "next": next_nos.tolist(),
+            "weight": weights.tolist(),
+            "tilt": np.asarray(point_tilt, dtype=np.float32).tolist(),
+        }
+    return bind
+
+
+# 入力のハッシュ(保存した計画が今のCurveにそのまま使えるかの判定用)
+def get_input_digest(curve_input):
+    digest = hashlib.sha1()
+    for key in sorted(curve_input.keys()):
+        value = curve_input[key]
+        digest.update(key.encode("utf-8"))
+        if isinstance(value, np.ndarray):
+            digest.update(str(value.dtype).encode("utf-8"))
+            digest.update(np.ascontiguousarray(value).tobytes())
+        else:
+            digest.update(json.dumps(value, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+# 保存と比較
+# *************************************************************************************************
+# NumPy配列は {"__array__": dtype, "shape": [...], "data": [...]} にしてJSONに入れる
+# blobsを渡した時は、配列の中身はblobsに追加してその番号だけ入れる(バイナリ形式用)
+def encode_plan(value, blobs=None):
+    if isinstance(value, np.ndarray):
+        if blobs is None:
+            return {"__array__": str(value.dtype), "shape": list(value.shape), "data": value.ravel().tolist()}
+        blobs.append(np.ascontiguousarray(value).tobytes())
+        return {"__array__": value.dtype.str, "shape": list(value.shape), "blob": len(blobs) - 1}
+    if isinstance(value, dict):
+        return {key: encode_plan(item, blobs) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [encode_plan(item, blobs) for item in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def decode_plan(value, blobs=None):
+    if isinstance(value, dict):
+        if "__array__" in value:
+            if "blob" in value:
+                return np.frombuffer(blobs[value["blob"]], dtype=value["__array__"]).reshape(value["shape"]).copy()
+            return np.array(value["data"], dtype=value["__array__"]).reshape(value["shape"])
+        return {key: decode_plan(item, blobs) for key, item in value.items()}
+    if isinstance(value, list):
+        return [decode_plan(item, blobs) for item in value]
+    return value
+
+
+# バイナリ形式(リグの書き出し用)
+# マジック, 形式のバージョン, JSON部分の長さ + JSON(配列は番号と形だけ) + 配列の中身をつなげてzlibで圧縮したもの
+PACK_MAGIC = b"AFTP"
+PACK_VERSION = 1
+PACK_HEADER = struct.Struct("<4sHI")
+
+
+def pack_plan(value):
+    blobs = []
+    header = json.dumps({"value": encode_plan(value, blobs), "blobs": [len(blob) for blob in blobs]}, separators=(",", ":")).encode("utf-8")
+    return PACK_HEADER.pack(PACK_MAGIC, PACK_VERSION, len(header)) + header + zlib.compress(b"".join(blobs))
+
+
+def unpack_plan(data):
+    magic, version, header_size = PACK_HEADER.unpack_from(data)
+    if magic != PACK_MAGIC:
+        raise ValueError("not an AFT file")
+    if version != PACK_VERSION:
+        raise ValueError("unsupported file version: %d" % version)
+    start = PACK_HEADER.size
+    header = json.loads(data[start:start + header_size].decode("utf-8"))
+    body = zlib.decompress(data[start + header_size:])
+
+    blobs = []
+    offset = 0
+    for size in header["blobs"]:
+        blobs.append(body[offset:offset + size])
+        offset += size
+    return decode_plan(header["value"], blobs)
+
+
+def save_plan(plan, filepath):
+    with open(filepath, "w", encoding="utf-8") as f:
+        json.dump(encode_plan(plan), f, sort_keys=True)
+
+
+def load_plan(filepath):
+    with open(filepath, "r", encoding="utf-8") as f:
+        plan = decode_plan(json.load(f))
+    if plan.get("version") != PLAN_VERSION:
+        raise ValueError("unsupported plan version: %s" % plan.get("version"))
+    return plan
+
+
+# 2つの計画で違う項目の名前を返す(入れ子のdictは "hooks.vertices" のようにつなげる)
+def diff_plans(old, new, prefix=""):
+    changed = []
+    for key in sorted(set(old.keys()) | set(new.keys())):
+        a = old.get(key)
+        b = new.get(key)
+        if isinstance(a, dict) and isinstance(b, dict):
+            changed.extend(diff_plans(a, b, prefix + key + "."))
+        elif not is_plan_value_equal(a, b):
+            changed.append(prefix + key)
+    return changed
+
+
+def is_plan_value_equal(a, b):
+    if isinstance(a, np.ndarray) or isinstance(b, np.ndarray):
+        return a is not None and b is not None and np.shape(a) == np.shape(b) and np.array_equal(a, b)
+    return a == b
+
+
+# コントロールの間引き(LOD)
+# *************************************************************************************************
+# スプラインごとにコントロールを選んで、通し番号で返す(counts, cyclicはスプラインごとのポイント数と閉じているか)
+# 間引いたスプラインがあれば、get_lod_neighbors()の結果も通し番号で返す(なければNone)
+def select_curve_control_points(point_co, counts, cyclic, mode, step, tolerance):
+    num = len(point_co)
+    controls = []
+    prev_nos = np.arange(num)
+    next_nos = np.arange(num)
+    weights = np.zeros(num)
+    decimated = False
+
+    start = 0
+    for count, spline_cyclic in zip(counts, cyclic):
+        end = start + count
+        spline_controls = select_control_points(point_co[start:end], spline_cyclic, mode, step, tolerance)
+        if len(spline_controls) < end - start:
+            decimated = True
+            spline_prev, spline_next, spline_weights = get_lod_neighbors(point_co[start:end], spline_controls, spline_cyclic)
+            prev_nos[start:end] = spline_prev + start
+            next_nos[start:end] = spline_next + start
+            weights[start:end] = spline_weights
+        controls.extend(start + no for no in spline_controls)
+        start = end
+
+    return (controls, (prev_nos, next_nos, weights) if decimated else None)
+
+
+# コントロールを置くポイント番号を返す(開いたCurveは両端を必ず含める)
+# NTH: N個おき / ERROR: 間引いた折れ線からのずれがtolerance以下になるように選ぶ(Douglas-Peucker)
+def select_control_points(point_co, cyclic, mode, step, tolerance):
+    num = len(point_co)
+    if mode == 'ALL' or num <= 2:
+        return list(range(num))
+
+    if mode == 'NTH':
+        controls = list(range(0, num, max(step, 1)))
+        if not cyclic and controls[-1] != num - 1:
+            controls.append(num - 1)
+        return controls
+
+    # 閉じたCurveは先頭を末尾にも付けて、1周を開いた折れ線として扱う
+    co = np.asarray(point_co, dtype=np.float64)
+    if cyclic:
+        co = np.vstack([co, co[:1]])
+    last = len(co) - 1
+    keep = np.zeros(len(co), dtype=bool)
+    keep[0] = keep[last] = True
+
+    stack = [(0, last)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        segment = co[end] - co[start]
+        inner = co[start + 1:end] - co[start]
+        length2 = segment @ segment
+        if length2 > 0:
+            t = np.clip(inner @ segment / length2, 0, 1)
+            dist = np.linalg.norm(inner - t[:, None] * segment, axis=1)
+        else:
+            dist = np.linalg.norm(inner, axis=1)
+        i = int(np.argmax(dist))
+        if dist[i] > tolerance:
+            mid = start + 1 + i
+            keep[mid] = True
+            stack.append((start, mid))
+            stack.append((mid, end))
+
+    return np.flatnonzero(keep[:num]).tolist()
+
+
+# ポイントごとに、前後のコントロールのポイント番号と後ろ側の重み(前後のコントロール間の弧長の割合)を返す
+# コントロール自身は前後とも自分、重み0になる
+def get_lod_neighbors(point_co, controls, cyclic):
+    num = len(point_co)
+    controls = np.asarray(controls, dtype=np.int64)
+    co = np.asarray(point_co, dtype=np.float64)
+
+    # 先頭からの弧長(閉じたCurveは1周の長さも)
+    segment = np.linalg.norm(np.diff(co, axis=0), axis=1)
+    param = np.concatenate([[0.0], np.cumsum(segment)])
+    length = param[-1] + (np.linalg.norm(co[0] - co[-1]) if cyclic else 0.0)
+
+    pos = np.searchsorted(controls, np.arange(num), side='right') - 1
+    prev_nos = controls[pos % len(controls)]
+    next_nos = controls[(pos + 1) % len(controls)]
+    is_control = np.zeros(num, dtype=bool)
+    is_control[controls] = True
+    next_nos[is_control] = np.arange(num)[is_control]
+
+    span = param[next_nos] - param[prev_nos]
+    offset = param - param[prev_nos]
+    if cyclic:
+        span[next_nos < prev_nos] += length  # 末尾から先頭へまたぐ区間
+    weights = np.divide(offset, span, out=np.zeros(num), where=span > 0)
+    return (prev_nos, next_nos, weights)
+
+
+# コントロールごとのHookの対象ポイント(自分と前後のコントロールまでの間のポイント)と減衰の半径
+# 半径は前後のコントロールまでの距離の平均(間隔が揃っている時に、前後のHookの重みの和がほぼ1になる)
+def get_lod_hook_influences(point_co, controls, lod):
+    prev_nos, next_nos, weights = lod
+    co = np.asarray(point_co, dtype=np.float64)
+    slots = {no: k for k, no in enumerate(controls)}
+    vertex_indices = [[no] for no in controls]
+    spans = [[] for no in controls]
+
+    for no in range(len(co)):
+        if no in slots:
+            continue
+        vertex_indices[slots[int(prev_nos[no])]].append(no)
+        vertex_indices[slots[int(next_nos[no])]].append(no)
+
+    # 隣り合うコントロール間の距離を両側に登録する
+    for no in range(len(co)):
+        a, b = int(prev_nos[no]), int(next_nos[no])
+        if a == b or (no > 0 and int(prev_nos[no - 1]) == a and int(next_nos[no - 1]) == b):
+            continue
+        dist = float(np.linalg.norm(co[b] - co[a]))
+        spans[slots[a]].append(dist)
+        spans[slots[b]].append(dist)
+
+    return [(indices, (sum(span) / len(span)) if span else 1.0) for indices, span in zip(vertex_indices, spans)]
@@ -0,0 +1,159 @@
+import bpy, json, time, contextlib
+from bpy.app.handlers import persistent
+from bpy_extras.io_utils import ExportHelper
+
+
+# 処理時間の計測
+# *************************************************************************************************
+# with profile_phase("create.hooks"): のように各処理の区間を囲んでおく
+# 無効の時は使い回しのnullcontextを返すだけなので、ほとんどコストはかからない
+profiling_enabled = False
+profile_records = []  # (区間名, 開始, 時間) 秒
+profile_counters = {}  # 作成したオブジェクト数など
+
+NULL_PHASE = contextlib.nullcontext()
+
+
+class ProfilePhase:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        profile_records.append((self.name, self.start, time.perf_counter() - self.start))
+        return False
+
+
+def profile_phase(name):
+    if not profiling_enabled:
+        return NULL_PHASE
+    return ProfilePhase(name)
+
+
+# データブロック操作の回数を数える(ループの中ではなく、まとめて件数を渡す)
+def profile_count(name, count=1):
+    if profiling_enabled:
+        profile_counters[name] = profile_counters.get(name, 0) + count
+
+
+def clear_profile():
+    profile_records.clear()
+    profile_counters.clear()
+
+
+# 区間名ごとの合計(表示用)
+def get_profile_summary():
+    summary = {}
+    for name, start, duration in profile_records:
+        total, count = summary.get(name, (0.0, 0))
+        summary[name] = (total + duration, count + 1)
+    return sorted(summary.items(), key=lambda item: item[1][0], reverse=True)
+
+
+# Chromeのトレース形式(chrome://tracing, Perfetto)で出力する
+def get_profile_trace():
+    origin = min((start for name, start, duration in profile_records), default=0)
+    events = []
+    for name, start, duration in profile_records:
+        events.append({
+            "name": name,
+            "cat": name.split(".")[0],
+            "ph": "X",
+            "ts": (start - origin) * 1e6,
+            "dur": duration * 1e6,
+            "pid": 0,
+            "tid": 0,
+        })
+    for name, count in profile_counters.items():
+        events.append({"name": name, "ph": "C", "ts": 0, "pid": 0, "args": {name: count}})
+    return {"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"counters": dict(profile_counters)}}
+
+
+def update_profiling_enabled(self, context):
+    global profiling_enabled
+    profiling_enabled = self.aft_profile_enabled
+
+
+# ファイルを開いた時はシーンの設定に合わせる
+@persistent
+def profile_load_post(dummy):
+    global profiling_enabled
+    scene = bpy.context.scene
+    profiling_enabled = scene != None and scene.aft_profile_enabled
+
+
+# クリアボタン
+class AHT_FRILL_OT_clear_profile(bpy.types.Operator):
+    bl_idname = "aht_frill.clear_profile"
+    bl_label = "Clear"
+
+    # execute
+    def execute(self, context):
+        clear_profile()
+        return{'FINISHED'}
+
+
+# 出力ボタン
+class AHT_FRILL_OT_export_profile(bpy.types.Operator, ExportHelper):
+    bl_idname = "aht_frill.export_profile"
+    bl_label = "Export"
+
+    filename_ext = ".json"
+    filter_glob: bpy.props.StringProperty(default="*.json", options={'HIDDEN'})
+
+    # execute
+    def execute(self, context):
+        with open(self.filepath, "w", encoding="utf-8") as f:
+            json.dump(get_profile_trace(), f)
+        return{'FINISHED'}
+
+
+# UI
+# =================================================================================================
+class AHT_FRILL_PT_profile(bpy.types.Panel):
+    bl_label = "Profile"
+    bl_parent_id = "APT_FRILL_PT_UI"
+    bl_space_type = "VIEW_3D"
+    bl_region_type = "UI"
+    bl_category = "AHT"
+    bl_options = {'DEFAULT_CLOSED'}
+
+    def draw(self, context):
+        layout = self.layout
+        row = layout.row()
+        row.prop(context.scene, "aft_profile_enabled")
+        row.operator("aht_frill.clear_profile")
+        row.operator("aht_frill.export_profile")
+
+        summary = get_profile_summary()
+        if summary:
+            box = layout.box()
+            for name, (total, count) in summary:
+                row = box.row()
+                row.label(text=name)
+                row.label(text="%.2f ms (%d)" % (total * 1000, count))
+
+        if profile_counters:
+            box = layout.box()
+            for name, count in sorted(profile_counters.items()):
+                row = box.row()
+                row.label(text=name)
+                row.label(text=str(count))
+
+
+# 設定用データ
+# =================================================================================================
+def register():
+    bpy.types.Scene.aft_profile_enabled = bpy.props.BoolProperty(name="Profile", description="AFTの各処理の時間とデータ操作の回数を記録する", default=False, update=update_profiling_enabled)
+    bpy.app.handlers.load_post.append(profile_load_post)
+
+def unregister():
+    global profiling_enabled
+    profiling_enabled = False
+    bpy.app.handlers.load_post.remove(profile_load_post)
+    del bpy.types.Scene.aft_profile_enabled
@@ -0,0 +1,250 @@
+import bpy
+import numpy as np
+from bpy_extras.io_utils import ExportHelper, ImportHelper
+
+from .AnimeFrillTools import (
+    AHT_FRILL_OT_create_control_empty, AHT_FRILL_OT_remove_control_empty,
+    AFT_BIND_NAME, AFT_CACHE_NAME, AFT_EMPTY_ARMATURE_NAME, AFT_REGISTRY_EMPTIES,
+    add_empty_armature, get_control_poses, get_point_splines, get_registered_control_empties, group_control_empties, read_curve_input, set_control_pose,
+)
+from .AnimeFrillPlan import PLAN_VERSION, plan_control_empties, plan_curves, get_input_digest, pack_plan, unpack_plan
+from .AnimeFrillProfile import profile_phase
+
+
+# リグの書き出し/読み込み
+# *************************************************************************************************
+# CurveのAFTの設定一式(Hook/ドライバの計画、全ポーズ、Emptyの今の値とArmatureコンストレイント、Curveの設定)を
+# バージョン付きのバイナリファイル(AnimeFrillPlan.pack_plan)にまとめる
+# 読み込みは全Curveの分をまとめて、Createと同じ計画の書き込み(apply)で作り直す
+RIG_VERSION = 1
+RIG_OPTIONS = ("aft_bind_mode", "aft_tilt_sync", "aft_lod_mode", "aft_lod_step", "aft_lod_tolerance")
+
+
+# Curve 1本分のリグをデータにまとめる
+def export_rig(context, curve):
+    options = {name: getattr(curve, name) for name in RIG_OPTIONS}
+
+    # 作成後にモードを変えていても、今あるEmptyと同じ作り方で計画する
+    bind = curve.get(AFT_BIND_NAME)
+    if bind != None:
+        options["aft_bind_mode"] = bind["bind_mode"]
+        options["aft_tilt_sync"] = bind["tilt_sync"]
+    curve_input = read_curve_input(curve)
+    curve_input["bind_mode"] = options["aft_bind_mode"]
+    curve_input["tilt_sync"] = options["aft_tilt_sync"]
+
+    # Emptyの今の値と、Armatureコンストレイントのターゲット(Emptyごとの数と、全Emptyの分を並べた配列)
+    empties = get_registered_control_empties(context, curve)[0]
+    armature_names = {}
+    target_counts = []
+    target_armatures = []
+    target_bones = []
+    target_weights = []
+    constraint_enabled = []
+    for empty in empties:
+        count = 0
+        enabled = True
+        for constraint in empty.constraints:
+            if not constraint.name.startswith(AFT_EMPTY_ARMATURE_NAME):
+                continue
+            enabled = constraint.enabled
+            for target in constraint.targets:
+                if target.target == None:
+                    continue
+                target_armatures.append(armature_names.setdefault(target.target.name, len(armature_names)))
+                target_bones.append(target.subtarget)
+                target_weights.append(target.weight)
+                count += 1
+        target_counts.append(count)
+        constraint_enabled.append(enabled)
+
+    poses = get_control_poses(curve)
+    return {
+        "curve": curve.name,
+        "options": options,
+        "plan": plan_control_empties(curve_input),
+        "poses": {name: np.array(pose, dtype=np.float32).reshape(-1, 4) for name, pose in (poses.items() if poses != None else [])},
+        "empties": {
+            "point_nos": np.array([empty["AFT_point_no"] for empty in empties], dtype=np.int64),
+            "transforms": np.array([(*empty.location, empty.rotation_euler[2]) for empty in empties], dtype=np.float32).reshape(-1, 4),
+            "target_counts": np.array(target_counts, dtype=np.int32),
+            "target_armatures": np.array(target_armatures, dtype=np.int32),
+            "target_bones": target_bones,
+            "target_weights": np.array(target_weights, dtype=np.float32),
+            "constraint_enabled": np.array(constraint_enabled, dtype=bool),
+        },
+        "armatures": list(armature_names.keys()),
+    }
+
+
+def save_rig_file(filepath, rigs):
+    with open(filepath, "wb") as f:
+        f.write(pack_plan({"version": RIG_VERSION, "rigs": rigs}))
+
+
+def load_rig_file(filepath):
+    with open(filepath, "rb") as f:
+        data = unpack_plan(f.read())
+    if data.get("version") != RIG_VERSION:
+        raise ValueError("unsupported rig version: %s" % data.get("version"))
+    return data["rigs"]
+
+
+# 読み込んだリグを対象のCurveに作り直す(curvesはrigsと同じ順)
+# ポイントの位置と設定が書き出した時と同じなら保存された計画をそのまま使い、違う時だけ計画しなおす(まとめてスレッドプールで)
+# 計画しなおしたCurveは、保存されたポーズとEmptyの値を新しいレストポーズの位置にずらして戻す
+# ポイント数が違うCurveは作り直さずに名前を返す
+def import_rigs(context, rigs, curves):
+    skipped = []
+    targets = []
+    for rig, curve in zip(rigs, curves):
+        counts = [len(spline.points) for spline_no, spline in get_point_splines(curve.data)]
+        if AFT_CACHE_NAME in curve or list(rig["plan"]["bind"]["counts"]) != counts:
+            skipped.append(curve.name)
+            continue
+        targets.append((rig, curve))
+
+    with profile_phase("rig.plan"):
+        for rig, curve in targets:
+            AHT_FRILL_OT_remove_control_empty.remove(context, curve)
+            for name, value in rig["options"].items():
+                setattr(curve, name, value)
+
+        # 計画の入力にはCurve名も入っているので、書き出し元の名前で比べる(古い形式の計画も計画しなおす)
+        curve_inputs = [read_curve_input(curve) for rig, curve in targets]
+        plans = [rig["plan"] if is_rig_plan_valid(rig, curve_input) else None for (rig, curve), curve_input in zip(targets, curve_inputs)]
+        missing = [no for no, plan in enumerate(plans) if plan == None]
+        for no, plan in zip(missing, plan_curves([curve_inputs[no] for no in missing])):
+            plans[no] = plan
+
+    with profile_phase("rig.apply"):
+        for (rig, curve), plan in zip(targets, plans):
+            AHT_FRILL_OT_create_control_empty.apply(context, curve, plan)
+            offset = None if plan is rig["plan"] else plan["rest_pose"] - rig["plan"]["rest_pose"]
+            restore_rig_state(curve, rig, offset)
+
+    return (skipped, len(missing))
+
+
+def is_rig_plan_valid(rig, curve_input):
+    plan = rig["plan"]
+    return plan["version"] == PLAN_VERSION and plan["input_digest"] == get_input_digest(dict(curve_input, curve=rig["curve"]))
+
+
+# ポーズ、Emptyの値、Armatureコンストレイントを戻す(EmptyはAFT_point_noで対応させる)
+# offsetはポイントごとの書き出し時のレストポーズからの差で、ポーズとEmptyの値に足す
+# (書き出し時のCurveのmatrix_worldで計算された値なので、そのままだとCurveを動かした分だけ変形してしまう)
+# Armatureはこのファイルの同じ名前のオブジェクトを使い、見つからないターゲットは付けない
+def restore_rig_state(curve, rig, offset=None):
+    empties = {empty["AFT_point_no"]: empty for empty in curve[AFT_REGISTRY_EMPTIES].values()}
+    num = len(rig["plan"]["rest_pose"])
+    if offset is None:
+        offset = np.zeros((num, 4), dtype=np.float32)
+    for name, pose in rig["poses"].items():
+        if len(pose) == num:
+            set_control_pose(curve, name, pose + offset)
+
+    data = rig["empties"]
+    transforms = (data["transforms"] + offset[data["point_nos"]]).tolist()
+    starts = np.concatenate([[0], np.cumsum(data["target_counts"])]).tolist()
+    target_armatures = data["target_armatures"].tolist()
+    target_weights = data["target_weights"].tolist()
+    armatures = [bpy.data.objects.get(name) for name in rig["armatures"]]
+    armatures = [armature if armature != None and armature.type == 'ARMATURE' else None for armature in armatures]
+
+    for row, point_no in enumerate(data["point_nos"].tolist()):
+        empty = empties.get(point_no)
+        if empty == None:
+            continue
+        empty.location = transforms[row][:3]
+        empty.rotation_euler[2] = transforms[row][3]
+
+        start, end = starts[row], starts[row + 1]
+        targets = [(armatures[index], bone, weight) for index, bone, weight in zip(target_armatures[start:end], data["target_bones"][start:end], target_weights[start:end]) if armatures[index] != None]
+        if targets:
+            constraint = add_empty_armature(empty, targets)
+            constraint.enabled = bool(data["constraint_enabled"][row])
+
+
+# 書き出し/読み込みの対象のCurve(選択中のCurveと、選択中のEmptyのCurve)
+def get_selected_rig_curves(context):
+    curves = {obj.name: obj for obj in context.selected_objects if obj.type == 'CURVE'}
+    for curve, empties in group_control_empties(context.selected_objects).values():
+        curves.setdefault(curve.name, curve)
+    return [curves[name] for name in sorted(curves.keys())]
+
+
+# 書き出しボタン
+# *************************************************************************************************
+class AHT_FRILL_OT_export_rig(bpy.types.Operator, ExportHelper):
+    bl_idname = "aht_frill.export_rig"
+    bl_label = "Export Rig"
+
+    filename_ext = ".aftrig"
+    filter_glob: bpy.props.StringProperty(default="*.aftrig", options={'HIDDEN'})
+
+    # execute
+    def execute(self, context):
+        curves = [curve for curve in get_selected_rig_curves(context) if curve.get(AFT_REGISTRY_EMPTIES)]
+        if len(curves) == 0:
+            self.report({'ERROR'}, "Emptyを作成済みのCurveを選択してください")
+            return{'FINISHED'}
+
+        save_rig_file(self.filepath, [export_rig(context, curve) for curve in curves])
+        self.report({'INFO'}, "%d rigs" % len(curves))
+        return{'FINISHED'}
+
+
+# 読み込みボタン
+# *************************************************************************************************
+class AHT_FRILL_OT_import_rig(bpy.types.Operator, ImportHelper):
+    bl_idname = "aht_frill.import_rig"
+    bl_label = "Import Rig"
+
+    filename_ext = ".aftrig"
+    filter_glob: bpy.props.StringProperty(default="*.aftrig", options={'HIDDEN'})
+
+    match: bpy.props.EnumProperty(name="Match", description="読み込んだリグを付けるCurve", items=[
+        ('NAME', "Name", "シーン中の同じ名前のCurve"),
+        ('SELECTED', "Selected", "選択中のCurve(名前順にリグの順で割り当てる)"),
+    ], default='NAME')
+
+    # execute
+    def execute(self, context):
+        try:
+            rigs = load_rig_file(self.filepath)
+        except (OSError, ValueError) as e:
+            self.report({'ERROR'}, str(e))
+            return{'FINISHED'}
+
+        if self.match == 'SELECTED':
+            curves = get_selected_rig_curves(context)
+            pairs = list(zip(rigs, curves))
+        else:
+            objects = context.scene.objects
+            pairs = [(rig, objects.get(rig["curve"])) for rig in rigs]
+            pairs = [(rig, curve) for rig, curve in pairs if curve != None and curve.type == 'CURVE']
+        if len(pairs) == 0:
+            self.report({'ERROR'}, "リグを付けるCurveが見つかりません")
+            return{'FINISHED'}
+
+        skipped, replanned = import_rigs(context, [rig for rig, curve in pairs], [curve for rig, curve in pairs])
+        self.report({'WARNING'} if skipped else {'INFO'}, "%d rigs (replanned %d, skipped: %s)" % (len(pairs) - len(skipped), replanned, ", ".join(skipped) or "none"))
+        return{'FINISHED'}
+
+
+# UI
+# =================================================================================================
+class AHT_FRILL_PT_rig_file(bpy.types.Panel):
+    bl_label = "Rig File"
+    bl_parent_id = "APT_FRILL_PT_UI"
+    bl_space_type = "VIEW_3D"
+    bl_region_type = "UI"
+    bl_category = "AHT"
+    bl_options = {'DEFAULT_CLOSED'}
+
+    def draw(self, context):
+        row = self.layout.row()
+        row.enabled = context.mode == "OBJECT"
+        row.operator("aht_frill.export_rig")
+        row.operator("aht_frill.import_rig")
@@ -1,9 +1,22 @@
 import bpy, mathutils, math
+import numpy as np
+from bpy.app.handlers import persistent
+
+from .AnimeFrillProfile import profile_phase, profile_count
+from .AnimeFrillPlan import PLAN_VERSION, plan_control_empties, transform_rest_pose, make_control_bind
 
 # 定数
 AFT_EMPTY_NAME = "AFT_Empty"
 AFT_EMPTY_HOOK_NAME = "AFT_Hook"
 AFT_EMPTY_ARMATURE_NAME = "AFT_Armature"
+AFT_REGISTRY_EMPTIES = "AFT_empties"
+AFT_REGISTRY_HOOKS = "AFT_hooks"
+AFT_REGISTRY_BONES = "AFT_bones"
+AFT_BONES_NAME = "AFT_Bones"
+AFT_CACHE_NAME = "AFT_cache"
+AFT_BIND_NAME = "AFT_bind"
+AFT_POSES_NAME = "AFT_poses"
+AFT_REST_POSE = "rest"
 
 
 # 作成ボタン
@@ -15,61 +28,471 @@ class AHT_FRILL_OT_create_control_empty(bpy.types.Operator):
 
     # execute
     def execute(self, context):
-        # 先に一旦削除
-        for obj in context.selected_objects:
-            if obj and obj.type == 'CURVE':
-                AHT_FRILL_OT_remove_control_empty.remove(context, obj)
-        # create
+        # 作成済みなら差分だけ更新する(作れない時はsyncの中で作り直す)
         for obj in context.selected_objects:
-            if obj and obj.type == 'CURVE':
-                AHT_FRILL_OT_create_control_empty.create(context, obj)
+            if obj and obj.type == 'CURVE' and AFT_CACHE_NAME not in obj:  # キャッシュ再生中のCurveは触らない
+                AHT_FRILL_OT_create_control_empty.sync(context, obj)
 
         return{'FINISHED'}
 
 
+    # indicesを渡した時はそのポイントの分だけ作って返す(Syncでの追加用。登録はsync側で行う)
+    # 計算(AnimeFrillPlan、bpyに触らない)と書き込み(apply)の2段階で行う
+    @classmethod
+    def create(cls, context, curve, indices=None):
+        with profile_phase("create.read_points"):
+            curve_input = read_curve_input(curve)
+        with profile_phase("create.plan"):
+            plan = plan_control_empties(curve_input, indices)
+        return AHT_FRILL_OT_create_control_empty.apply(context, curve, plan)
+
+
+    # 計画の通りにEmpty/Hook(Armature)/ドライバを作って登録する(部分的な計画の時は作ったEmptyとHookを返す)
     @classmethod
-    def create(cls, context, curve):
-        spline = curve.data.splines[0]
-        curve_mat_world = curve.matrix_world
+    def apply(cls, context, curve, plan):
+        if plan["version"] != PLAN_VERSION:
+            raise ValueError("unsupported plan version: %s" % plan["version"])
+        if not plan["partial"] and list(plan["bind"]["counts"]) != [len(spline.points) for spline_no, spline in get_point_splines(curve.data)]:
+            raise ValueError("plan does not match curve: %s" % curve.name)
+
+        splines = curve.data.splines
+        collection = curve.users_collection[0]
+        controls = plan["controls"].tolist()
+        locations = plan["locations"].tolist()
+        rotations = plan["rotations"].tolist()
 
         # ポイントごとにEmpty生成
-        PointEmptys = []
-        for no, point in enumerate(spline.points):
-            empty = bpy.data.objects.new(AFT_EMPTY_NAME, None)
-            curve.users_collection[0].objects.link(empty)
-
-            # 初期設定
-            empty.parent = curve
-            empty.empty_display_size = 0.05
-            empty.location = (curve_mat_world @ point.co).xyz
-            empty.rotation_euler[2] = point.tilt  # とりあえずZを使う
-            empty.show_in_front = True
-
-            # リセット用
-            empty["AFT_target_curve"] = curve
-            empty["AFT_point_no"] = no
-            AHT_FRILL_OT_update_control_empty.update(context, empty)  # 残りはUpdateと同じ
-
-            # この後の設定用にリスト保存
-            PointEmptys.append(empty)
-
-        # Hookの追加
-        for no, point in enumerate(spline.points):
-            hook = curve.modifiers.new("AFT_Hook", 'HOOK')
-            hook.object = PointEmptys[no]
-            hook.vertex_indices_set([no])
-            hook.matrix_inverse = mathutils.Matrix.Translation(-point.co.xyz)
-
-        # Tiltにドライバを設定
-        for no, point in enumerate(spline.points):
-            driver = point.driver_add('tilt')
-            driver.driver.type = 'SCRIPTED'
-            var = driver.driver.variables.new()
-            var.name = 'var'
-            var.type = 'TRANSFORMS'
-            var.targets[0].id = PointEmptys[no]
-            var.targets[0].transform_type = 'ROT_Z'
-            driver.driver.expression = 'var'
+        with profile_phase("create.empties"):
+            PointEmptys = [bpy.data.objects.new(AFT_EMPTY_NAME, None) for no in controls]
+            for k, (no, empty) in enumerate(zip(controls, PointEmptys)):
+                collection.objects.link(empty)
+
+                # 初期設定
+                empty.parent = curve
+                empty.empty_display_size = 0.05
+                empty.location = locations[k]
+                empty.rotation_euler[2] = rotations[k]  # とりあえずZを使う
+                empty.show_in_front = True
+
+                # 対象のCurveとポイント(リセット用の位置はCurve側にまとめて保存する)
+                empty["AFT_target_curve"] = curve
+                empty["AFT_point_no"] = no
+
+        profile_count("objects_created", len(controls))
+        profile_count("idprops_written", len(controls) * 2)
+
+        # 変形の設定(Curveごとに Hook / Armature を選べる)
+        PointHooks = []
+        armature = None
+        hooks = plan["hooks"]
+        if hooks == None:
+            with profile_phase("create.armature"):
+                armature, modifier = create_control_armature(context, curve, PointEmptys, plan["control_co"], locations, rotations, plan["lod_blend"])
+                PointHooks.append(modifier)  # 削除と評価の切り替えでHookと同じに扱う
+            profile_count("objects_created")
+            profile_count("modifiers_added")
+            profile_count("constraints_added", len(controls))
+        else:
+            inverse_matrices = hooks["inverse_matrices"].tolist()
+            centers = plan["control_co"].tolist()
+            radii = hooks["radii"]
+            # 同じ名前で追加すると、空いている番号(.001, .002, ...)をモディファイア全部と比べながら探すので、
+            # ポイント番号を付けた名前で追加する(重なった時だけBlenderが番号を探す)
+            with profile_phase("create.hooks"):
+                for k, empty in enumerate(PointEmptys):
+                    hook = curve.modifiers.new("%s.%03d" % (AFT_EMPTY_HOOK_NAME, controls[k]), 'HOOK')
+                    hook.object = empty
+                    hook.matrix_inverse = mathutils.Matrix(inverse_matrices[k])
+                    hook.vertex_indices_set(hooks["vertices"][k])
+                    if radii is not None:
+                        hook.center = centers[k]
+                        hook.falloff_type = 'LINEAR'
+                        hook.falloff_radius = float(radii[k])
+                    PointHooks.append(hook)
+            profile_count("modifiers_added", len(controls))
+
+        # Tiltにドライバを設定(HANDLERの時はドライバを使わずハンドラでまとめて書き込む)
+        control_drivers = plan["control_drivers"]
+        if control_drivers is not None:
+            with profile_phase("create.drivers"):
+                for (spline_no, local_no), empty in zip(control_drivers.tolist(), PointEmptys):
+                    driver = splines[spline_no].points[local_no].driver_add('tilt')
+                    driver.driver.type = plan["tilt_sync"]  # SUMならPythonを使わずに評価される
+                    var = driver.driver.variables.new()
+                    var.name = 'var'
+                    var.type = 'TRANSFORMS'
+                    var.targets[0].id = empty
+                    var.targets[0].transform_type = 'ROT_Z'
+                    if plan["tilt_sync"] == 'SCRIPTED':
+                        driver.driver.expression = 'var'
+            profile_count("drivers_added", len(controls))
+
+        # 間のポイントは前後のEmptyの回転の変化量を補間する
+        lod_drivers = plan["lod_drivers"]
+        if lod_drivers is not None:
+            with profile_phase("create.lod_drivers"):
+                for (spline_no, local_no), slots, expression in zip(lod_drivers["paths"].tolist(), lod_drivers["slots"].tolist(), lod_drivers["expressions"]):
+                    driver = splines[spline_no].points[local_no].driver_add('tilt')
+                    driver.driver.type = 'SCRIPTED'
+                    for name, slot in zip(('a', 'b'), slots):
+                        var = driver.driver.variables.new()
+                        var.name = name
+                        var.type = 'TRANSFORMS'
+                        var.targets[0].id = PointEmptys[slot]
+                        var.targets[0].transform_type = 'ROT_Z'
+                    driver.driver.expression = expression
+            profile_count("drivers_added", len(lod_drivers["expressions"]))
+
+        if plan["partial"]:
+            return (PointEmptys, PointHooks)
+
+        # 削除時にシーンを走査しなくて済むようにCurve側に登録しておく
+        with profile_phase("create.registry"):
+            register_control_empties(curve, PointEmptys, PointHooks, armature)
+            curve[AFT_BIND_NAME] = plan["bind"]
+            store_rest_pose(curve, plan["rest_pose"])
+            invalidate_tilt_sync_curves()
+
+
+    # 作成時のポイント位置と比べて、増減した部分のEmpty/Hook/ドライバだけ作り直す
+    # ポイントの追加/削除は1か所にまとまっていることが多いので、先頭と末尾から一致する範囲を除いた残りを差分とする
+    # 一致範囲のEmptyはそのまま残すので、Emptyに打ったキーも消えない(後ろ側は番号だけ付け替える)
+    @classmethod
+    def sync(cls, context, curve):
+        with profile_phase("sync.diff"):
+            point_co, point_tilt = read_curve_points(curve.data)
+            num = len(point_co)
+
+            get_control_poses(curve)  # 古いファイルは番号を付け替える前にポーズを移行しておく
+            plan = diff_control_bind(curve, point_co[:, :3])
+
+        # 差分で更新できない時(未作成、Armatureモード、モード変更、登録情報の破損)は作り直す
+        if plan == None:
+            AHT_FRILL_OT_remove_control_empty.remove(context, curve)
+            AHT_FRILL_OT_create_control_empty.create(context, curve)
+            return
+
+        head, old_tail, new_tail, empties, hook_items = plan
+        old_num = len(empties)
+        shift = num - old_num
+        if old_tail == head and new_tail == head and shift == 0:
+            return  # 変化なし
+
+        # ドライバのパスはスプライン内の番号、Hookは頂点番号で指定するので、変更前と変更後の両方の対応を作っておく
+        drivers = curve.data.animation_data.drivers if curve.data.animation_data else None
+        old_spline_nos, old_local_nos = get_curve_point_layout(curve.data, curve[AFT_BIND_NAME]["counts"])[:2]
+        spline_nos, local_nos, vertex_nos = get_curve_point_layout(curve.data)
+        tilt_path = 'splines[%d].points[%d].tilt'
+
+        # 消えた範囲のEmpty/Hook/ドライバを削除
+        with profile_phase("sync.remove"):
+            for no in range(head, old_tail):
+                if drivers != None:
+                    driver = drivers.find(tilt_path % (old_spline_nos[no], old_local_nos[no]))
+                    if driver != None:
+                        drivers.remove(driver)
+                hook = curve.modifiers.get(hook_items[no][0])
+                if hook != None:
+                    curve.modifiers.remove(hook)
+                bpy.data.objects.remove(empties[no], do_unlink=True)
+        profile_count("objects_removed", old_tail - head)
+        profile_count("modifiers_removed", old_tail - head)
+
+        # 後ろ側は番号をずらす(ドライバのパスが重ならないように、ずらす方向の先から処理する)
+        moved = range(old_tail, old_num) if shift != 0 else range(0)
+        with profile_phase("sync.reindex"):
+            for no in (reversed(moved) if shift > 0 else moved):
+                empties[no]["AFT_point_no"] = no + shift
+                hook = curve.modifiers.get(hook_items[no][0])
+                if hook != None:
+                    hook.vertex_indices_set([int(vertex_nos[no + shift])])
+                if drivers != None:
+                    driver = drivers.find(tilt_path % (old_spline_nos[no], old_local_nos[no]))
+                    if driver != None:
+                        driver.data_path = tilt_path % (spline_nos[no + shift], local_nos[no + shift])
+        profile_count("idprops_written", len(moved))
+
+        # 増えた範囲を作成
+        new_empties, new_hooks = AHT_FRILL_OT_create_control_empty.create(context, curve, range(head, new_tail))
+
+        # 番号順のまま登録しなおす
+        with profile_phase("sync.registry"):
+            curve[AFT_REGISTRY_EMPTIES] = {empty.name: empty for empty in empties[:head] + new_empties + empties[old_tail:]}
+            curve[AFT_REGISTRY_HOOKS] = dict(
+                hook_items[:head] +
+                [(hook.name, no) for no, hook in zip(range(head, new_tail), new_hooks)] +
+                [(name, no + shift) for name, no in hook_items[old_tail:]]
+            )
+            store_control_bind(curve, point_co[:, :3])
+            splice_control_poses(curve, head, old_tail, get_rest_pose(curve, point_co[head:new_tail], point_tilt[head:new_tail]))
+            invalidate_tilt_sync_curves()
+
+
+# ポーズ(Emptyの位置と回転)
+# *************************************************************************************************
+# Curveに名前ごとのfloat32配列で保存する(ポイント数 x 4 = location x, y, z, rotation z(ラジアン)。行はAFT_point_no)
+# "rest"はCreate時の位置で、それ以外はStoreで好きな名前で保存できる
+
+# ポイントの座標とTiltからレストポーズを作る
+def get_rest_pose(curve, point_co, point_tilt):
+    return transform_rest_pose(np.array(curve.matrix_world, dtype=np.float64), point_co, point_tilt)
+
+
+def get_control_poses(curve):
+    poses = curve.get(AFT_POSES_NAME)
+    if poses == None:
+        poses = migrate_control_poses(curve)
+    return poses
+
+
+# 指定した名前のポーズを(ポイント数, 4)の配列で返す(なければNone)
+def get_control_pose(curve, name):
+    poses = get_control_poses(curve)
+    if poses == None or name not in poses:
+        return None
+    return np.array(poses[name], dtype=np.float32).reshape(-1, 4)
+
+
+def set_control_pose(curve, name, pose):
+    if AFT_POSES_NAME not in curve:
+        curve[AFT_POSES_NAME] = {}
+    curve[AFT_POSES_NAME][name] = np.ascontiguousarray(pose, dtype=np.float32).ravel()
+
+
+# Create時にレストポーズを保存する(ポイント数が変わって使えなくなったポーズは消す)
+def store_rest_pose(curve, pose):
+    poses = curve.get(AFT_POSES_NAME)
+    if poses != None:
+        for name in [name for name, value in poses.items() if len(value) != pose.size]:
+            del poses[name]
+    set_control_pose(curve, AFT_REST_POSE, pose)
+
+
+# Syncでポイントが増減した時は、全ポーズの同じ範囲を差し替える(増えた分はレストポーズの値)
+def splice_control_poses(curve, start, end, rows):
+    poses = curve.get(AFT_POSES_NAME)
+    if poses == None:
+        return
+    for name in list(poses.keys()):
+        pose = np.array(poses[name], dtype=np.float32).reshape(-1, 4)
+        set_control_pose(curve, name, np.concatenate([pose[:start], rows, pose[end:]]))
+
+
+# 以前のバージョンのEmptyごとのプロパティ(AFT_org_pos, AFT_org_tilt(度))からレストポーズを作る
+# 元のアドオンで作ったファイルには登録情報がないので、その時はシーンを走査して登録してから移行する
+def migrate_control_poses(curve):
+    empties = curve.get(AFT_REGISTRY_EMPTIES)
+    if empties == None:
+        empties = repair_control_empties_registry(bpy.context, curve)[0]
+    else:
+        empties = empties.values()
+    empties = [empty for empty in empties if empty != None and "AFT_org_pos" in empty and empty.get("AFT_point_no") != None]
+    if len(empties) == 0:
+        return None
+
+    # Emptyのないポイントは今のポイントの位置で埋める
+    point_co, point_tilt = read_curve_points(curve.data)
+    pose = get_rest_pose(curve, point_co, point_tilt)
+    for empty in empties:
+        point_no = empty["AFT_point_no"]
+        if point_no < len(pose):
+            pose[point_no, :3] = empty["AFT_org_pos"]
+            pose[point_no, 3] = empty.get("AFT_org_tilt", 0) * math.pi / 180
+        del empty["AFT_org_pos"]
+        if "AFT_org_tilt" in empty:
+            del empty["AFT_org_tilt"]
+
+    set_control_pose(curve, AFT_REST_POSE, pose)
+    return curve[AFT_POSES_NAME]
+
+
+# Emptyを対象のCurveごとに分ける({Curve名: (Curve, [Empty])})
+def group_control_empties(objects):
+    groups = {}
+    for obj in objects:
+        if obj == None or obj.type != 'EMPTY':
+            continue
+
+        # AFT用のEmptyかチェック
+        target_curve = obj.get("AFT_target_curve")
+        if target_curve == None or obj.get("AFT_point_no") == None:
+            continue
+        groups.setdefault(target_curve.name, (target_curve, []))[1].append(obj)
+    return groups
+
+
+# Curveのポイント
+# *************************************************************************************************
+# 全スプラインのポイント(POLY/NURBS)を、スプライン順に並べた通し番号(AFT_point_no)で扱う
+# Hookの頂点番号はBezierのポイントをハンドル込みで3つと数えるので、通し番号とは別に求める
+
+# 通し番号の対象になるスプライン(Bezierは対象外)
+def get_point_splines(curve_data):
+    return [(spline_no, spline) for spline_no, spline in enumerate(curve_data.splines) if spline.type != 'BEZIER']
+
+
+# スプラインの構成(Bezierはハンドル込みの頂点数、それ以外は-1)。これが変わったら頂点番号の対応も変わる
+def get_spline_layout(curve_data):
+    return [len(spline.bezier_points) * 3 if spline.type == 'BEZIER' else -1 for spline in curve_data.splines]
+
+
+# 通し番号ごとの(スプライン番号, スプライン内の番号, Hookの頂点番号)
+# countsを渡した時は、スプラインごとのポイント数がその値だった時の対応を返す(Sync用)
+def get_curve_point_layout(curve_data, counts=None):
+    spline_nos = [np.zeros(0, dtype=np.int64)]
+    local_nos = [np.zeros(0, dtype=np.int64)]
+    vertex_nos = [np.zeros(0, dtype=np.int64)]
+    offset = 0
+    index = 0
+    for spline_no, spline in enumerate(curve_data.splines):
+        if spline.type == 'BEZIER':
+            offset += len(spline.bezier_points) * 3
+            continue
+        count = len(spline.points) if counts == None else counts[index]
+        index += 1
+        spline_nos.append(np.full(count, spline_no, dtype=np.int64))
+        local_nos.append(np.arange(count, dtype=np.int64))
+        vertex_nos.append(np.arange(count, dtype=np.int64) + offset)
+        offset += count
+    return (np.concatenate(spline_nos), np.concatenate(local_nos), np.concatenate(vertex_nos))
+
+
+# 全スプラインの座標(x, y, z, w)とTiltを通し番号順にまとめて取得する
+def read_curve_points(curve_data):
+    point_co = [np.zeros((0, 4), dtype=np.float32)]
+    point_tilt = [np.zeros(0, dtype=np.float32)]
+    for spline_no, spline in get_point_splines(curve_data):
+        num = len(spline.points)
+        co = np.empty(num * 4, dtype=np.float32)
+        spline.points.foreach_get("co", co)
+        tilt = np.empty(num, dtype=np.float32)
+        spline.points.foreach_get("tilt", tilt)
+        point_co.append(co.reshape(num, 4))
+        point_tilt.append(tilt)
+    return (np.concatenate(point_co), np.concatenate(point_tilt))
+
+
+# Hook/Armatureで変形した後のポイントを取得する
+# 評価済みのCurveのポイントは変形前のまま(変形はカーブキャッシュにある)なので、to_curveで取り出す
+def read_deformed_curve_points(curve, depsgraph):
+    try:
+        return read_curve_points(curve.to_curve(depsgraph, apply_modifiers=True))
+    finally:
+        curve.to_curve_clear()
+
+
+# 計画(AnimeFrillPlan)の入力になるCurveの状態を、bpyを含まないデータにまとめて取得する
+def read_curve_input(curve):
+    point_co, point_tilt = read_curve_points(curve.data)
+    spline_nos, local_nos, vertex_nos = get_curve_point_layout(curve.data)
+    point_splines = get_point_splines(curve.data)
+    return {
+        "curve": curve.name,
+        "matrix_world": np.array(curve.matrix_world, dtype=np.float64),
+        "point_co": point_co,
+        "point_tilt": point_tilt,
+        "spline_nos": spline_nos,
+        "local_nos": local_nos,
+        "vertex_nos": vertex_nos,
+        "counts": [len(spline.points) for spline_no, spline in point_splines],
+        "cyclic": [spline.use_cyclic_u for spline_no, spline in point_splines],
+        "layout": get_spline_layout(curve.data),
+        "bind_mode": curve.aft_bind_mode,
+        "tilt_sync": curve.aft_tilt_sync,
+        "lod_mode": curve.aft_lod_mode,
+        "lod_step": curve.aft_lod_step,
+        "lod_tolerance": curve.aft_lod_tolerance,
+    }
+
+
+# Tiltだけ取得する(毎フレームのハンドラ用)
+def read_curve_tilt(curve_data):
+    point_tilt = [np.zeros(0, dtype=np.float32)]
+    for spline_no, spline in get_point_splines(curve_data):
+        tilt = np.empty(len(spline.points), dtype=np.float32)
+        spline.points.foreach_get("tilt", tilt)
+        point_tilt.append(tilt)
+    return np.concatenate(point_tilt)
+
+
+# 通し番号順の座標/Tiltをスプラインごとに一括で書き込む(Noneの方は書き込まない)
+def write_curve_points(curve_data, point_co=None, point_tilt=None):
+    start = 0
+    for spline_no, spline in get_point_splines(curve_data):
+        end = start + len(spline.points)
+        if point_co is not None:
+            spline.points.foreach_set("co", np.ascontiguousarray(point_co[start:end], dtype=np.float32).ravel())
+        if point_tilt is not None:
+            spline.points.foreach_set("tilt", np.ascontiguousarray(point_tilt[start:end], dtype=np.float32))
+        start = end
+
+
+# Hookの代わりに、ポイントごとにボーンを持つArmatureを1つ作ってArmatureモディファイア1つで変形させる
+# Curveは頂点グループを持てないので、隣のポイントに届かない大きさのエンベロープで1ポイント1ボーンにする
+# 作ったArmatureとArmatureモディファイアを返す
+def create_control_armature(context, curve, empties, point_co, locations, tilts, blend=False):
+    collection = curve.users_collection[0]
+    view_layer = context.view_layer
+
+    armature_data = bpy.data.armatures.new(AFT_BONES_NAME)
+    armature = bpy.data.objects.new(AFT_BONES_NAME, armature_data)
+    collection.objects.link(armature)
+    armature.parent = curve  # Curveのローカル空間 = Armature空間にしておく
+    armature["AFT_target_curve"] = curve
+
+    # 一番近い別のポイントまでの距離からエンベロープの半径を決める
+    num = len(point_co)
+    kd = mathutils.kdtree.KDTree(num)
+    for no, co in enumerate(point_co):
+        kd.insert(co, no)
+    kd.balance()
+    radius = []
+    reach = []
+    for co in point_co:
+        nearest = kd.find_n(co, 3)
+        dist = nearest[1][2] if len(nearest) > 1 else 1.0
+        radius.append(max(dist * 0.45, 0.0001))
+        reach.append(nearest[-1][2] if len(nearest) > 1 else 1.0)
+
+    # LOD(blend)の時は両隣のコントロールまで届くエンベロープにして、間のポイントを混ぜる
+    if blend:
+        radius = [max(r * 0.01, 0.0001) for r in reach]
+
+    # ボーンはEditModeでしか作れない
+    prev_active = view_layer.objects.active
+    view_layer.objects.active = armature
+    armature.select_set(True)
+    bpy.ops.object.mode_set(mode='EDIT')
+    for no, co in enumerate(point_co):
+        bone = armature_data.edit_bones.new("%s_%d" % (AFT_BONES_NAME, no))
+        bone.head = co
+        bone.tail = (co[0], co[1], co[2] + radius[no] * 0.1)
+        bone.head_radius = radius[no]
+        bone.tail_radius = radius[no]
+        bone.envelope_distance = reach[no] if blend else 0
+        bone.envelope_weight = 1
+        bone.use_deform = True
+    bpy.ops.object.mode_set(mode='OBJECT')
+    armature.select_set(False)
+    view_layer.objects.active = prev_active
+
+    # ボーンをEmptyに追従させる(作成時のEmptyの位置を基準にする)
+    curve_mat_world = curve.matrix_world
+    for no, empty in enumerate(empties):
+        constraint = armature.pose.bones["%s_%d" % (AFT_BONES_NAME, no)].constraints.new('CHILD_OF')
+        constraint.name = AFT_BONES_NAME
+        constraint.target = empty
+        empty_mat_world = curve_mat_world @ mathutils.Matrix.Translation(locations[no]) @ mathutils.Matrix.Rotation(tilts[no], 4, 'Z')
+        constraint.inverse_matrix = empty_mat_world.inverted()
+
+    # 変形はArmatureモディファイア1つで行う
+    modifier = curve.modifiers.new(AFT_BONES_NAME, 'ARMATURE')
+    modifier.object = armature
+    modifier.use_vertex_groups = False
+    modifier.use_bone_envelopes = True
+
+    armature.hide_set(True)
+    return (armature, modifier)
 
 
 # 削除ボタン
@@ -82,106 +505,384 @@ class AHT_FRILL_OT_remove_control_empty(bpy.types.Operator):
     # execute
     def execute(self, context):
         for obj in context.selected_objects:
-            if obj.type == 'CURVE':
+            if obj.type == 'CURVE' and AFT_CACHE_NAME not in obj:  # キャッシュ再生中のCurveは触らない
                 AHT_FRILL_OT_remove_control_empty.remove(context, obj)
         return{'FINISHED'}
 
     @classmethod
     def remove(cls, context, curve):
-        for obj in context.view_layer.objects:
-            # Emptyに対してのみ処理が行える
-            if obj == None or obj.type != 'EMPTY':
-                continue
-
-            # 対象のCurveかチェック
-            target_curve = obj.get("AFT_target_curve")
-            if target_curve == None or target_curve != curve:
-                continue
+        # Curveに登録されているEmptyとHookだけ見る(登録情報が壊れていたらここで作り直される)
+        with profile_phase("remove.registry"):
+            empties, hooks, armature = get_registered_control_empties(context, curve)
+
+        with profile_phase("remove.empties"):
+            for empty in empties:
+                bpy.data.objects.remove(empty, do_unlink=True)
+        profile_count("objects_removed", len(empties))
+
+        # hook(Armatureモードの時はArmatureモディファイア)も削除
+        with profile_phase("remove.hooks"):
+            for hook in hooks:
+                curve.modifiers.remove(hook)
+        profile_count("modifiers_removed", len(hooks))
+
+        # 以前のバージョンはArmatureモディファイアを登録していなかったので、残っていれば一緒に削除
+        for mod in [mod for mod in curve.modifiers if mod.type == 'ARMATURE' and mod.name.startswith(AFT_BONES_NAME) and mod.object in (None, armature)]:
+            curve.modifiers.remove(mod)
+
+        # Armatureモードで作ったArmatureも削除
+        if armature != None:
+            armature_data = armature.data
+            bpy.data.objects.remove(armature, do_unlink=True)
+            if armature_data.users == 0:
+                bpy.data.armatures.remove(armature_data)
+
+        # driverも削除(全スプライン)
+        with profile_phase("remove.drivers"):
+            for spline_no, spline in get_point_splines(curve.data):
+                for point in spline.points:
+                    point.driver_remove('tilt')
+
+        # 空で登録しなおしておく(次回Create時の削除で走査が走らないように)
+        register_control_empties(curve, [], [])
+        if AFT_BIND_NAME in curve:
+            del curve[AFT_BIND_NAME]
+        invalidate_tilt_sync_curves()
+
+
+# Curveごとの登録情報
+# *************************************************************************************************
+# CurveにEmptyとHook(とArmatureモードのArmature)の一覧を保存する
+def register_control_empties(curve, empties, hooks, armature=None):
+    curve[AFT_REGISTRY_EMPTIES] = {empty.name: empty for empty in empties}
+    curve[AFT_REGISTRY_HOOKS] = {hook.name: hook.object.get("AFT_point_no", -1) if hook.type == 'HOOK' and hook.object else -1 for hook in hooks}
+    if armature != None:
+        curve[AFT_REGISTRY_BONES] = armature
+    elif AFT_REGISTRY_BONES in curve:
+        del curve[AFT_REGISTRY_BONES]
+    invalidate_panel_state()
+
+
+# 登録情報が今のシーンの状態と一致しているかチェック
+def is_control_empties_registry_valid(curve):
+    empties = curve.get(AFT_REGISTRY_EMPTIES)
+    hooks = curve.get(AFT_REGISTRY_HOOKS)
+    if empties == None or hooks == None:
+        return False
+    profile_count("idprops_read", len(empties))
+
+    for empty in empties.values():
+        # 手動で削除された(Curveからの参照だけ残っている)か、別のCurveに付け替えられた
+        if empty == None or not empty.users_collection or empty.get("AFT_target_curve") != curve:
+            return False
+
+    for name in hooks.keys():
+        # 手動で削除された
+        if curve.modifiers.get(name) == None:
+            return False
+
+    if AFT_REGISTRY_BONES in curve:
+        armature = curve[AFT_REGISTRY_BONES]
+        if armature == None or not armature.users_collection or armature.get("AFT_target_curve") != curve:
+            return False
+
+    return True
+
+
+# シーンを走査して登録情報を作り直す
+def repair_control_empties_registry(context, curve):
+    profile_count("idprops_read", len(context.view_layer.objects))
+    empties = []
+    armature = None
+    for obj in context.view_layer.objects:
+        # EmptyとArmatureに対してのみ処理が行える
+        if obj == None or obj.type not in ('EMPTY', 'ARMATURE'):
+            continue
+
+        # 対象のCurveかチェック
+        target_curve = obj.get("AFT_target_curve")
+        if target_curve == None or target_curve != curve:
+            continue
+
+        if obj.type == 'ARMATURE':
+            armature = obj
+        else:
+            empties.append(obj)
+
+    # 登録はポイント番号順にしておく(Syncは並び順で番号を引く)
+    empties.sort(key=lambda empty: empty.get("AFT_point_no", -1))
+    hooks = [mod for mod in curve.modifiers if mod.name.startswith((AFT_EMPTY_HOOK_NAME, AFT_BONES_NAME))]
+    hooks.sort(key=lambda hook: hook.object.get("AFT_point_no", -1) if hook.type == 'HOOK' and hook.object else -1)
+    register_control_empties(curve, empties, hooks, armature)
+    return (empties, hooks, armature)
+
+
+# 登録されているEmptyとHookを取得する(壊れていたら作り直す)
+def get_registered_control_empties(context, curve):
+    if not is_control_empties_registry_valid(curve):
+        return repair_control_empties_registry(context, curve)
+
+    empties = list(curve[AFT_REGISTRY_EMPTIES].values())
+    hooks = [curve.modifiers[name] for name in curve[AFT_REGISTRY_HOOKS].keys()]
+    return (empties, hooks, curve.get(AFT_REGISTRY_BONES))
+
+
+# 作成時のポイント位置(Curveローカル)とモードを保存しておく(Syncで差分を取る用)
+def store_control_bind(curve, point_co, point_tilt=None, lod=None):
+    counts = [len(spline.points) for spline_no, spline in get_point_splines(curve.data)]
+    curve[AFT_BIND_NAME] = make_control_bind(point_co, counts, get_spline_layout(curve.data), curve.aft_bind_mode, curve.aft_tilt_sync, point_tilt, lod)
+
+
+# 作成時のポイント位置と今のポイント位置を比べて、変化した範囲を返す
+# (先頭の一致数, 旧ポイントの変化範囲の終わり, 新ポイントの変化範囲の終わり, 番号順のEmpty, 番号順の(Hook名, 番号))
+# 差分で更新できない時はNone
+def diff_control_bind(curve, point_co, eps=1e-5):
+    bind = curve.get(AFT_BIND_NAME)
+    if bind == None or curve.aft_bind_mode != 'HOOK' or bind["bind_mode"] != 'HOOK' or bind["tilt_sync"] != curve.aft_tilt_sync:
+        return None
+    if curve.aft_lod_mode != 'ALL' or "lod" in bind:  # 間引きの結果は全体で決まるので作り直す
+        return None
+    if "layout" not in bind or list(bind["layout"]) != get_spline_layout(curve.data):  # スプラインの追加/削除
+        return None
+    if not is_control_empties_registry_valid(curve):
+        return None
+
+    old_co = np.array(bind["co"], dtype=np.float32).reshape(-1, 3)
+    empties = list(curve[AFT_REGISTRY_EMPTIES].values())
+    hook_items = [(name, no) for name, no in curve[AFT_REGISTRY_HOOKS].items()]
+    old_num = len(old_co)
+    num = len(point_co)
+    if len(empties) != old_num or len(hook_items) != old_num:
+        return None
+
+    # 先頭から一致している数
+    same = min(old_num, num)
+    match = np.all(np.abs(old_co[:same] - point_co[:same]) <= eps, axis=1)
+    head = same if match.all() else int(np.argmin(match))
+
+    # 末尾から一致している数(先頭の一致範囲とは重ねない)
+    rest = same - head
+    match = np.all(np.abs(old_co[old_num - rest:] - point_co[num - rest:]) <= eps, axis=1)[::-1]
+    tail = rest if match.all() else int(np.argmin(match))
+
+    # 触る範囲だけ並び順と番号が合っているか確認する
+    for no in range(head, old_num):
+        if empties[no].get("AFT_point_no") != no or hook_items[no][1] != no:
+            return None
+
+    return (head, old_num - tail, num - tail, empties, hook_items)
+
+
+# 登録情報の修復ボタン
+# 手動でEmptyを削除した時など、登録情報とシーンがずれてしまった時用
+class AHT_FRILL_OT_repair_control_empty(bpy.types.Operator):
+    bl_idname = "aht_frill.repair_control_empty"
+    bl_label = "Repair"
 
-            # 削除対象
-            bpy.data.objects.remove(obj, do_unlink=True)
+    # execute
+    def execute(self, context):
+        for obj in context.selected_objects:
+            if obj.type == 'CURVE':
+                empties, hooks, armature = repair_control_empties_registry(context, obj)
+                self.report({'INFO'}, "%s: Empty %d, Hook %d" % (obj.name, len(empties), len(hooks)))
+        return{'FINISHED'}
 
-        # hookも削除
-        for mod in curve.modifiers:
-            if mod.name.startswith(AFT_EMPTY_HOOK_NAME):
-                curve.modifiers.remove(mod)
 
-        # driverも削除
-        spline = curve.data.splines[0]
-        for no, point in enumerate(spline.points):
-            point.driver_remove('tilt')
+# Tiltの同期(ドライバなし)
+# *************************************************************************************************
+# HANDLERモードのCurve名一覧(Noneの時は次に使う時に作り直す)
+tilt_sync_curve_names = None
+
+def invalidate_tilt_sync_curves(self=None, context=None):
+    global tilt_sync_curve_names
+    tilt_sync_curve_names = None
+
+
+def get_tilt_sync_curves(scene):
+    global tilt_sync_curve_names
+    if tilt_sync_curve_names == None:
+        tilt_sync_curve_names = [obj.name for obj in scene.objects if obj.type == 'CURVE' and obj.aft_tilt_sync == 'HANDLER']
+
+    curves = []
+    for name in tilt_sync_curve_names:
+        curve = scene.objects.get(name)
+        if curve == None or curve.type != 'CURVE' or curve.aft_tilt_sync != 'HANDLER':
+            invalidate_tilt_sync_curves()  # 名前変更や削除があった
+            continue
+        curves.append(curve)
+    return curves
+
+
+# 評価を止めている(凍結中の)Curve名。AnimeFrillGateが管理する
+frozen_curve_names = set()
+
+
+# Emptyのワールド回転Z(ドライバのROT_Zと同じ値)をまとめて計算して、Tiltに一括で書き込む
+def sync_control_empty_tilt(curve, depsgraph):
+    empties = curve.get(AFT_REGISTRY_EMPTIES)
+    if not empties or AFT_CACHE_NAME in curve:  # キャッシュ再生中はキャッシュのTiltを使う
+        return
+    if curve.name in frozen_curve_names:  # 凍結中は書き込んだTiltのまま
+        return
+
+    tilt = read_curve_tilt(curve.data)
+    num = len(tilt)
+
+    matrices = []
+    point_nos = []
+    for empty in empties.values():
+        if empty == None:
+            continue
+        point_no = empty.get("AFT_point_no")
+        if point_no == None or point_no >= num:
+            continue
+        matrices.append(empty.evaluated_get(depsgraph).matrix_world)
+        point_nos.append(point_no)
+
+    if len(matrices) == 0:
+        return
+
+    matrices = np.array(matrices, dtype=np.float32)
+    new_tilt = tilt.copy()
+    new_tilt[point_nos] = np.arctan2(matrices[:, 1, 0], matrices[:, 0, 0])
+
+    # LODの時は間のポイントに前後のコントロールの変化量を補間して足す
+    bind = curve.get(AFT_BIND_NAME)
+    lod = bind.get("lod") if bind != None else None
+    if lod != None and len(lod["tilt"]) == num:
+        rest_tilt = np.array(lod["tilt"], dtype=np.float32)
+        delta = np.zeros(num, dtype=np.float32)
+        delta[point_nos] = new_tilt[point_nos] - rest_tilt[point_nos]
+        weights = np.array(lod["weight"], dtype=np.float32)
+        new_tilt = rest_tilt + delta[np.array(lod["prev"])] * (1 - weights) + delta[np.array(lod["next"])] * weights
+
+    # 変化がなければ書き込まない(depsgraph更新のループ防止)
+    if np.array_equal(new_tilt, tilt):
+        return
+
+    write_curve_points(curve.data, point_tilt=new_tilt)
+    curve.data.update_tag()
+
+
+@persistent
+def tilt_sync_frame_change_post(scene, depsgraph):
+    for curve in get_tilt_sync_curves(scene):
+        sync_control_empty_tilt(curve, depsgraph)
+
+
+@persistent
+def tilt_sync_depsgraph_update_post(scene, depsgraph):
+    curves = get_tilt_sync_curves(scene)
+    if len(curves) == 0:
+        return
+
+    # 動いたEmptyのCurveだけ同期する
+    updated = set()
+    for update in depsgraph.updates:
+        if not update.is_updated_transform or not isinstance(update.id, bpy.types.Object):
+            continue
+        target_curve = update.id.original.get("AFT_target_curve")
+        if target_curve != None:
+            updated.add(target_curve.name)
+
+    for curve in curves:
+        if curve.name in updated:
+            sync_control_empty_tilt(curve, depsgraph)
+
+
+@persistent
+def tilt_sync_load_post(dummy):
+    invalidate_tilt_sync_curves()
 
 
 # リセットボタン
 # *************************************************************************************************
-# Emptyをプロパティを元にリセットする
+# EmptyをCurveに保存したポーズを元にリセットする
 class AHT_FRILL_OT_reset_control_empty(bpy.types.Operator):
     bl_idname = "aht_frill.reset_control_empty"
     bl_label = "Load"
 
     # execute
     def execute(self, context):
-        # アクティブだけじゃなくて選択中のEmpty全部対象にしちゃう
-        for obj in context.selected_objects:
-            if obj == None or obj.type != 'EMPTY':
-                continue
+        # アクティブだけじゃなくて選択中のEmpty全部対象にしちゃう(Curveごとにまとめて処理)
+        pose_name = context.scene.aft_pose_name
+        for curve, empties in group_control_empties(context.selected_objects).values():
+            if not AHT_FRILL_OT_reset_control_empty.reset(curve, empties, pose_name):
+                self.report({'WARNING'}, "%s: ポーズ「%s」がありません" % (curve.name, pose_name))
 
-            # AFT用のEmptyかチェック
-            target_curve = obj.get("AFT_target_curve")
-            if target_curve == None:
-                continue
-
-            # 対象ポイント番号は必ずあるはずだけど、ないと操作しようがないので(フェイルセーフ)
-            point_no = obj.get("AFT_point_no")
-            if point_no == None:
-                continue
-
-            # リセット対象だったのでリセット
-            org_pos = obj.get("AFT_org_pos")
-            if org_pos:
-                obj.location.x = org_pos[0]
-                obj.location.y = org_pos[1]
-                obj.location.z = org_pos[2]
-
-            org_tilt = obj.get("AFT_org_tilt")
-            if org_tilt:
-                obj.rotation_euler[2] = org_tilt * math.pi / 180
- 
         return{'FINISHED'}
 
-
-# プロパティをEmptyの状態で更新する
+    @classmethod
+    def reset(cls, curve, empties, pose_name=AFT_REST_POSE):
+        pose = get_control_pose(curve, pose_name)
+        if pose is None:
+            return False
+
+        # ポーズの配列から、対象の行をまとめて取り出してから書き込む
+        point_nos = np.array([empty["AFT_point_no"] for empty in empties], dtype=np.int64)
+        valid = point_nos < len(pose)
+        rows = pose[point_nos[valid]].tolist()
+        for empty, row in zip([empty for empty, ok in zip(empties, valid) if ok], rows):
+            empty.location = row[:3]
+            empty.rotation_euler[2] = row[3]
+        profile_count("idprops_read", len(empties))
+        return True
+
+
+# ポーズをEmptyの状態で更新する
 class AHT_FRILL_OT_update_control_empty(bpy.types.Operator):
     bl_idname = "aht_frill.update_control_empty"
     bl_label = "Store"
 
     # execute
     def execute(self, context):
-        # アクティブだけじゃなくて選択中のEmpty全部対象にしちゃう
-        for obj in context.selected_objects:
-            if obj == None or obj.type != 'EMPTY':
-                continue
+        # アクティブだけじゃなくて選択中のEmpty全部対象にしちゃう(Curveごとにまとめて処理)
+        pose_name = context.scene.aft_pose_name
+        for curve, empties in group_control_empties(context.selected_objects).values():
+            AHT_FRILL_OT_update_control_empty.store(curve, empties, pose_name)
 
-            # AFT用のEmptyかチェック
-            target_curve = obj.get("AFT_target_curve")
-            if target_curve == None:
-                continue
+        return{'FINISHED'}
 
-            # 対象ポイント番号は必ずあるはずだけど、ないと操作しようがないので(フェイルセーフ)
-            point_no = obj.get("AFT_point_no")
-            if point_no == None:
-                continue
+    @classmethod
+    def store(cls, curve, empties, pose_name=AFT_REST_POSE):
+        # 新しい名前の時はレストポーズ(なければ今のポイント位置)から始める
+        pose = get_control_pose(curve, pose_name)
+        if pose is None:
+            pose = get_control_pose(curve, AFT_REST_POSE)
+        if pose is None:
+            pose = get_rest_pose(curve, *read_curve_points(curve.data))
+
+        point_nos = np.array([empty["AFT_point_no"] for empty in empties], dtype=np.int64)
+        valid = point_nos < len(pose)
+        rows = np.array([(*empty.location, empty.rotation_euler[2]) for empty, ok in zip(empties, valid) if ok], dtype=np.float32).reshape(-1, 4)
+        pose[point_nos[valid]] = rows
+
+        # Curveへの書き込みは1回だけ
+        set_control_pose(curve, pose_name, pose)
+        profile_count("idprops_written")
+        invalidate_panel_state()  # IDプロパティの変更ではdepsgraphが更新されないので、ポーズ一覧を作り直す
+
+
+# 保存したポーズの削除ボタン(レストポーズは消せない)
+class AHT_FRILL_OT_remove_control_pose(bpy.types.Operator):
+    bl_idname = "aht_frill.remove_control_pose"
+    bl_label = "Delete"
+
+    # execute
+    def execute(self, context):
+        pose_name = context.scene.aft_pose_name
+        if pose_name == AFT_REST_POSE:
+            self.report({'ERROR'}, "レストポーズは削除できません")
+            return{'FINISHED'}
 
-            AHT_FRILL_OT_update_control_empty.update(context, obj)
+        for curve, empties in group_control_empties(context.selected_objects).values():
+            poses = curve.get(AFT_POSES_NAME)
+            if poses != None and pose_name in poses:
+                del poses[pose_name]
+        invalidate_panel_state()
 
         return{'FINISHED'}
 
-    @classmethod
-    def update(cls, context, empty):
-        # 更新
-        empty["AFT_org_pos"] = list(empty.location)
-        empty["AFT_org_tilt"] = empty.rotation_euler[2] * 180 / math.pi
-
 
 # アーマチュア設定ボタン
 # *************************************************************************************************
@@ -210,55 +911,206 @@ class AHT_FRILL_OT_create_empty_armature(bpy.types.Operator):
         # 一旦削除
         AHT_FRILL_OT_remove_empty_armature.remove(context)
         # 追加
-        AHT_FRILL_OT_create_empty_armature.create(context, list(selected.groups))
+        mesh = context.view_layer.objects.active
+        with profile_phase("weights.bone_index"):
+            bone_index = build_deform_bone_index(mesh, context.scene.aft_use_name_fallback)
+        AHT_FRILL_OT_create_empty_armature.create(context, list(selected.groups), bone_index)
 
         return{'FINISHED'}
 
     @classmethod
-    def create(cls, context, vertex_groups):
-        mesh = context.view_layer.objects.active
+    def create(cls, context, vertex_groups, bone_index=None):
+        if bone_index == None:
+            bone_index = build_deform_bone_index(context.view_layer.objects.active)
+        profile_count("idprops_read", len(context.selected_objects))
 
-        # アクティブだけじゃなくて選択中のEmpty全部対象にしちゃう
-        for obj in context.selected_objects:
-            if obj == None or obj.type != 'EMPTY':
-                continue
+        # 登録するボーンはどのEmptyでも同じなので先に決めておく
+        targets = []
+        for vg in vertex_groups:
+            armature, bone = bone_index.get(vg.group, (None, None))
 
-            # AFT用のEmptyかチェック
-            target_curve = obj.get("AFT_target_curve")
-            if target_curve == None:
-                continue
+            # コントロールボーンだった
+            if armature == None or bone == None:
+                continue  # 登録しない(デフォームボーンのみ)
 
-            # Armature追加
-            # -----------------------------------------------------------------
-            constraint = obj.constraints.new(type='ARMATURE')
-            constraint.name = AFT_EMPTY_ARMATURE_NAME
-
-            # 頂点グループ全部登録
-            for vg in vertex_groups:
-                weight = vg.weight
-                bone_name = mesh.vertex_groups[vg.group].name
-                armature, bone = find_bones_armature(mesh, bone_name)
-
-                # コントロールボーンだった
-                if armature == None or bone == None:
-                    continue  # 登録しない(デフォームボーンのみ)
-
-                # 頂点グループごとにボーンを設定
-                target = constraint.targets.new()
-                target.target = context.scene.objects.get(armature.name)
-                target.subtarget = bone.name
-                target.weight = weight
-                
+            targets.append((armature, bone.name, vg.weight))
+
+        # 影響の小さいボーンは登録しない
+        targets = prune_armature_targets(targets, context.scene.aft_max_influences, context.scene.aft_min_weight)
 
-def find_bones_armature(mesh, bone_name):
+        # アクティブだけじゃなくて選択中のEmpty全部対象にしちゃう
+        with profile_phase("weights.constraints"):
+            for obj in context.selected_objects:
+                if obj == None or obj.type != 'EMPTY':
+                    continue
+
+                # AFT用のEmptyかチェック
+                target_curve = obj.get("AFT_target_curve")
+                if target_curve == None:
+                    continue
+
+                # Armature追加
+                # -----------------------------------------------------------------
+                add_empty_armature(obj, targets)
+
+
+# EmptyにArmatureコンストレイントを追加する(targetsは (Armatureオブジェクト, ボーン名, ウエイト) のリスト)
+def add_empty_armature(obj, targets):
+    constraint = obj.constraints.new(type='ARMATURE')
+    constraint.name = AFT_EMPTY_ARMATURE_NAME
+    profile_count("constraints_added")
+
+    # 頂点グループごとにボーンを設定
+    for armature, bone_name, weight in targets:
+        target = constraint.targets.new()
+        target.target = armature
+        target.subtarget = bone_name
+        target.weight = weight
+    return constraint
+
+
+# ウエイトの大きい順にmax_influences個まで、min_weight以上のものだけ残す(0なら制限なし)
+# 残したウエイトは元の合計に合わせて正規化しなおす
+def prune_armature_targets(targets, max_influences, min_weight):
+    total = sum(weight for armature, bone_name, weight in targets)
+    pruned = sorted(targets, key=lambda target: target[2], reverse=True)
+    if max_influences > 0:
+        pruned = pruned[:max_influences]
+    pruned = [target for target in pruned if target[2] >= min_weight]
+
+    # 全部消えてしまう時は一番大きいものだけ残す
+    if len(pruned) == 0 and len(targets) > 0:
+        pruned = sorted(targets, key=lambda target: target[2], reverse=True)[:1]
+
+    pruned_total = sum(weight for armature, bone_name, weight in pruned)
+    if pruned_total <= 0:
+        return pruned
+    return [(armature, bone_name, weight * total / pruned_total) for armature, bone_name, weight in pruned]
+
+
+# 頂点グループ番号 → (Armatureオブジェクト, デフォームボーン) の対応表をメッシュごとに1回だけ作る
+# 名前の完全一致を優先し、見つからない時だけ(use_name_fallbackなら)ボーン名が頂点グループ名に含まれるものを探す
+def build_deform_bone_index(mesh, use_name_fallback=True):
+    deform_bones = {}
     for modifier in mesh.modifiers:
         if modifier.type == 'ARMATURE' and modifier.object:
-            armature = modifier.object.data
+            for bone in modifier.object.data.bones:
+                if bone.use_deform and bone.name not in deform_bones:  # 同名なら先のモディファイア優先
+                    deform_bones[bone.name] = (modifier.object, bone)
+
+    bone_index = {}
+    for vertex_group in mesh.vertex_groups:
+        found = deform_bones.get(vertex_group.name)
+
+        # 部分一致は一番長く一致したボーンを使う(短い名前のボーンに誤爆しないように)
+        if found == None and use_name_fallback:
+            matched_len = 0
+            for bone_name, armature_bone in deform_bones.items():
+                if len(bone_name) > matched_len and bone_name in vertex_group.name:
+                    found = armature_bone
+                    matched_len = len(bone_name)
+
+        if found != None:
+            bone_index[vertex_group.index] = found
+
+    return bone_index
+
+# 選択中のEmpty全部に、それぞれ一番近いメッシュ表面のウエイトを設定する
+class AHT_FRILL_OT_transfer_empty_armature(bpy.types.Operator):
+    bl_idname = "aht_frill.transfer_empty_armature"
+    bl_label = "Auto"
+
+    # execute
+    def execute(self, context):
+        mesh = context.view_layer.objects.active
+        if mesh == None or mesh.type != 'MESH':
+            self.report({'ERROR'}, "転送元メッシュをアクティブにしてください")
+            return{'FINISHED'}
+
+        if mesh.mode == 'EDIT':
+            mesh.update_from_editmode()
+
+        # AFT用のEmptyだけ対象
+        empties = [obj for obj in context.selected_objects if obj.type == 'EMPTY' and obj.get("AFT_target_curve") != None]
+        if len(empties) == 0:
+            self.report({'ERROR'}, "転送先のEmptyを選択してください")
+            return{'FINISHED'}
+
+        # 一旦削除
+        AHT_FRILL_OT_remove_empty_armature.remove(context)
+        # 追加
+        with profile_phase("weights.bone_index"):
+            bone_index = build_deform_bone_index(mesh, context.scene.aft_use_name_fallback)
+        AHT_FRILL_OT_transfer_empty_armature.transfer(mesh, empties, bone_index, context.scene.aft_max_influences, context.scene.aft_min_weight)
+
+        return{'FINISHED'}
+
+    @classmethod
+    def transfer(cls, mesh, empties, bone_index, max_influences=0, min_weight=0):
+        # メッシュの三角形をワールド座標でBVHにする(1回だけ)
+        with profile_phase("transfer.bvh"):
+            mesh_data = mesh.data
+            mesh_data.calc_loop_triangles()
+            vertex_co = np.empty(len(mesh_data.vertices) * 3, dtype=np.float32)
+            mesh_data.vertices.foreach_get("co", vertex_co)
+            mesh_mat_world = np.array(mesh.matrix_world, dtype=np.float64)
+            vertex_co = vertex_co.reshape(-1, 3) @ mesh_mat_world[:3, :3].T + mesh_mat_world[:3, 3]
+            triangles = np.empty(len(mesh_data.loop_triangles) * 3, dtype=np.int32)
+            mesh_data.loop_triangles.foreach_get("vertices", triangles)
+            triangles = triangles.reshape(-1, 3)
+            bvh = mathutils.bvhtree.BVHTree.FromPolygons(vertex_co.tolist(), triangles.tolist(), all_triangles=True)
+
+        # Emptyごとに一番近い表面の点を探す
+        with profile_phase("transfer.nearest"):
+            hit_empties = []
+            hit_points = []
+            hit_triangles = []
+            for empty in empties:
+                location, normal, index, distance = bvh.find_nearest(empty.matrix_world.translation)
+                if index == None:
+                    continue
+                hit_empties.append(empty)
+                hit_points.append(location)
+                hit_triangles.append(index)
+        if len(hit_empties) == 0:
+            return
+
+        # 重心座標をまとめて計算
+        hit_points = np.array(hit_points, dtype=np.float64)
+        hit_vertices = triangles[hit_triangles]
+        a, b, c = vertex_co[hit_vertices[:, 0]], vertex_co[hit_vertices[:, 1]], vertex_co[hit_vertices[:, 2]]
+        v0, v1, v2 = b - a, c - a, hit_points - a
+        d00 = np.einsum("ij,ij->i", v0, v0)
+        d01 = np.einsum("ij,ij->i", v0, v1)
+        d11 = np.einsum("ij,ij->i", v1, v1)
+        d20 = np.einsum("ij,ij->i", v2, v0)
+        d21 = np.einsum("ij,ij->i", v2, v1)
+        denom = d00 * d11 - d01 * d01
+        denom[denom == 0] = 1  # 潰れた三角形は頂点aのウエイトを使う
+        v = (d11 * d20 - d01 * d21) / denom
+        w = (d00 * d21 - d01 * d20) / denom
+        barycentric = np.clip(np.stack([1 - v - w, v, w], axis=1), 0, None)
+        barycentric /= np.maximum(barycentric.sum(axis=1, keepdims=True), 1e-12)
+
+        # 使う頂点のデフォームボーンのウエイトだけ取り出しておく
+        with profile_phase("transfer.vertex_weights"):
+            vertex_weights = {}
+            for vertex_no in np.unique(hit_vertices).tolist():
+                vertex_weights[vertex_no] = [(vg.group, vg.weight) for vg in mesh_data.vertices[vertex_no].groups if vg.group in bone_index]
+
+        # 3頂点のウエイトを重心座標で補間してEmptyごとに設定
+        with profile_phase("transfer.constraints"):
+            for empty, vertices, factors in zip(hit_empties, hit_vertices.tolist(), barycentric.tolist()):
+                weights = {}
+                for vertex_no, factor in zip(vertices, factors):
+                    for group, weight in vertex_weights[vertex_no]:
+                        armature, bone = bone_index[group]
+                        key = (armature, bone.name)
+                        weights[key] = weights.get(key, 0) + weight * factor
+
+                targets = [(armature, bone_name, weight) for (armature, bone_name), weight in weights.items() if weight > 0]
+                add_empty_armature(empty, prune_armature_targets(targets, max_influences, min_weight))
 
-            for bone in armature.bones:
-                if bone.use_deform and bone.name in bone_name:
-                    return (armature, bone)
-    return (None, None)
 
 # EmptyからArmatureを削除する
 class AHT_FRILL_OT_remove_empty_armature(bpy.types.Operator):
@@ -288,6 +1140,48 @@ class AHT_FRILL_OT_remove_empty_armature(bpy.types.Operator):
                     obj.constraints.remove(constraint)
 
 
+# シーン中のAFT用EmptyのArmatureコンストレイントを、今の設定で間引きしなおす
+class AHT_FRILL_OT_prune_empty_armature(bpy.types.Operator):
+    bl_idname = "aht_frill.prune_empty_armature"
+    bl_label = "Prune"
+
+    # execute
+    def execute(self, context):
+        count = 0
+        for obj in context.view_layer.objects:
+            if obj == None or obj.type != 'EMPTY':
+                continue
+
+            # AFT用のEmptyかチェック
+            target_curve = obj.get("AFT_target_curve")
+            if target_curve == None:
+                continue
+
+            for constraint in obj.constraints:
+                if constraint.name.startswith(AFT_EMPTY_ARMATURE_NAME):
+                    count += AHT_FRILL_OT_prune_empty_armature.prune(constraint, context.scene.aft_max_influences, context.scene.aft_min_weight)
+
+        self.report({'INFO'}, "%d targets removed" % count)
+        return{'FINISHED'}
+
+    @classmethod
+    def prune(cls, constraint, max_influences, min_weight):
+        targets = [(target.target, target.subtarget, target.weight) for target in constraint.targets]
+        pruned = prune_armature_targets(targets, max_influences, min_weight)
+
+        # 残すものはウエイトを更新、残さないものは削除
+        weights = {(armature, bone_name): weight for armature, bone_name, weight in pruned}
+        removed = 0
+        for target in list(constraint.targets):
+            weight = weights.get((target.target, target.subtarget))
+            if weight == None:
+                constraint.targets.remove(target)
+                removed += 1
+            else:
+                target.weight = weight
+        return removed
+
+
 # ArmatureのEnable/Disable
 # *************************************************************************************************
 class AHT_FRILL_OT_enable_empty_armature(bpy.types.Operator):
@@ -336,6 +1230,122 @@ class AHT_FRILL_OT_disable_empty_armature(bpy.types.Operator):
         return{'FINISHED'}
 
 
+# パネル表示用のキャッシュ
+# *************************************************************************************************
+# drawの度にアクティブオブジェクトやCurveを調べないように、表示に使う値をまとめて持っておく
+# アクティブの変更(msgbus)と、関係するデータの変更(depsgraph_update_post)で捨てて、次のdrawで1回だけ作り直す
+# 再生中は関係するデータが変わっても作り直さず(staleにするだけ)、再生を止めた後の最初のdrawで作り直す
+class FrillPanelState:
+    def __init__(self, active):
+        self.active_name = active.name if active != None else ""
+        self.role = active.type if active != None and active.type in ('CURVE', 'EMPTY', 'MESH') else 'NONE'
+        self.has_bezier = False
+        self.cached = False
+        self.armature = None  # アクティブなEmptyのArmatureコンストレイント(有効数, 全体数)
+        self.rig = None  # リグの統計(アクティブなCurve、またはEmptyの対象のCurve)
+        self.rig_names = set()  # 変更されたら作り直すデータの名前
+        self.stale = False  # 再生中に関係するデータが変更された
+
+        curve = None
+        if self.role == 'CURVE':
+            curve = active
+            self.has_bezier = any(spline.type == 'BEZIER' for spline in curve.data.splines)
+            self.cached = AFT_CACHE_NAME in curve
+        elif self.role == 'EMPTY':
+            curve = active.get("AFT_target_curve")
+            self.armature = count_empty_armature(active)
+            self.rig_names.add(active.name)
+
+        if curve != None:
+            self.rig = get_rig_stats(curve)
+            self.rig_names.update((curve.name, curve.data.name))
+            self.rig_names.update(empty.name for empty in (curve.get(AFT_REGISTRY_EMPTIES) or {}).values() if empty != None)
+
+
+# EmptyのArmatureコンストレイントの(有効数, 全体数)
+def count_empty_armature(empty):
+    enabled = 0
+    total = 0
+    for constraint in empty.constraints:
+        if constraint.name.startswith(AFT_EMPTY_ARMATURE_NAME):
+            total += 1
+            enabled += constraint.enabled
+    return (enabled, total)
+
+
+# リグの統計(登録情報から数えるので、シーンは走査しない)
+def get_rig_stats(curve):
+    empties = [empty for empty in (curve.get(AFT_REGISTRY_EMPTIES) or {}).values() if empty != None]
+    enabled = 0
+    total = 0
+    for empty in empties:
+        empty_enabled, empty_total = count_empty_armature(empty)
+        enabled += empty_enabled
+        total += empty_total
+    poses = curve.get(AFT_POSES_NAME)
+    return {
+        "curve": curve.name,
+        "points": sum(len(spline.points) for spline_no, spline in get_point_splines(curve.data)),
+        "empties": len(empties),
+        "hooks": len(curve.get(AFT_REGISTRY_HOOKS) or {}),
+        "drivers": len(curve.data.animation_data.drivers) if curve.data.animation_data else 0,
+        "constraints": (enabled, total),
+        "bones": AFT_REGISTRY_BONES in curve,
+        "poses": list(poses.keys()) if poses != None else [],
+    }
+
+
+panel_state = None
+panel_state_owner = object()  # msgbusの登録用
+
+
+def invalidate_panel_state(*args):
+    global panel_state
+    panel_state = None
+
+
+def get_panel_state(context):
+    global panel_state
+    active = context.view_layer.objects.active
+
+    screen = context.screen
+    playing = screen != None and screen.is_animation_playing
+
+    # Pythonからアクティブを変えた時はmsgbusが呼ばれないので、名前だけ比べておく
+    if panel_state == None or panel_state.active_name != (active.name if active != None else "") or (panel_state.stale and not playing):
+        panel_state = FrillPanelState(active)
+    return panel_state
+
+
+def subscribe_panel_state():
+    bpy.msgbus.clear_by_owner(panel_state_owner)
+    bpy.msgbus.subscribe_rna(key=(bpy.types.LayerObjects, "active"), owner=panel_state_owner, args=(), notify=invalidate_panel_state)
+
+
+# 表示中のリグに関係するデータか、オブジェクトの追加/削除(コレクションの変更)があった時だけ捨てる
+# 再生中はAFTのハンドラ(HANDLERのTilt同期、揺れ、キャッシュの再生)が毎フレームCurveとEmptyを更新するので、
+# 捨てずにstaleにしておき、毎フレームのdrawでリグの統計を数えなおさないようにする
+@persistent
+def panel_state_depsgraph_update_post(scene, depsgraph):
+    if panel_state == None or panel_state.stale:
+        return
+    for update in depsgraph.updates:
+        if isinstance(update.id, bpy.types.Collection) or update.id.name in panel_state.rig_names:
+            screen = bpy.context.screen
+            if screen != None and screen.is_animation_playing:
+                panel_state.stale = True
+            else:
+                invalidate_panel_state()
+            return
+
+
+# ファイルを開くとmsgbusの登録が消えるので登録しなおす
+@persistent
+def panel_state_load_post(dummy):
+    invalidate_panel_state()
+    subscribe_panel_state()
+
+
 # Main UI
 # ===========================================================================================
 # 3DView Tools Panel
@@ -349,60 +1359,176 @@ class AHT_FRILL_PT_ui(bpy.types.Panel):
 
     def draw(self, context):
         layout = self.layout
+        state = get_panel_state(context)  # アクティブの種類やリグの情報はキャッシュから読む
+        active = context.view_layer.objects.active
 
-        # Curveは1本のみ対応
-        if context.view_layer.objects.active.type == "CURVE":
-            curve = context.view_layer.objects.active
-            if len(curve.data.splines) != 1:
-                layout.label(text="カーブが1本ではありません")
-                return
+        # 複数スプラインはまとめて処理する(Bezierのスプラインは対象外)
+        if state.has_bezier:
+            layout.label(text="Bezierのスプラインは対象外です")
 
         # ボタン表示
         # ---------------------------------------------------------------------
         # リセットボタンが押せるかチェック
         layout.label(text="Empty's transform from property")
         box = layout.box()
-        if context.view_layer.objects.active.type != "EMPTY":  # リセット/更新ボタンはEmpty選択時のみ
+        if state.role != "EMPTY":  # リセット/更新ボタンはEmpty選択時のみ
             box.enabled = False
         row = box.row()
+        row.prop(context.scene, "aft_pose_name")
+        row.operator("aht_frill.remove_control_pose")
+        row = box.row()
         row.operator("aht_frill.reset_control_empty")
         row.operator("aht_frill.update_control_empty")
 
+        # アクティブなEmptyのCurveに保存されているポーズ
+        if state.role == "EMPTY" and state.rig != None and state.rig["poses"]:
+            box.label(text=", ".join(state.rig["poses"]))
+
 
         # ArmatureのON/OFF
         layout.label(text="Enable/Disable Empty's Armature")
         box = layout.box()
-        if context.view_layer.objects.active.type != "EMPTY":  # リセットボタンはEmpty選択時のみ
+        if state.role != "EMPTY":  # リセットボタンはEmpty選択時のみ
             box.enabled = False
         row = box.row()
         row.operator("aht_frill.enable_empty_armature")
         row.operator("aht_frill.disable_empty_armature")
+        if state.armature != None and state.armature[1] > 0:
+            box.label(text="Armature: %d / %d" % state.armature)
 
 
         # 作成と削除ボタンが押せるかチェック
         layout.label(text="Create/Remove Empty from Curve")
         box = layout.box()
-        if context.view_layer.objects.active.type != "CURVE" or context.mode != "OBJECT":  # Create/RemoveはCurve選択時のみ
+        if state.role != "CURVE" or context.mode != "OBJECT":  # Create/RemoveはCurve選択時のみ
+            box.enabled = False
+        elif state.cached:  # キャッシュ再生中はUnbakeしてから
+            box.label(text="キャッシュ再生中です")
             box.enabled = False
         row = box.row()
         row.operator("aht_frill.create_control_empty")
         row.operator("aht_frill.remove_control_empty")
+        box.operator("aht_frill.repair_control_empty")
+        if state.role == "CURVE":
+            box.prop(active, "aft_bind_mode")
+            box.prop(active, "aft_tilt_sync")
+            row = box.row()
+            row.prop(active, "aft_lod_mode")
+            if active.aft_lod_mode == 'NTH':
+                row.prop(active, "aft_lod_step")
+            elif active.aft_lod_mode == 'ERROR':
+                row.prop(active, "aft_lod_tolerance")
+
+        # リグの統計(アクティブなCurveか、アクティブなEmptyのCurve)
+        rig = state.rig
+        if rig != None and rig["empties"] > 0:
+            box = layout.box()
+            box.label(text="%s: %d / %d points" % (rig["curve"], rig["empties"], rig["points"]))
+            row = box.row()
+            row.label(text="Hooks: %d" % rig["hooks"])
+            row.label(text="Drivers: %d" % rig["drivers"])
+            row = box.row()
+            row.label(text="Armature: %d / %d" % rig["constraints"])
+            row.label(text="Bones" if rig["bones"] else "")
 
         # ウエイト設定ボタンが押せるかチェック
         layout.label(text="Empty's weight copy from mesh vertex")
         box = layout.box().row()
         row = box.row()
-        if context.view_layer.objects.active.type != "MESH" or context.mode != "EDIT_MESH":  # 設定ボタンはMesh選択時のみ
+        if state.role != "MESH" or context.mode != "EDIT_MESH":  # 設定ボタンはMesh選択時のみ
             row.enabled = False
         row.operator("aht_frill.create_empty_armature")
 
         row = box.row()
-        if context.view_layer.objects.active.type != "EMPTY":  # リセットボタンはEmpty選択時のみ
+        if state.role != "MESH":  # 自動設定はMeshがアクティブなら編集モードでなくてもよい
+            row.enabled = False
+        row.operator("aht_frill.transfer_empty_armature")
+
+        row = box.row()
+        if state.role != "EMPTY":  # リセットボタンはEmpty選択時のみ
             row.enabled = False
         row.operator("aht_frill.remove_empty_armature")
 
+        # ウエイトの間引き設定
+        box = layout.box()
+        row = box.row()
+        row.prop(context.scene, "aft_max_influences")
+        row.prop(context.scene, "aft_min_weight")
+        row = box.row()
+        row.prop(context.scene, "aft_use_name_fallback")
+        row.operator("aht_frill.prune_empty_armature")
+
 
 # 設定用データ
 # =================================================================================================
 def register():
-    pass
+    # Curveごとの変形方法
+    bpy.types.Object.aft_bind_mode = bpy.props.EnumProperty(
+        name = "Bind",
+        items = [
+            ('HOOK', "Hook", "ポイントごとにHookモディファイアを追加する"),
+            ('ARMATURE', "Armature", "ポイントごとのボーンを持つArmatureを作成し、Armatureモディファイア1つで変形する"),
+        ],
+        default = 'HOOK',
+    )
+
+    # Tiltの同期方法
+    bpy.types.Object.aft_tilt_sync = bpy.props.EnumProperty(
+        name = "Tilt",
+        items = [
+            ('SCRIPTED', "Scripted", "ポイントごとにスクリプトドライバを設定する"),
+            ('SUM', "Sum", "ポイントごとにPythonを使わないドライバを設定する(スクリプトの自動実行が無効でも動く)"),
+            ('HANDLER', "Handler", "ドライバを使わず、フレーム変更/depsgraph更新時にまとめて書き込む"),
+        ],
+        default = 'SCRIPTED',
+        update = invalidate_tilt_sync_curves,
+    )
+
+    # コントロールの間引き
+    bpy.types.Object.aft_lod_mode = bpy.props.EnumProperty(
+        name = "LOD",
+        items = [
+            ('ALL', "All", "すべてのポイントにEmptyを作成する"),
+            ('NTH', "Every Nth", "N個おきのポイントにEmptyを作成する"),
+            ('ERROR', "Tolerance", "間引いた形状とのずれが許容値以下になるポイントを選んでEmptyを作成する"),
+        ],
+        default = 'ALL',
+    )
+    bpy.types.Object.aft_lod_step = bpy.props.IntProperty(name="Step", description="何個おきにEmptyを作成するか", default=4, min=1)
+    bpy.types.Object.aft_lod_tolerance = bpy.props.FloatProperty(name="Tolerance", description="間引いた形状との距離の許容値", default=0.005, min=0, subtype='DISTANCE')
+
+    # Load/Storeするポーズの名前
+    bpy.types.Scene.aft_pose_name = bpy.props.StringProperty(name="Pose", description="Load/Storeするポーズの名前(restはCreate時の位置)", default=AFT_REST_POSE)
+
+    # Armatureコンストレイント作成時の設定
+    bpy.types.Scene.aft_max_influences = bpy.props.IntProperty(name="Max Influences", description="1つのEmptyに登録するボーンの最大数(0なら制限なし)", default=4, min=0)
+    bpy.types.Scene.aft_min_weight = bpy.props.FloatProperty(name="Min Weight", description="これより小さいウエイトのボーンは登録しない", default=0.01, min=0, max=1)
+    bpy.types.Scene.aft_use_name_fallback = bpy.props.BoolProperty(name="Partial Name Match", description="名前が完全一致するボーンがない時、部分一致でも探す", default=True)
+
+    bpy.app.handlers.frame_change_post.append(tilt_sync_frame_change_post)
+    bpy.app.handlers.depsgraph_update_post.append(tilt_sync_depsgraph_update_post)
+    bpy.app.handlers.load_post.append(tilt_sync_load_post)
+
+    subscribe_panel_state()
+    bpy.app.handlers.depsgraph_update_post.append(panel_state_depsgraph_update_post)
+    bpy.app.handlers.load_post.append(panel_state_load_post)
+
+def unregister():
+    bpy.app.handlers.frame_change_post.remove(tilt_sync_frame_change_post)
+    bpy.app.handlers.depsgraph_update_post.remove(tilt_sync_depsgraph_update_post)
+    bpy.app.handlers.load_post.remove(tilt_sync_load_post)
+
+    bpy.msgbus.clear_by_owner(panel_state_owner)
+    bpy.app.handlers.depsgraph_update_post.remove(panel_state_depsgraph_update_post)
+    bpy.app.handlers.load_post.remove(panel_state_load_post)
+    invalidate_panel_state()
+
+    del bpy.types.Scene.aft_use_name_fallback
+    del bpy.types.Scene.aft_min_weight
+    del bpy.types.Scene.aft_max_influences
+    del bpy.types.Scene.aft_pose_name
+    del bpy.types.Object.aft_lod_tolerance
+    del bpy.types.Object.aft_lod_step
+    del bpy.types.Object.aft_lod_mode
+    del bpy.types.Object.aft_tilt_sync
+    del bpy.types.Object.aft_bind_mode
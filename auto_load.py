@@ -1,7 +1,9 @@
 import os
 import bpy
 import sys
+import json
 import typing
+import collections
 import inspect
 import pkgutil
 import importlib
@@ -18,12 +20,22 @@ blender_version = bpy.app.version
 modules = None
 ordered_classes = None
 
+manifest_path = Path(__file__).parent / "__pycache__" / "auto_load_manifest.json"
+
 def init():
     global modules
     global ordered_classes
 
-    modules = get_all_submodules(Path(__file__).parent)
+    directory = Path(__file__).parent
+    key = get_manifest_key(directory)
+    cached = load_manifest(key, directory.name)
+    if cached is not None:
+        modules, ordered_classes = cached
+        return
+
+    modules = get_all_submodules(directory)
     ordered_classes = get_ordered_classes_to_register(modules)
+    save_manifest(key, modules, ordered_classes)
 
 def register():
     for cls in ordered_classes:
@@ -66,6 +78,65 @@ def iter_submodule_names(path, root=""):
             yield root + module_name
 
 
+# Cached manifest
+#################################################
+
+# The manifest stores the module names to import and the ordered class list.
+# It is keyed by the Blender version and the mtime/size of every submodule file,
+# so any edit falls back to the full scan. Modules that have neither classes nor
+# a register() function are not imported at startup (they are imported on use).
+
+def get_manifest_key(directory):
+    files = {}
+    for root, dirnames, filenames in os.walk(directory):
+        dirnames[:] = [name for name in dirnames if name != "__pycache__"]
+        for filename in filenames:
+            if filename.endswith(".py"):
+                path = Path(root) / filename
+                stat = path.stat()
+                files[path.relative_to(directory).as_posix()] = [stat.st_mtime_ns, stat.st_size]
+    return {"blender": list(blender_version), "files": files}
+
+def load_manifest(key, package_name):
+    try:
+        manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    if manifest.get("key") != key:
+        return None
+
+    try:
+        loaded_modules = [importlib.import_module("." + name, package_name) for name in manifest["modules"]]
+        classes = []
+        for module_name, class_name in manifest["classes"]:
+            cls = getattr(sys.modules[module_name], class_name)
+            if not getattr(cls, "is_registered", False):
+                classes.append(cls)
+    except (ImportError, KeyError, AttributeError, ValueError):
+        return None
+    return loaded_modules, classes
+
+def save_manifest(key, modules, ordered_classes):
+    # Classes that were already registered are missing from the list, so it is not complete
+    if any(getattr(cls, "is_registered", False) for cls in iter_register_classes(modules)):
+        return
+
+    package_name = Path(__file__).parent.name
+    class_modules = {cls.__module__ for cls in ordered_classes}
+    needed = [module.__name__[len(package_name) + 1:] for module in modules
+              if module.__name__ == __name__ or module.__name__ in class_modules or hasattr(module, "register")]
+    manifest = {
+        "key": key,
+        "modules": needed,
+        "classes": [[cls.__module__, cls.__qualname__] for cls in ordered_classes],
+    }
+    try:
+        manifest_path.parent.mkdir(exist_ok=True)
+        manifest_path.write_text(json.dumps(manifest), encoding="utf-8")
+    except OSError:
+        pass
+
+
 # Find classes to register
 #################################################
 
@@ -111,11 +182,15 @@ def iter_my_deps_from_parent_id(cls, my_classes_by_idname):
                 yield parent_cls
 
 def iter_my_classes(modules):
+    for cls in iter_register_classes(modules):
+        if not getattr(cls, "is_registered", False):
+            yield cls
+
+def iter_register_classes(modules):
     base_types = get_register_base_types()
     for cls in get_classes_in_modules(modules):
         if any(base in base_types for base in cls.__bases__):
-            if not getattr(cls, "is_registered", False):
-                yield cls
+            yield cls
 
 def get_classes_in_modules(modules):
     classes = set()
@@ -143,15 +218,28 @@ def get_register_base_types():
 #################################################
 
 def toposort(deps_dict):
+    # Kahn's algorithm, ordered by name so that the result is stable
+    def sort_key(value):
+        return (value.__module__, value.__qualname__)
+
+    dependents = {value : [] for value in deps_dict}
+    remaining = {}
+    for value, deps in deps_dict.items():
+        remaining[value] = len(deps)
+        for dep in deps:
+            dependents[dep].append(value)
+
+    ready = collections.deque(sorted((value for value, count in remaining.items() if count == 0), key=sort_key))
     sorted_list = []
-    sorted_values = set()
-    while len(deps_dict) > 0:
-        unsorted = []
-        for value, deps in deps_dict.items():
-            if len(deps) == 0:
-                sorted_list.append(value)
-                sorted_values.add(value)
-            else:
-                unsorted.append(value)
-        deps_dict = {value : deps_dict[value] - sorted_values for value in unsorted}
+    while ready:
+        value = ready.popleft()
+        sorted_list.append(value)
+        for dependent in sorted(dependents[value], key=sort_key):
+            remaining[dependent] -= 1
+            if remaining[dependent] == 0:
+                ready.append(dependent)
+
+    if len(sorted_list) != len(deps_dict):
+        cycle = sorted((value for value, count in remaining.items() if count > 0), key=sort_key)
+        raise ValueError("Cyclic register dependencies: " + ", ".join(value.__qualname__ for value in cycle))
     return sorted_list
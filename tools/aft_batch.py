@@ -0,0 +1,94 @@
+# AnimeFrillTools のバッチ処理ドライバ(Blenderの外で普通のPythonとして実行する)
+#
+#   python tools/aft_batch.py --blender blender --jobs 4 --steps create weights \
+#       --collections Frills --mesh Body --save --report report.json assets/*.blend
+#   python tools/aft_batch.py --steps repair --save assets/*.blend  (シーン全体の整合性チェックと修復だけ)
+#   python tools/aft_batch.py --steps import --rig-file frills.aftrig --save assets/*.blend  (書き出したリグを同じ名前のCurveに作り直す)
+#
+# ファイルごとに blender --background を起動して AnimeFrillBatch.worker_main() を実行し、
+# 各ワーカーが出力したレポート(JSON)を集めて1つのファイルにまとめる
+
+import os, sys, json, time, argparse, subprocess
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+ADDON_DIR = Path(__file__).resolve().parent.parent
+REPORT_PREFIX = "AFT_BATCH_REPORT:"  # AnimeFrillBatch.BATCH_REPORT_PREFIX と同じ
+
+
+def worker_expression():
+    return "; ".join([
+        "import sys, importlib",
+        "sys.path.insert(0, %r)" % str(ADDON_DIR.parent),
+        "importlib.import_module(%r).worker_main()" % (ADDON_DIR.name + ".AnimeFrillBatch"),
+    ])
+
+
+# 1ファイル分のblenderを起動してレポートを受け取る
+def run_file(blender, filepath, job, timeout):
+    command = [blender, "--background", "--factory-startup", str(filepath), "--python-exit-code", "1", "--python-expr", worker_expression(), "--", json.dumps(job)]
+    start = time.perf_counter()
+    try:
+        result = subprocess.run(command, capture_output=True, text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return {"file": str(filepath), "ok": False, "error": "timeout", "wall": time.perf_counter() - start}
+
+    report = None
+    for line in result.stdout.splitlines():
+        if line.startswith(REPORT_PREFIX):
+            report = json.loads(line[len(REPORT_PREFIX):])
+
+    if report == None:
+        report = {"file": str(filepath), "ok": False, "error": "no report (exit code %d)" % result.returncode, "stderr": result.stderr[-2000:]}
+    report["wall"] = time.perf_counter() - start
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="AnimeFrillTools batch processing")
+    parser.add_argument("files", nargs="+", type=Path)
+    parser.add_argument("--blender", default=os.environ.get("BLENDER", "blender"))
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="同時に起動するblenderの数")
+    parser.add_argument("--steps", nargs="+", default=["create"], choices=["check", "repair", "import", "remove", "create", "weights"], help="check/repairはシーン全体の整合性チェック(repairは修復も)、importは--rig-fileの読み込み")
+    parser.add_argument("--curves", nargs="*", default=[], help="対象のCurve名")
+    parser.add_argument("--collections", nargs="*", default=[], help="対象のCurveを含むコレクション名")
+    parser.add_argument("--mesh", help="weightsで使う転送元メッシュ名")
+    parser.add_argument("--bind-mode", choices=["HOOK", "ARMATURE"])
+    parser.add_argument("--tilt-sync", choices=["SCRIPTED", "SUM", "HANDLER"])
+    parser.add_argument("--plan-dir", help="createの計画(JSON)の保存先。入力が同じCurveは保存した計画を再利用する")
+    parser.add_argument("--plan-workers", type=int, help="blenderの中で計画を計算するスレッド数")
+    parser.add_argument("--rig-file", help="importで読み込むリグファイル(.aftrig)")
+    parser.add_argument("--save", action="store_true", help="処理後に.blendを上書き保存する")
+    parser.add_argument("--timeout", type=float, default=None)
+    parser.add_argument("--report", type=Path, help="レポートの出力先(省略時は標準出力)")
+    args = parser.parse_args(argv)
+
+    options = {}
+    if args.bind_mode:
+        options["bind_mode"] = args.bind_mode
+    if args.tilt_sync:
+        options["tilt_sync"] = args.tilt_sync
+    if args.plan_dir:
+        options["plan_dir"] = os.path.abspath(args.plan_dir)
+    if args.plan_workers:
+        options["plan_workers"] = args.plan_workers
+    if args.rig_file:
+        options["rig_file"] = os.path.abspath(args.rig_file)
+    job = {"steps": args.steps, "curves": args.curves, "collections": args.collections, "mesh": args.mesh, "save": args.save, "options": options}
+
+    # 重い処理はblender側なので、こちらはスレッドで子プロセスの終了を待つだけ
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+        reports = list(pool.map(lambda filepath: run_file(args.blender, filepath, job, args.timeout), args.files))
+
+    summary = {"job": job, "files": reports, "failed": sum(1 for report in reports if not report.get("ok")), "total": time.perf_counter() - start}
+    text = json.dumps(summary, indent=2)
+    if args.report:
+        args.report.write_text(text, encoding="utf-8")
+    else:
+        print(text)
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
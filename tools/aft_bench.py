@@ -0,0 +1,987 @@
+# AnimeFrillTools のベンチマーク(Blenderの中で実行する)
+#
+#   blender --background --factory-startup --python tools/aft_bench.py -- \
+#       --points 100 1000 10000 --objects 0 20000 --out bench.json --baseline bench_old.json
+#
+# シーンを手続き的に作って各オペレータの処理時間を測り、JSONに出力する
+# --baseline を指定すると前回の結果と比べ、--threshold 倍より遅くなったものがあれば終了コード1を返す
+#
+# Blenderなしでも、代わりのbpy(tools/fake_bpy.py)でAFT側のPythonの処理とパネルのdrawを測れる
+#
+#   python tools/aft_bench.py --points 100 1000 10000 --objects 0 20000 --out bench_fake.json --baseline bench_fake_old.json
+#
+# この時はBlender本体の評価が要るもの(フレームの評価、Tiltの同期、変形後の形状、キー、リグファイル、起動時間)は測らない
+
+import gc, os, sys, json, time, math, types, argparse, importlib, subprocess, tempfile
+from pathlib import Path
+
+import numpy as np
+try:
+    import bpy, bmesh
+    FAKE_BPY = False
+except ImportError:
+    import fake_bpy
+    bpy = fake_bpy.install()
+    bmesh = None
+    FAKE_BPY = True
+import mathutils
+
+ADDON_DIR = Path(__file__).resolve().parent.parent
+
+
+# アドオンの読み込み
+# *************************************************************************************************
+def load_addon():
+    sys.path.insert(0, str(ADDON_DIR.parent))
+    package = importlib.import_module(ADDON_DIR.name)
+    if not hasattr(bpy.types.Object, "aft_bind_mode"):
+        package.register()
+    return package
+
+
+# シーン作成
+# *************************************************************************************************
+def clear_scene():
+    for collection in (bpy.data.objects, bpy.data.curves, bpy.data.meshes, bpy.data.armatures, bpy.data.actions):
+        bpy.data.batch_remove(list(collection))
+
+
+def select(objects, active=None):
+    view_layer = bpy.context.view_layer
+    for obj in view_layer.objects:
+        obj.select_set(False)
+    for obj in objects:
+        obj.select_set(True)
+    view_layer.objects.active = active if active != None else (objects[0] if objects else None)
+
+
+# 腰回りの円形のフリル
+def make_curve(name, num_points):
+    data = bpy.data.curves.new(name, 'CURVE')
+    data.dimensions = '3D'
+    spline = data.splines.new('POLY')
+    spline.points.add(num_points - 1)
+    spline.use_cyclic_u = True
+
+    angle = np.linspace(0, math.pi * 2, num_points, endpoint=False)
+    co = np.zeros((num_points, 4), dtype=np.float32)
+    co[:, 0] = np.cos(angle) * 0.3
+    co[:, 1] = np.sin(angle) * 0.3
+    co[:, 2] = 1.0
+    co[:, 3] = 1.0
+    spline.points.foreach_set("co", co.ravel())
+    spline.points.foreach_set("tilt", (angle * 0.1).astype(np.float32))
+
+    obj = bpy.data.objects.new(name, data)
+    bpy.context.scene.collection.objects.link(obj)
+    return obj
+
+
+# 縦に並んだボーンで変形する球(高さで頂点グループを分ける)
+# spreadを指定すると、全頂点に全ボーンの小さなウエイトを足す(密なスキンウエイトの再現)
+def make_body(num_bones=8, segments=64, rings=32, spread=0):
+    mesh = bpy.data.meshes.new("Body")
+    if bmesh != None:
+        bm = bmesh.new()
+        bmesh.ops.create_uvsphere(bm, u_segments=segments, v_segments=rings, radius=0.35)
+        bmesh.ops.translate(bm, verts=bm.verts, vec=(0, 0, 1))
+        bm.to_mesh(mesh)
+        bm.free()
+    else:
+        # 代わりのbpyにはbmeshがないので、同じ並びの頂点だけ作る(面はウエイトのコピーには使わない)
+        theta = np.repeat(np.linspace(0, math.pi, rings + 1)[1:-1], segments)
+        phi = np.tile(np.linspace(0, math.pi * 2, segments, endpoint=False), rings - 1)
+        co = np.stack([np.sin(theta) * np.cos(phi), np.sin(theta) * np.sin(phi), np.cos(theta)], axis=1) * 0.35
+        co = np.concatenate([[(0, 0, 0.35)], co, [(0, 0, -0.35)]]) + (0, 0, 1)
+        mesh.from_pydata(co.tolist(), [], [])
+    body = bpy.data.objects.new("Body", mesh)
+    bpy.context.scene.collection.objects.link(body)
+
+    armature_data = bpy.data.armatures.new("Rig")
+    rig = bpy.data.objects.new("Rig", armature_data)
+    bpy.context.scene.collection.objects.link(rig)
+    select([rig])
+    bpy.ops.object.mode_set(mode='EDIT')
+    height = 0.7 / num_bones
+    for no in range(num_bones):
+        bone = armature_data.edit_bones.new("Bone_%d" % no)
+        bone.head = (0, 0, 0.65 + height * no)
+        bone.tail = (0, 0, 0.65 + height * (no + 1))
+    bpy.ops.object.mode_set(mode='OBJECT')
+
+    # となりのボーンと半分ずつ混ぜる
+    z = np.array([v.co.z for v in mesh.vertices])
+    position = np.clip((z - 0.65) / height - 0.5, 0, num_bones - 1)
+    groups = [body.vertex_groups.new(name="Bone_%d" % no) for no in range(num_bones)]
+    for index, p in enumerate(position.tolist()):
+        low = int(math.floor(p))
+        high = min(low + 1, num_bones - 1)
+        groups[low].add([index], 1 - (p - low), 'REPLACE')
+        if high != low:
+            groups[high].add([index], p - low, 'REPLACE')
+    if spread > 0:
+        for group in groups:
+            group.add(list(range(len(mesh.vertices))), spread, 'ADD')
+
+    modifier = body.modifiers.new("Armature", 'ARMATURE')
+    modifier.object = rig
+    return (body, rig)
+
+
+# AFTと関係ないオブジェクトを増やす
+def make_filler(num_objects):
+    collection = bpy.context.scene.collection
+    for no in range(num_objects):
+        collection.objects.link(bpy.data.objects.new("Filler", None))
+
+
+# 計測
+# *************************************************************************************************
+# 測っている間はGCを止める(前のsetupで作ったオブジェクトの分のGCが入ると、どちらが速いか入れ替わるほどぶれる)
+def measure(name, params, setup, run, repeat, teardown=None):
+    times = []
+    for _ in range(repeat):
+        state = setup()
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            run(state)
+            times.append(time.perf_counter() - start)
+        finally:
+            gc.enable()
+        if teardown != None:
+            teardown(state)
+    result = {"name": name, "params": params, "seconds": min(times), "repeat": repeat}
+    print("%-32s %-40s %10.4f s" % (name, json.dumps(params, sort_keys=True), result["seconds"]), flush=True)
+    return result
+
+
+def created_curve(num_points, bind_mode='HOOK', tilt_sync='SCRIPTED', num_objects=0):
+    aft = sys.modules[ADDON_DIR.name + ".AnimeFrillTools"]
+    clear_scene()
+    make_filler(num_objects)
+    curve = make_curve("Frill", num_points)
+    curve.aft_bind_mode = bind_mode
+    curve.aft_tilt_sync = tilt_sync
+    aft.AHT_FRILL_OT_create_control_empty.create(bpy.context, curve)
+    return curve
+
+
+def bench_operators(points, objects, repeat, frames):
+    aft = sys.modules[ADDON_DIR.name + ".AnimeFrillTools"]
+    context = bpy.context
+    results = []
+
+    for num_points in points:
+        # Create / Remove
+        for bind_mode in ('HOOK', 'ARMATURE'):
+            def setup():
+                clear_scene()
+                curve = make_curve("Frill", num_points)
+                curve.aft_bind_mode = bind_mode
+                select([curve])
+                return curve
+            results.append(measure("create_control_empty", {"points": num_points, "bind_mode": bind_mode}, setup,
+                lambda curve: aft.AHT_FRILL_OT_create_control_empty.create(context, curve), repeat))
+
+        for num_objects in objects:
+            results.append(measure("remove_control_empty", {"points": num_points, "objects": num_objects},
+                lambda: created_curve(num_points, num_objects=num_objects),
+                lambda curve: aft.AHT_FRILL_OT_remove_control_empty.remove(context, curve), repeat))
+
+            # 登録情報がない(古いファイル)時の走査込み
+            def setup_stale():
+                curve = created_curve(num_points, num_objects=num_objects)
+                del curve[aft.AFT_REGISTRY_EMPTIES]
+                return curve
+            results.append(measure("remove_control_empty_rescan", {"points": num_points, "objects": num_objects}, setup_stale,
+                lambda curve: aft.AHT_FRILL_OT_remove_control_empty.remove(context, curve), repeat))
+
+        # Reset / Store / Enable / Disable (選択中のEmpty全部)
+        def setup_selected():
+            curve = created_curve(num_points)
+            empties = list(curve[aft.AFT_REGISTRY_EMPTIES].values())
+            select(empties)
+            return curve
+        for name, operator in (("reset_control_empty", bpy.ops.aht_frill.reset_control_empty), ("update_control_empty", bpy.ops.aht_frill.update_control_empty),
+                               ("enable_empty_armature", bpy.ops.aht_frill.enable_empty_armature), ("disable_empty_armature", bpy.ops.aht_frill.disable_empty_armature)):
+            results.append(measure(name, {"points": num_points}, setup_selected, lambda curve, operator=operator: operator(), repeat))
+
+        # Append (1頂点のウエイトをコピー) / Auto (最寄り面から)
+        def setup_weights():
+            curve = created_curve(num_points)
+            body, rig = make_body()
+            empties = list(curve[aft.AFT_REGISTRY_EMPTIES].values())
+            select(empties, body)
+            return (body, empties)
+        def run_append(state):
+            body, empties = state
+            groups = list(body.data.vertices[len(body.data.vertices) // 2].groups)
+            aft.AHT_FRILL_OT_create_empty_armature.create(context, groups, aft.build_deform_bone_index(body))
+        def run_auto(state):
+            body, empties = state
+            aft.AHT_FRILL_OT_transfer_empty_armature.transfer(body, empties, aft.build_deform_bone_index(body), 4, 0.01)
+        results.append(measure("create_empty_armature", {"points": num_points}, setup_weights, run_append, repeat))
+        if FAKE_BPY:
+            continue  # 最寄り面の検索(BVHTree)とフレームの評価はBlenderでしか測れない
+        results.append(measure("transfer_empty_armature", {"points": num_points}, setup_weights, run_auto, repeat))
+
+        # 再生(フレームごとの評価)
+        for bind_mode, tilt_sync in (('HOOK', 'SCRIPTED'), ('HOOK', 'SUM'), ('HOOK', 'HANDLER'), ('ARMATURE', 'SCRIPTED')):
+            def run_frames(curve):
+                scene = context.scene
+                for frame in range(1, frames + 1):
+                    scene.frame_set(frame)
+            results.append(measure("frame_evaluation", {"points": num_points, "bind_mode": bind_mode, "tilt_sync": tilt_sync, "frames": frames},
+                lambda: created_curve(num_points, bind_mode, tilt_sync), run_frames, repeat))
+
+    return results
+
+
+# 比較用: 一括で作る前の、1ポイントずつのCreate(Empty、リセット用のEmptyごとのプロパティ、Hook、SCRIPTEDドライバ)
+# 作ったEmptyとHookを返す
+def create_per_point(curve):
+    spline = curve.data.splines[0]
+    curve_mat_world = curve.matrix_world
+
+    empties = []
+    for no, point in enumerate(spline.points):
+        empty = bpy.data.objects.new("AFT_Empty", None)
+        curve.users_collection[0].objects.link(empty)
+        empty.parent = curve
+        empty.empty_display_size = 0.05
+        empty.location = (curve_mat_world @ point.co).xyz
+        empty.rotation_euler[2] = point.tilt
+        empty.show_in_front = True
+        empty["AFT_target_curve"] = curve
+        empty["AFT_point_no"] = no
+        empty["AFT_org_pos"] = list(empty.location)
+        empty["AFT_org_tilt"] = empty.rotation_euler[2] * 180 / math.pi
+        empties.append(empty)
+
+    hooks = []
+    for no, point in enumerate(spline.points):
+        hook = curve.modifiers.new("AFT_Hook", 'HOOK')
+        hook.object = empties[no]
+        hook.vertex_indices_set([no])
+        hook.matrix_inverse = mathutils.Matrix.Translation(-point.co.xyz)
+        hooks.append(hook)
+
+    for no, point in enumerate(spline.points):
+        driver = point.driver_add('tilt')
+        driver.driver.type = 'SCRIPTED'
+        var = driver.driver.variables.new()
+        var.name = 'var'
+        var.type = 'TRANSFORMS'
+        var.targets[0].id = empties[no]
+        var.targets[0].transform_type = 'ROT_Z'
+        driver.driver.expression = 'var'
+    return (empties, hooks)
+
+
+# 作った結果のうち、1ポイントずつのCreateと同じになるところ(Emptyの位置と回転、Hookの頂点、ドライバの対象)
+# Hookのmatrix_inverseはEmptyの回転も打ち消すように直したので比べない
+def describe_created(curve, empties, hooks):
+    drivers = curve.data.animation_data.drivers
+    return (
+        np.array([(*empty.location, empty.rotation_euler[2]) for empty in empties], dtype=np.float64),
+        [list(hook.vertex_indices) for hook in hooks],
+        sorted((driver.data_path, driver.driver.type, driver.driver.expression, driver.driver.variables[0].targets[0].id["AFT_point_no"]) for driver in drivers),
+    )
+
+
+# 一括のCreateと1ポイントずつのCreateの時間の比(speedup、1より小さいと speedup_ok で失敗)と、同じ結果になっているか(per_point_match_ok)
+def bench_create_speedup(points, repeat):
+    aft = sys.modules[ADDON_DIR.name + ".AnimeFrillTools"]
+    context = bpy.context
+    results = []
+    for num_points in points:
+        def setup():
+            clear_scene()
+            return make_curve("Frill", num_points)
+        params = {"points": num_points}
+        reference = measure("create_control_empty_per_point", params, setup, create_per_point, repeat)
+        result = measure("create_control_empty_bulk", params, setup, lambda curve: aft.AHT_FRILL_OT_create_control_empty.create(context, curve), repeat)
+        result["speedup"] = reference["seconds"] / max(result["seconds"], 1e-12)
+        result["speedup_ok"] = result["speedup"] >= 1
+
+        curve = setup()
+        expected = describe_created(curve, *create_per_point(curve))
+        curve = setup()
+        aft.AHT_FRILL_OT_create_control_empty.create(context, curve)
+        actual = describe_created(curve, *aft.get_registered_control_empties(context, curve)[:2])
+        result["per_point_match_ok"] = bool(np.allclose(expected[0], actual[0], atol=1e-5) and expected[1:] == actual[1:])
+        print("%-32s x%.1f%s, match %s" % ("", result["speedup"], "" if result["speedup_ok"] else " (slower)", "ok" if result["per_point_match_ok"] else "FAILED"), flush=True)
+        results += [reference, result]
+    return results
+
+
+# Tiltの同期(SCRIPTED/SUM/HANDLER): Emptyを回してフレームを進め、TiltがEmptyのワールド行列のZ回転と同じか
+def bench_tilt_sync(points, repeat):
+    aft = sys.modules[ADDON_DIR.name + ".AnimeFrillTools"]
+    context = bpy.context
+    scene = context.scene
+    results = []
+    for num_points in points:
+        for tilt_sync in ('SCRIPTED', 'SUM', 'HANDLER'):
+            def setup():
+                curve = created_curve(num_points, tilt_sync=tilt_sync)
+                empties = list(curve[aft.AFT_REGISTRY_EMPTIES].values())
+                for empty, rotation in zip(empties, np.random.default_rng(0).uniform(-3, 3, len(empties)).tolist()):
+                    empty.rotation_euler[2] = rotation
+                return (curve, empties)
+            def run(state):
+                scene.frame_set(scene.frame_current + 1)
+            result = measure("tilt_sync", {"points": num_points, "tilt_sync": tilt_sync}, setup, run, repeat)
+
+            curve, empties = setup()
+            run((curve, empties))
+            depsgraph = context.evaluated_depsgraph_get()
+            tilt = aft.read_curve_tilt(curve.evaluated_get(depsgraph).data)
+            matrices = np.array([empty.evaluated_get(depsgraph).matrix_world for empty in empties], dtype=np.float64)
+            expected = np.arctan2(matrices[:, 1, 0], matrices[:, 0, 0])
+            error = (tilt[[empty["AFT_point_no"] for empty in empties]] - expected + math.pi) % (2 * math.pi) - math.pi
+            result["tilt_error"] = float(np.abs(error).max())
+            result["tilt_sync_ok"] = result["tilt_error"] < 1e-4
+            print("%-32s max error %.2e, %s" % ("", result["tilt_error"], "ok" if result["tilt_sync_ok"] else "FAILED"), flush=True)
+            results.append(result)
+    return results
+
+
+# Armatureコンストレイントの間引き: 間引く前と後の再生時間と、ボーンを動かした時のEmptyの位置の差
+# 間引いた後の位置の差がtolerance以下なら prune_ok
+def bench_prune(points, frames, repeat, tolerance):
+    aft = sys.modules[ADDON_DIR.name + ".AnimeFrillTools"]
+    context = bpy.context
+    scene = context.scene
+    results = []
+
+    def setup(num_points, prune):
+        curve = created_curve(num_points)
+        body, rig = make_body(spread=0.005)
+        empties = list(curve[aft.AFT_REGISTRY_EMPTIES].values())
+        aft.AHT_FRILL_OT_transfer_empty_armature.transfer(body, empties, aft.build_deform_bone_index(body))
+        if prune:
+            for empty in empties:
+                for constraint in empty.constraints:
+                    if constraint.name.startswith(aft.AFT_EMPTY_ARMATURE_NAME):
+                        aft.AHT_FRILL_OT_prune_empty_armature.prune(constraint, scene.aft_max_influences, scene.aft_min_weight)
+
+        # ボーンごとに違う向きに回す
+        for no, bone in enumerate(rig.pose.bones):
+            bone.rotation_mode = 'XYZ'
+            bone.rotation_euler = (0.3 * math.sin(no), 0.3 * math.cos(no), 0.2 * no)
+        return empties
+    def run_frames(empties):
+        for frame in range(1, frames + 1):
+            scene.frame_set(frame)
+    def get_positions(empties):
+        depsgraph = context.evaluated_depsgraph_get()
+        return np.array([empty.evaluated_get(depsgraph).matrix_world.translation for empty in empties], dtype=np.float64)
+    def count_targets(empties):
+        return sum(len(constraint.targets) for empty in empties for constraint in empty.constraints)
+
+    for num_points in points:
+        for prune in (False, True):
+            results.append(measure("prune_frame_evaluation", {"points": num_points, "pruned": prune, "frames": frames},
+                lambda prune=prune: setup(num_points, prune), run_frames, repeat))
+
+        empties = setup(num_points, False)
+        full_targets, full_positions = count_targets(empties), get_positions(empties)
+        empties = setup(num_points, True)
+        result = results[-1]
+        result["targets"] = (full_targets, count_targets(empties))
+        result["position_error"] = float(np.linalg.norm(get_positions(empties) - full_positions, axis=1).max())
+        result["prune_ok"] = result["position_error"] <= tolerance
+        print("%-32s targets %d -> %d, max error %.2e, %s" % ("", full_targets, result["targets"][1], result["position_error"], "ok" if result["prune_ok"] else "FAILED"), flush=True)
+    return results
+
+
+# コントロールのEmptyにキーを打つ(フレームごとに評価が走るように)
+def animate_empties(curve, frames):
+    aft = sys.modules[ADDON_DIR.name + ".AnimeFrillTools"]
+    for no, empty in enumerate(curve[aft.AFT_REGISTRY_EMPTIES].values()):
+        empty.keyframe_insert("location", frame=1)
+        empty.keyframe_insert("rotation_euler", index=2, frame=1)
+        empty.location.z += 0.05 * math.sin(no)
+        empty.rotation_euler.z += 0.3
+        empty.keyframe_insert("location", frame=frames)
+        empty.keyframe_insert("rotation_euler", index=2, frame=frames)
+
+
+# なめらかな変形をコントロールに与えた時の、全ポイントに与えた時との形状の差(最大距離)
+def lod_shape_error(curve):
+    aft = sys.modules[ADDON_DIR.name + ".AnimeFrillTools"]
+    num = len(curve.data.splines[0].points)
+    rest = np.empty(num * 4, dtype=np.float32)
+    curve.data.splines[0].points.foreach_get("co", rest)
+    rest = rest.reshape(num, 4)[:, :3].astype(np.float64)
+
+    def wave(co):
+        offset = np.zeros_like(co)
+        offset[:, 2] = 0.05 * np.sin(3 * np.arctan2(co[:, 1], co[:, 0]))
+        return offset
+
+    rest_pose = aft.get_control_pose(curve, aft.AFT_REST_POSE)
+    for empty in curve[aft.AFT_REGISTRY_EMPTIES].values():
+        co = rest_pose[[empty["AFT_point_no"]], :3].astype(np.float64)
+        empty.location = (co + wave(co))[0]
+
+    # 評価済みのCurveのポイントは変形前のままなので、Hookを適用したCurveで比べる
+    point_co = aft.read_deformed_curve_points(curve, bpy.context.evaluated_depsgraph_get())[0]
+    return float(np.linalg.norm(point_co[:, :3] - (rest + wave(rest)), axis=1).max())
+
+
+# LOD(間引き)ごとのコントロール数、再生時間、形状の誤差
+def bench_lod(points, frames, repeat):
+    aft = sys.modules[ADDON_DIR.name + ".AnimeFrillTools"]
+    context = bpy.context
+    results = []
+    for num_points in points:
+        for lod_mode, lod_step, lod_tolerance in (('ALL', 1, 0), ('NTH', 5, 0), ('NTH', 10, 0), ('ERROR', 1, 0.002)):
+            def setup():
+                clear_scene()
+                curve = make_curve("Frill", num_points)
+                curve.aft_tilt_sync = 'HANDLER'
+                curve.aft_lod_mode = lod_mode
+                curve.aft_lod_step = lod_step
+                curve.aft_lod_tolerance = lod_tolerance
+                aft.AHT_FRILL_OT_create_control_empty.create(context, curve)
+                return curve
+            def setup_animated():
+                curve = setup()
+                animate_empties(curve, frames)
+                return curve
+            def run_frames(curve):
+                scene = context.scene
+                for frame in range(1, frames + 1):
+                    scene.frame_set(frame)
+            params = {"points": num_points, "lod_mode": lod_mode, "lod_step": lod_step, "lod_tolerance": lod_tolerance, "frames": frames}
+            result = measure("lod_frame_evaluation", params, setup_animated, run_frames, repeat)
+
+            curve = setup()
+            result["controls"] = len(curve[aft.AFT_REGISTRY_EMPTIES])
+            result["shape_error"] = lod_shape_error(curve)
+            print("%-32s controls %d, shape error %.6f" % ("", result["controls"], result["shape_error"]), flush=True)
+            results.append(result)
+    return results
+
+
+# ポーズのLoad/Store(Curve 1本の全Empty)と、Emptyごとのプロパティからの移行
+def bench_poses(num_empties, repeat):
+    aft = sys.modules[ADDON_DIR.name + ".AnimeFrillTools"]
+    results = []
+
+    def setup():
+        curve = created_curve(num_empties, tilt_sync='HANDLER')
+        return (curve, list(curve[aft.AFT_REGISTRY_EMPTIES].values()))
+    results.append(measure("pose_store", {"empties": num_empties}, setup,
+        lambda state: aft.AHT_FRILL_OT_update_control_empty.store(state[0], state[1], "wind"), repeat))
+    results.append(measure("pose_load", {"empties": num_empties}, setup,
+        lambda state: aft.AHT_FRILL_OT_reset_control_empty.reset(state[0], state[1], aft.AFT_REST_POSE), repeat))
+
+    # 以前のバージョンと同じEmptyごとのプロパティを作ってから移行する
+    # 元のアドオンで作ったファイルと同じく、Curve側の登録情報もない状態にする
+    def setup_legacy():
+        curve, empties = setup()
+        for empty in empties:
+            empty.location.x += 0.01  # 今のポイントの位置とは違う値にしておく
+            empty["AFT_org_pos"] = list(empty.location)
+            empty["AFT_org_tilt"] = empty.rotation_euler[2] * 180 / math.pi
+        for name in (aft.AFT_POSES_NAME, aft.AFT_REGISTRY_EMPTIES, aft.AFT_REGISTRY_HOOKS):
+            del curve[name]
+        return (curve, empties)
+    result = measure("pose_migrate", {"empties": num_empties}, setup_legacy, lambda state: aft.migrate_control_poses(state[0]), repeat)
+
+    # 移行したレストポーズがEmptyごとの値と同じか
+    curve, empties = setup_legacy()
+    expected = np.array([(*empty.location, empty.rotation_euler[2]) for empty in empties], dtype=np.float32)
+    pose = aft.get_control_pose(curve, aft.AFT_REST_POSE)
+    result["migrate_ok"] = pose is not None and np.allclose(pose[[empty["AFT_point_no"] for empty in empties]], expected, atol=1e-5)
+    print("%-32s migrate %s" % ("", "ok" if result["migrate_ok"] else "FAILED"), flush=True)
+    results.append(result)
+    return results
+
+
+# 計画(bpyなし)と書き込みに分けた時のそれぞれの時間
+# 計画は1本ずつ順に計算した時と、全Curveまとめてスレッドプールで計算した時を比べる(LODの時が一番重い)
+def bench_plan(points, num_curves, repeat):
+    aft = sys.modules[ADDON_DIR.name + ".AnimeFrillTools"]
+    planner = sys.modules[ADDON_DIR.name + ".AnimeFrillPlan"]
+    results = []
+    for num_points in points:
+        def setup():
+            clear_scene()
+            curves = [make_curve("Frill", num_points) for no in range(num_curves)]
+            for curve in curves:
+                curve.aft_lod_mode = 'ERROR'
+            return curves
+        def setup_inputs():
+            return [aft.read_curve_input(curve) for curve in setup()]
+        def setup_plans():
+            curves = setup()
+            return (curves, planner.plan_curves([aft.read_curve_input(curve) for curve in curves]))
+        def run_apply(state):
+            for curve, plan in zip(*state):
+                aft.AHT_FRILL_OT_create_control_empty.apply(bpy.context, curve, plan)
+
+        params = {"points": num_points, "curves": num_curves}
+        results.append(measure("plan_serial", params, setup_inputs, lambda inputs: [planner.plan_control_empties(curve_input) for curve_input in inputs], repeat))
+        results.append(measure("plan_threads", params, setup_inputs, planner.plan_curves, repeat))
+        results.append(measure("plan_apply", params, setup_plans, run_apply, repeat))
+    return results
+
+
+# 整合性チェック(関係ないオブジェクトの多いシーンで、複製したCurveと手で消したEmptyを直す)
+def bench_integrity(num_objects, repeat):
+    aft = sys.modules[ADDON_DIR.name + ".AnimeFrillTools"]
+    integrity = sys.modules[ADDON_DIR.name + ".AnimeFrillIntegrity"]
+    results = []
+
+    def setup():
+        curves = [created_curve(100, num_objects=num_objects)]
+        for no in range(9):
+            curve = make_curve("Frill", 100)
+            aft.AHT_FRILL_OT_create_control_empty.create(bpy.context, curve)
+            curves.append(curve)
+
+        # Curveだけ複製(Hook、ドライバ、登録情報が複製元のEmptyを指したまま)
+        for curve in curves[:3]:
+            duplicate = curve.copy()
+            duplicate.data = curve.data.copy()
+            bpy.context.scene.collection.objects.link(duplicate)
+
+        # Emptyを手で消す(Hookとドライバの対象がなくなる)
+        for curve in curves[3:6]:
+            empties = list(curve[aft.AFT_REGISTRY_EMPTIES].values())
+            bpy.data.batch_remove(empties[::10])
+        return bpy.context.scene
+
+    params = {"objects": num_objects}
+    results.append(measure("integrity_scan", params, setup, integrity.scan_scene_integrity, repeat))
+    results.append(measure("integrity_repair", params, setup, lambda scene: integrity.check_scene_integrity(scene, True), repeat))
+    return results
+
+
+# キーフレームの書き込み速度(キー/秒)。1つずつkeyframe_insertした時と比べる(こちらは少ないEmptyで測る)
+def bench_keying(num_empties, frames, repeat):
+    aft = sys.modules[ADDON_DIR.name + ".AnimeFrillTools"]
+    keying = sys.modules[ADDON_DIR.name + ".AnimeFrillKeying"]
+    context = bpy.context
+    results = []
+
+    def setup():
+        curve = created_curve(num_empties, tilt_sync='HANDLER')
+        empties = list(curve[aft.AFT_REGISTRY_EMPTIES].values())
+        values = np.random.default_rng(0).standard_normal((frames, len(empties), 4)).cumsum(axis=0).astype(np.float32) * 0.01
+        return (empties, values)
+    def add_rate(result, keys):
+        result["keys"] = keys
+        result["keys_per_second"] = keys / result["seconds"]
+        print("%-32s %d keys, %.0f keys/s" % ("", keys, result["keys_per_second"]), flush=True)
+        return result
+
+    keys = num_empties * frames * len(keying.KEY_CHANNELS)
+    params = {"empties": num_empties, "frames": frames}
+    results.append(add_rate(measure("keys_write", params, setup, lambda state: keying.write_control_keys(state[0], range(1, frames + 1), state[1]), repeat), keys))
+    results.append(measure("keys_write_thin", params, setup, lambda state: keying.write_control_keys(state[0], range(1, frames + 1), state[1], 0.005), repeat))
+
+    # 書き込みはframesの範囲のキーだけ置き換えて、範囲外のキー、モディファイア、外挿の設定を残すかを keep_ok に入れる
+    empties, values = setup()
+    keying.write_control_keys(empties, range(1, frames + 11), np.zeros((frames + 10, len(empties), 4), dtype=np.float32))
+    fcurves = [empty.animation_data.action.fcurves.find(data_path, index=index) for empty in empties for data_path, index in keying.KEY_CHANNELS]
+    for fcurve in fcurves:
+        fcurve.modifiers.new('CYCLES')
+        fcurve.extrapolation = 'LINEAR'
+    keying.write_control_keys(empties, range(1, frames + 1), values)
+    after = [empty.animation_data.action.fcurves.find(data_path, index=index) for empty in empties for data_path, index in keying.KEY_CHANNELS]
+    keyed = []
+    for fcurve in after:
+        co = np.empty(len(fcurve.keyframe_points) * 2, dtype=np.float32)
+        fcurve.keyframe_points.foreach_get("co", co)
+        keyed.append(co.reshape(-1, 2))
+    result = results[-2]
+    result["keep_ok"] = bool(all(fcurve == old and len(fcurve.modifiers) == 1 and fcurve.extrapolation == 'LINEAR' for fcurve, old in zip(after, fcurves))
+        and all(len(co) == frames + 10 and np.array_equal(co[:, 0], np.arange(1, frames + 11)) and not co[frames:, 1].any() for co in keyed)
+        and np.allclose(np.array([co[:frames, 1] for co in keyed]), values.transpose(1, 2, 0).reshape(-1, frames)))
+    print("%-32s keep %s" % ("", "ok" if result["keep_ok"] else "FAILED"), flush=True)
+
+    def run_insert(state):
+        for no in range(1, frames + 1):
+            keying.AHT_FRILL_OT_key_control_empty.key(state[0], no)
+    results.append(add_rate(measure("keys_insert_bulk", params, setup, run_insert, repeat), keys))
+
+    # 比較用: Emptyとフレームごとにkeyframe_insert
+    num_insert = min(num_empties, 100)
+    def run_keyframe_insert(state):
+        for no in range(1, frames + 1):
+            for empty in state[0][:num_insert]:
+                empty.keyframe_insert("location", frame=no)
+                empty.keyframe_insert("rotation_euler", index=2, frame=no)
+    results.append(add_rate(measure("keys_keyframe_insert", {"empties": num_insert, "frames": frames}, setup, run_keyframe_insert, repeat), num_insert * frames * 4))
+
+    results.append(measure("keys_bake", params, setup, lambda state: keying.AHT_FRILL_OT_bake_control_keys.bake(context, state[0], range(1, frames + 1)), repeat))
+
+    # 打ってあるキーの間引き(Thin)。F-Curveを作り直さないので、モディファイアとキーの補間の種類が残り、
+    # 間引いた後のF-Curveの値が元の値からtolerance以内に収まっているかを thin_ok に入れる
+    tolerance = 0.005
+    def setup_keyed():
+        empties, values = setup()
+        keying.write_control_keys(empties, range(1, frames + 1), values)
+        fcurves = [empty.animation_data.action.fcurves.find(data_path, index=index) for empty in empties for data_path, index in keying.KEY_CHANNELS]
+        for fcurve in fcurves[::2]:
+            fcurve.modifiers.new('NOISE').strength = 0.1
+            for point in fcurve.keyframe_points:
+                point.interpolation = 'LINEAR'
+        expected = [[fcurve.evaluate(frame) for frame in range(1, frames + 1)] for fcurve in fcurves]
+        return (empties, fcurves, np.array(expected))
+    result = measure("keys_thin", params, setup_keyed, lambda state: keying.AHT_FRILL_OT_thin_control_keys.thin(state[0], tolerance), repeat)
+
+    empties, fcurves, expected = setup_keyed()
+    removed = keying.AHT_FRILL_OT_thin_control_keys.thin(empties, tolerance)
+    after = [empty.animation_data.action.fcurves.find(data_path, index=index) for empty in empties for data_path, index in keying.KEY_CHANNELS]
+    error = np.abs(np.array([[fcurve.evaluate(frame) for frame in range(1, frames + 1)] for fcurve in after]) - expected)
+    kept = all(fcurve == old and len(fcurve.modifiers) == (1 if no % 2 == 0 else 0) for no, (fcurve, old) in enumerate(zip(after, fcurves)))
+    linear = all(point.interpolation == 'LINEAR' for fcurve in after[::2] for point in fcurve.keyframe_points)
+    result["removed"] = removed
+    result["thin_ok"] = bool(removed > 0 and kept and linear and error.max() <= tolerance + 1e-5)
+    print("%-32s thin %s (%d removed, max error %.6f)" % ("", "ok" if result["thin_ok"] else "FAILED", removed, error.max()), flush=True)
+    results.append(result)
+    return results
+
+
+# パネル表示用のキャッシュ(作り直し1回と、キャッシュがある時のdraw 1000回分の取得)
+def bench_panel_state(num_empties, frames, repeat):
+    aft = sys.modules[ADDON_DIR.name + ".AnimeFrillTools"]
+    context = bpy.context
+
+    def setup():
+        curve = created_curve(num_empties, tilt_sync='HANDLER')
+        select([next(iter(curve[aft.AFT_REGISTRY_EMPTIES].values()))])
+        aft.invalidate_panel_state()
+        return context.view_layer.objects.active
+    def run_cached(active):
+        aft.get_panel_state(context)
+        for no in range(1000):
+            aft.get_panel_state(context)
+
+    params = {"empties": num_empties}
+    results = [
+        measure("panel_state_build", params, setup, aft.FrillPanelState, repeat),
+        measure("panel_state_cached_x1000", params, setup, run_cached, repeat),
+    ]
+    if not FAKE_BPY:
+        return results
+
+    # 再生中(代わりのbpyの時だけ。Blenderのバックグラウンドでは再生できない)
+    # HANDLERのTilt同期は毎フレームCurveのデータを更新するので、そのdepsgraph更新とdrawでの取得をフレーム数分行う
+    # 再生中は作り直さず、止めた後の最初の取得で作り直しているかを playback_ok に入れる
+    def send_curve_update(active):
+        fake_bpy.send_depsgraph_update([fake_bpy.DepsgraphUpdate(active["AFT_target_curve"].data, geometry=True)])
+    def run_playback(active):
+        context.screen = types.SimpleNamespace(is_animation_playing=True)
+        for frame in range(frames):
+            send_curve_update(active)
+            aft.get_panel_state(context)
+        context.screen = None
+    result = measure("panel_state_playback", dict(params, frames=frames), setup, run_playback, repeat)
+
+    active = setup()
+    state = aft.get_panel_state(context)
+    context.screen = types.SimpleNamespace(is_animation_playing=True)
+    send_curve_update(active)
+    playing_state = aft.get_panel_state(context)
+    context.screen = None
+    result["playback_ok"] = playing_state is state and aft.get_panel_state(context) is not state
+    print("%-32s playback %s" % ("", "ok" if result["playback_ok"] else "FAILED"), flush=True)
+    results.append(result)
+    return results
+
+
+# パネルのdraw(代わりのbpyの時だけ。Blenderのバックグラウンドでは描けない)
+# アクティブがCurve/Empty/なしの時に、メインパネルとサブパネルを全部開いて描く
+# 最初の1回(キャッシュの作り直し込み)と、キャッシュがある時の100回分を測る
+def bench_panel_draw(points, objects, repeat):
+    aft = sys.modules[ADDON_DIR.name + ".AnimeFrillTools"]
+    context = bpy.context
+    results = []
+    for num_points in points:
+        for num_objects in objects:
+            for role in ('CURVE', 'EMPTY', 'NONE'):
+                def setup():
+                    curve = created_curve(num_points, num_objects=num_objects)
+                    active = {'CURVE': curve, 'EMPTY': next(iter(curve[aft.AFT_REGISTRY_EMPTIES].values())), 'NONE': None}[role]
+                    select([active] if active != None else [])
+                    aft.invalidate_panel_state()
+                    return active
+                def run_cached(active):
+                    fake_bpy.draw_panels(context)
+                    for no in range(100):
+                        fake_bpy.draw_panels(context)
+
+                params = {"points": num_points, "objects": num_objects, "role": role}
+                results.append(measure("panel_draw", params, setup, lambda active: fake_bpy.draw_panels(context), repeat))
+                results.append(measure("panel_draw_cached_x100", params, setup, run_cached, repeat))
+    return results
+
+
+# リグの書き出し/読み込み(Curveをまとめて作り直す時間と、ファイルサイズ)
+# 読み込んだ後に、Empty/Hookの数、ポーズ、Armatureコンストレイントが書き出し元と同じかを roundtrip_ok に入れる
+def bench_rig(points, num_curves, repeat):
+    aft = sys.modules[ADDON_DIR.name + ".AnimeFrillTools"]
+    rig_io = sys.modules[ADDON_DIR.name + ".AnimeFrillRig"]
+    context = bpy.context
+    filepath = os.path.join(tempfile.mkdtemp(), "bench.aftrig")
+    results = []
+
+    def make_scene(num_points):
+        clear_scene()
+        body, rig = make_body()
+        curves = [make_curve("Frill_%d" % no, num_points) for no in range(num_curves)]
+        return (body, curves)
+    def snapshot(curves):
+        state = {}
+        for curve in curves:
+            empties, hooks, armature = aft.get_registered_control_empties(context, curve)
+            poses = aft.get_control_poses(curve)
+            targets = sum(len(constraint.targets) for empty in empties for constraint in empty.constraints)
+            state[curve.name] = (len(empties), len(hooks), targets, {name: np.array(pose) for name, pose in (poses or {}).items()})
+        return state
+    def is_same(a, b):
+        return a.keys() == b.keys() and all(a[name][:3] == b[name][:3] and a[name][3].keys() == b[name][3].keys()
+            and all(np.allclose(a[name][3][key], b[name][3][key]) for key in a[name][3]) for name in a)
+    # 変形後のポイント(座標, Tilt)とレストポーズ
+    def deformed(curves):
+        depsgraph = context.evaluated_depsgraph_get()
+        return {curve.name: (*aft.read_deformed_curve_points(curve, depsgraph), aft.get_control_pose(curve, aft.AFT_REST_POSE)) for curve in curves}
+
+    for num_points in points:
+        def setup_export():
+            body, curves = make_scene(num_points)
+            for curve in curves:
+                aft.AHT_FRILL_OT_create_control_empty.create(context, curve)
+                empties = list(curve[aft.AFT_REGISTRY_EMPTIES].values())
+                aft.AHT_FRILL_OT_transfer_empty_armature.transfer(body, empties, aft.build_deform_bone_index(body), 4, 0.01)
+                aft.AHT_FRILL_OT_update_control_empty.store(curve, empties, "wind")
+            return curves
+        params = {"points": num_points, "curves": num_curves}
+        results.append(measure("rig_export", params, setup_export,
+            lambda curves: rig_io.save_rig_file(filepath, [rig_io.export_rig(context, curve) for curve in curves]), repeat))
+        curves = setup_export()
+        expected = snapshot(curves)
+        rig_io.save_rig_file(filepath, [rig_io.export_rig(context, curve) for curve in curves])
+
+        # 同じCurveに読み込む(保存した計画を使う)時と、Curveを動かして計画しなおす時
+        def setup_import(moved=False):
+            body, curves = make_scene(num_points)
+            for curve in curves:
+                curve.location.x = 0.1 if moved else 0.0
+            context.view_layer.update()  # matrix_worldを更新する
+            return curves
+        def run_import(curves):
+            rigs = rig_io.load_rig_file(filepath)
+            curve_names = {curve.name: curve for curve in curves}
+            return rig_io.import_rigs(context, rigs, [curve_names[rig["curve"]] for rig in rigs])
+        result = measure("rig_import", params, setup_import, run_import, repeat)
+        result["bytes"] = os.path.getsize(filepath)
+        curves = setup_import()
+        run_import(curves)
+        result["roundtrip_ok"] = is_same(expected, snapshot(curves))
+        print("%-32s %d bytes, roundtrip %s" % ("", result["bytes"], "ok" if result["roundtrip_ok"] else "FAILED"), flush=True)
+        results.append(result)
+
+        # 動かしたCurveに読み込んだ結果が、そのCurveで作り直した時と同じ形とレストポーズになるか
+        result = measure("rig_import_replan", params, lambda: setup_import(True), run_import, repeat)
+        curves = setup_import(True)
+        for curve in curves:
+            aft.AHT_FRILL_OT_create_control_empty.create(context, curve)
+        context.view_layer.update()
+        expected = deformed(curves)
+        curves = setup_import(True)
+        run_import(curves)
+        context.view_layer.update()
+        actual = deformed(curves)
+        result["replan_ok"] = all(np.allclose(expected[name][0], actual[name][0], atol=1e-4) and np.allclose(expected[name][1], actual[name][1], atol=1e-4)
+            and np.allclose(expected[name][2], actual[name][2], atol=1e-5) for name in expected)
+        print("%-32s replan %s" % ("", "ok" if result["replan_ok"] else "FAILED"), flush=True)
+        results.append(result)
+    return results
+
+
+def bench_auto_load(repeat):
+    package = sys.modules[ADDON_DIR.name]
+    auto_load = sys.modules[ADDON_DIR.name + ".auto_load"]
+    results = []
+
+    # 登録済みの状態から unregister → register
+    def run_register(state):
+        package.unregister()
+        package.register()
+    results.append(measure("auto_load.register", {}, lambda: None, run_register, repeat))
+
+    # 登録済みのクラスはinit()で拾われないので、一旦外してから測る
+    results.append(measure("auto_load.init", {}, lambda: package.unregister(), lambda state: auto_load.init(), repeat, lambda state: package.register()))
+    return results
+
+
+# 起動時間(別のBlenderを起動して、アドオンのimport(= auto_load.init())とregisterの時間を測る)
+# cold: マニフェストなし(全モジュールを走査) / warm: マニフェストあり
+STARTUP_PREFIX = "AFT_STARTUP:"
+
+def bench_startup(repeat):
+    auto_load = sys.modules[ADDON_DIR.name + ".auto_load"]
+    expression = "; ".join([
+        "import sys, time, json, importlib",
+        "sys.path.insert(0, %r)" % str(ADDON_DIR.parent),
+        "start = time.perf_counter()",
+        "package = importlib.import_module(%r)" % ADDON_DIR.name,
+        "imported = time.perf_counter()",
+        "package.register()",
+        "print(%r + json.dumps({'init': imported - start, 'register': time.perf_counter() - imported}))" % STARTUP_PREFIX,
+    ])
+    command = [bpy.app.binary_path, "--background", "--factory-startup", "--python-exit-code", "1", "--python-expr", expression]
+
+    def run_child():
+        output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+        for line in output.splitlines():
+            if line.startswith(STARTUP_PREFIX):
+                return json.loads(line[len(STARTUP_PREFIX):])
+        raise RuntimeError("startup report not found")
+
+    results = []
+    for name in ("cold", "warm"):
+        times = []
+        for _ in range(repeat):
+            if name == "cold" and auto_load.manifest_path.exists():
+                auto_load.manifest_path.unlink()
+            times.append(run_child())
+        for phase in ("init", "register"):
+            result = {"name": "startup." + phase, "params": {"manifest": name}, "seconds": min(t[phase] for t in times), "repeat": repeat}
+            print("%-32s %-40s %10.4f s" % (result["name"], json.dumps(result["params"]), result["seconds"]), flush=True)
+            results.append(result)
+    return results
+
+
+# 揺れソルバ単体(chains x points x frames / 秒)
+def bench_jiggle(chains, points, frames, repeat):
+    jiggle = sys.modules[ADDON_DIR.name + ".AnimeFrillJiggle"]
+    settings = {"stiffness": 200, "link_stiffness": 400, "damping": 5, "gravity": (0, 0, -9.8), "substeps": 4, "collider": (np.zeros(3), 0.2)}
+    results = []
+    for num_points in points:
+        def setup():
+            rest = np.zeros((chains * num_points, 3))
+            rest[:, 0] = np.tile(np.arange(num_points) * 0.01, chains)
+            rest[:, 1] = np.repeat(np.arange(chains) * 0.1, num_points)
+            edges = np.array([(c * num_points + i, c * num_points + i + 1) for c in range(chains) for i in range(num_points - 1)], dtype=np.int64).reshape(-1, 2)
+            rest_length = np.linalg.norm(rest[edges[:, 1]] - rest[edges[:, 0]], axis=1)
+            return (rest.copy(), np.zeros_like(rest), rest, edges, rest_length)
+        def run(state):
+            for frame in range(frames):
+                jiggle.step_jiggle(*state, settings, 1 / 24)
+        result = measure("jiggle_step", {"chains": chains, "points": num_points, "frames": frames}, setup, run, repeat)
+        result["throughput"] = chains * num_points * frames / max(result["seconds"], 1e-12)
+        results.append(result)
+    if FAKE_BPY:
+        return results
+
+    # ベイク(Blenderの時だけ。代わりのbpyはキーを持たない)
+    # シーンのフレーム範囲外のキーとF-Curveのモディファイアが残り、範囲内にキーが入っているかを bake_ok に入れる
+    aft = sys.modules[ADDON_DIR.name + ".AnimeFrillTools"]
+    scene = bpy.context.scene
+    def setup_bake():
+        curve = created_curve(points[0], tilt_sync='HANDLER')
+        scene.frame_start = 1
+        scene.frame_end = frames
+        empties = list(curve[aft.AFT_REGISTRY_EMPTIES].values())
+        for empty in empties:
+            empty.keyframe_insert("location", frame=frames + 10)
+            empty.keyframe_insert("rotation_euler", index=2, frame=frames + 10)
+            empty.animation_data.action.fcurves.find("location", index=0).modifiers.new('NOISE')
+        select([curve])
+        return empties
+    params = {"points": points[0], "frames": frames}
+    result = measure("jiggle_bake", params, setup_bake, lambda empties: bpy.ops.aht_frill.bake_jiggle(), repeat)
+    empties = setup_bake()
+    bpy.ops.aht_frill.bake_jiggle()
+    fcurves = [(data_path, index, empty.animation_data.action.fcurves.find(data_path, index=index)) for empty in empties for data_path, index in (("location", 0), ("location", 1), ("location", 2), ("rotation_euler", 2))]
+    result["bake_ok"] = bool(all(len(fcurve.keyframe_points) == frames + 1 and fcurve.keyframe_points[-1].co[0] == frames + 10
+        and len(fcurve.modifiers) == (1 if (data_path, index) == ("location", 0) else 0) and not fcurve.mute for data_path, index, fcurve in fcurves))
+    print("%-32s bake %s" % ("", "ok" if result["bake_ok"] else "FAILED"), flush=True)
+    results.append(result)
+    return results
+
+
+# 前回の結果との比較
+# *************************************************************************************************
+def result_key(result):
+    return result["name"] + json.dumps(result["params"], sort_keys=True)
+
+
+def compare_baseline(results, baseline, threshold):
+    baseline_times = {result_key(result): result["seconds"] for result in baseline.get("results", [])}
+    regressions = []
+    for result in results:
+        base = baseline_times.get(result_key(result))
+        if base == None or base <= 0:
+            continue
+        result["baseline"] = base
+        result["ratio"] = result["seconds"] / base
+        if result["ratio"] > threshold:
+            regressions.append(result)
+    return regressions
+
+
+def main():
+    if FAKE_BPY:
+        argv = sys.argv[1:]
+    else:
+        argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+    parser = argparse.ArgumentParser(description="AnimeFrillTools benchmark")
+    parser.add_argument("--points", nargs="+", type=int, default=[100, 1000])
+    parser.add_argument("--objects", nargs="+", type=int, default=[0, 5000])
+    parser.add_argument("--speedup-points", nargs="+", type=int, default=[10000], help="一括のCreateと1ポイントずつのCreateを比べるポイント数")
+    parser.add_argument("--frames", type=int, default=24)
+    parser.add_argument("--pose-empties", type=int, default=10000)
+    parser.add_argument("--plan-curves", type=int, default=20)
+    parser.add_argument("--key-empties", type=int, default=1000)
+    parser.add_argument("--prune-tolerance", type=float, default=0.005, help="Armatureコンストレイントを間引いた時に許すEmptyの位置の差")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--out", type=Path)
+    parser.add_argument("--baseline", type=Path)
+    parser.add_argument("--threshold", type=float, default=1.2, help="この倍率より遅くなったら失敗にする")
+    args = parser.parse_args(argv)
+
+    load_addon()
+    if FAKE_BPY:
+        results = bench_operators(args.points, args.objects, args.repeat, args.frames) + bench_create_speedup(args.speedup_points, args.repeat) + bench_poses(args.pose_empties, args.repeat) + bench_plan(args.points, args.plan_curves, args.repeat) + bench_panel_state(args.pose_empties, args.frames, args.repeat) + bench_panel_draw(args.points, args.objects, args.repeat) + bench_jiggle(30, args.points, args.frames, args.repeat) + bench_auto_load(args.repeat)
+    else:
+        results = bench_operators(args.points, args.objects, args.repeat, args.frames) + bench_create_speedup(args.speedup_points, args.repeat) + bench_tilt_sync(args.points, args.repeat) + bench_prune(args.points, args.frames, args.repeat, args.prune_tolerance) + bench_lod(args.points, args.frames, args.repeat) + bench_poses(args.pose_empties, args.repeat) + bench_plan(args.points, args.plan_curves, args.repeat) + bench_integrity(max(args.objects), args.repeat) + bench_keying(args.key_empties, args.frames, args.repeat) + bench_panel_state(args.pose_empties, args.frames, args.repeat) + bench_rig(args.points, args.plan_curves, args.repeat) + bench_jiggle(30, args.points, args.frames, args.repeat) + bench_auto_load(args.repeat) + bench_startup(args.repeat)
+    # パネルのdrawはUIがないと呼べないので、Blenderのバックグラウンドではキャッシュの作成と取得だけ測る
+
+    report = {"blender": bpy.app.version_string, "args": {key: str(value) for key, value in vars(args).items()}, "results": results}
+    regressions = []
+    if args.baseline:
+        regressions = compare_baseline(results, json.loads(args.baseline.read_text(encoding="utf-8")), args.threshold)
+        report["regressions"] = [result_key(result) for result in regressions]
+        for result in regressions:
+            print("REGRESSION %s: %.4f s -> %.4f s (x%.2f)" % (result_key(result), result["baseline"], result["seconds"], result["ratio"]))
+
+    # 結果の確認(*_ok)が通らなかった時も失敗にする
+    checks_failed = [result_key(result) for result in results if any(key.endswith("_ok") and value == False for key, value in result.items())]
+    if checks_failed:
+        report["checks_failed"] = checks_failed
+        for key in checks_failed:
+            print("CHECK FAILED %s" % key)
+
+    text = json.dumps(report, indent=2)
+    if args.out:
+        args.out.write_text(text, encoding="utf-8")
+    else:
+        print(text)
+
+    if regressions or checks_failed:
+        sys.exit(1)
+
+
+main()
@@ -0,0 +1,1530 @@
+# Blenderなしでベンチマークを動かすための、最小限の bpy / mathutils の代わり
+#
+#   python tools/aft_bench.py --points 100 1000 10000 --objects 0 20000 --out bench_fake.json
+#
+# aft_bench.py は bpy がimportできない時に install() してから、アドオンをそのまま読み込む
+# オブジェクト、Curve、モディファイア、コンストレイント、ドライバ、IDプロパティ、オペレータとパネルの登録、UILayoutを
+# AFTが使う範囲だけPythonで持つ(depsgraphの評価、Hookの変形、ドライバの計算、ファイルの保存はしない)
+# 測れるのはAFT側のPythonの処理(計画、ループ、IDプロパティの読み書き、drawの分岐)の時間で、Blender本体のデータ操作の時間は入らない
+# なので結果はBlenderで測ったものとではなく、この代わりで測った前回の結果と比べる
+
+import sys, os, re, math, types, tempfile
+import numpy as np
+
+
+# mathutils
+# *************************************************************************************************
+def vector_axis(index):
+    def get(self):
+        return float(self.values[index])
+    def set(self, value):
+        self.values[index] = value
+    return property(get, set)
+
+
+class Vector:
+    def __init__(self, values=(0.0, 0.0, 0.0)):
+        self.values = np.array(values, dtype=np.float64)
+
+    # 配列をそのまま参照する(Object.location などへの書き込みが元の配列に反映される)
+    @classmethod
+    def view(cls, values):
+        vector = cls.__new__(cls)
+        vector.values = values
+        return vector
+
+    x = vector_axis(0)
+    y = vector_axis(1)
+    z = vector_axis(2)
+    w = vector_axis(3)
+
+    @property
+    def xyz(self):
+        return Vector(self.values[:3])
+
+    @property
+    def length(self):
+        return float(np.linalg.norm(self.values))
+
+    def __len__(self):
+        return len(self.values)
+
+    def __iter__(self):
+        return iter(self.values.tolist())
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return tuple(self.values[key].tolist())
+        return float(self.values[key])
+
+    def __setitem__(self, key, value):
+        self.values[key] = value
+
+    def __array__(self, dtype=None, copy=None):
+        return np.array(self.values, dtype=dtype)
+
+    def __add__(self, other):
+        return Vector(self.values + np.asarray(tuple(other), dtype=np.float64))
+
+    def __sub__(self, other):
+        return Vector(self.values - np.asarray(tuple(other), dtype=np.float64))
+
+    def __mul__(self, scalar):
+        return Vector(self.values * scalar)
+
+    __rmul__ = __mul__
+
+    def __neg__(self):
+        return Vector(-self.values)
+
+    def __matmul__(self, other):
+        return float(np.dot(self.values, np.asarray(tuple(other), dtype=np.float64)))
+
+    def __eq__(self, other):
+        return np.array_equal(self.values, np.asarray(tuple(other), dtype=np.float64))
+
+    __hash__ = None
+
+    def normalized(self):
+        return Vector(self.values / max(np.linalg.norm(self.values), 1e-30))
+
+    def copy(self):
+        return Vector(self.values)
+
+    def to_tuple(self):
+        return tuple(self.values.tolist())
+
+    def __repr__(self):
+        return "Vector(%s)" % (self.to_tuple(),)
+
+
+class Matrix:
+    def __init__(self, rows=None):
+        self.values = np.identity(4) if rows is None else np.array(rows, dtype=np.float64)
+
+    @classmethod
+    def Identity(cls, size):
+        return cls(np.identity(size))
+
+    @classmethod
+    def Translation(cls, vector):
+        matrix = cls()
+        matrix.values[:3, 3] = tuple(vector)[:3]
+        return matrix
+
+    @classmethod
+    def Rotation(cls, angle, size, axis):
+        c = math.cos(angle)
+        s = math.sin(angle)
+        rotation = {
+            'X': [[1, 0, 0], [0, c, -s], [0, s, c]],
+            'Y': [[c, 0, s], [0, 1, 0], [-s, 0, c]],
+            'Z': [[c, -s, 0], [s, c, 0], [0, 0, 1]],
+        }[axis]
+        matrix = cls(np.identity(size))
+        matrix.values[:3, :3] = rotation
+        return matrix
+
+    @property
+    def translation(self):
+        return Vector.view(self.values[:3, 3])
+
+    @translation.setter
+    def translation(self, vector):
+        self.values[:3, 3] = tuple(vector)[:3]
+
+    def __len__(self):
+        return len(self.values)
+
+    def __iter__(self):
+        return (Vector.view(row) for row in self.values)
+
+    def __getitem__(self, index):
+        return Vector.view(self.values[index])
+
+    def __array__(self, dtype=None, copy=None):
+        return np.array(self.values, dtype=dtype)
+
+    # 4x4 @ 3次元のベクトルは位置として変換する(mathutilsと同じ)
+    def __matmul__(self, other):
+        if isinstance(other, Matrix):
+            return Matrix(self.values @ other.values)
+        vector = np.asarray(tuple(other), dtype=np.float64)
+        if len(vector) == 3 and len(self.values) == 4:
+            return Vector((self.values @ np.append(vector, 1.0))[:3])
+        return Vector(self.values @ vector)
+
+    def __eq__(self, other):
+        return isinstance(other, Matrix) and np.array_equal(self.values, other.values)
+
+    __hash__ = None
+
+    def inverted(self):
+        return Matrix(np.linalg.inv(self.values))
+
+    def to_3x3(self):
+        return Matrix(self.values[:3, :3])
+
+    def copy(self):
+        return Matrix(self.values)
+
+    def __repr__(self):
+        return "Matrix(%s)" % self.values.tolist()
+
+
+# 総当たりで探す(AFTはポイント数分の検索しかしないので足りる)
+class KDTree:
+    def __init__(self, size):
+        self.co = np.zeros((size, 3))
+        self.indices = np.zeros(size, dtype=np.int64)
+        self.count = 0
+
+    def insert(self, co, index):
+        self.co[self.count] = tuple(co)[:3]
+        self.indices[self.count] = index
+        self.count += 1
+
+    def balance(self):
+        self.co = self.co[:self.count]
+        self.indices = self.indices[:self.count]
+
+    def find_n(self, co, n):
+        distances = np.linalg.norm(self.co - np.asarray(tuple(co)[:3], dtype=np.float64), axis=1)
+        n = min(n, len(distances))
+        if n == 0:
+            return []
+        order = np.argpartition(distances, n - 1)[:n]
+        order = order[np.argsort(distances[order], kind="stable")]
+        return [(Vector(self.co[no]), int(self.indices[no]), float(distances[no])) for no in order.tolist()]
+
+    def find(self, co):
+        found = self.find_n(co, 1)
+        return found[0] if found else (None, None, None)
+
+
+# bpy.props
+# *************************************************************************************************
+class PropertyDeferred:
+    def __init__(self, function, keywords):
+        self.function = function
+        self.keywords = keywords
+
+    def __repr__(self):
+        return "<%s, %r>" % (self.function.__name__, self.keywords)
+
+
+PROPERTY_DEFAULTS = {
+    "BoolProperty": False, "IntProperty": 0, "FloatProperty": 0.0, "StringProperty": "", "EnumProperty": "",
+    "PointerProperty": None, "CollectionProperty": None,
+    "BoolVectorProperty": False, "IntVectorProperty": 0, "FloatVectorProperty": 0.0,
+}
+
+
+def make_property_function(name):
+    def function(**keywords):
+        return PropertyDeferred(function, keywords)
+    function.__name__ = name
+    return function
+
+
+def get_property_default(deferred):
+    name = deferred.function.__name__
+    keywords = deferred.keywords
+    if "default" in keywords:
+        return keywords["default"]
+    if name == "EnumProperty":
+        if 'ENUM_FLAG' in keywords.get("options", ()):
+            return set()
+        items = keywords.get("items")
+        return items[0][0] if isinstance(items, (list, tuple)) and items else ""
+    if name.endswith("VectorProperty"):
+        return (PROPERTY_DEFAULTS[name],) * keywords.get("size", 3)
+    return PROPERTY_DEFAULTS[name]
+
+
+# bpy.types.Object.xxx = bpy.props.XxxProperty(...) で登録したプロパティ(インスタンスごとの値と、変更時のupdate)
+class RNAProperty:
+    def __init__(self, name, deferred):
+        self.name = name
+        self.key = "rna:" + name
+        self.deferred = deferred
+        self.default = get_property_default(deferred)
+        self.update = deferred.keywords.get("update")
+
+    def __get__(self, obj, owner):
+        if obj is None:
+            return self
+        if self.key not in obj.__dict__ and deferred_is_collection(self.deferred):
+            obj.__dict__[self.key] = []
+        return obj.__dict__.get(self.key, self.default)
+
+    def __set__(self, obj, value):
+        obj.__dict__[self.key] = value
+        if self.update != None:
+            self.update(obj, context)
+
+
+def deferred_is_collection(deferred):
+    return deferred.function.__name__ == "CollectionProperty"
+
+
+class RNAMeta(type):
+    def __setattr__(cls, name, value):
+        if isinstance(value, PropertyDeferred):
+            value = RNAProperty(name, value)
+        super().__setattr__(name, value)
+
+
+# アノテーションで宣言したプロパティ(オペレータ)の初期値
+def get_annotation_defaults(cls):
+    defaults = {}
+    for base in reversed(cls.__mro__):
+        for name, value in vars(base).get("__annotations__", {}).items():
+            if isinstance(value, PropertyDeferred):
+                defaults[name] = [] if deferred_is_collection(value) else get_property_default(value)
+    return defaults
+
+
+# bpy.types の登録用の基底クラス
+# *************************************************************************************************
+class StructRNA(metaclass=RNAMeta):
+    is_registered = False
+
+
+class Operator(StructRNA):
+    def report(self, type, message):
+        print("%s: %s" % ("/".join(sorted(type)), message))
+
+
+class Panel(StructRNA):
+    pass
+
+
+class PropertyGroup(StructRNA):
+    pass
+
+
+class AddonPreferences(StructRNA):
+    pass
+
+
+class Header(StructRNA):
+    pass
+
+
+class Menu(StructRNA):
+    pass
+
+
+class UIList(StructRNA):
+    pass
+
+
+class Node(StructRNA):
+    pass
+
+
+class NodeSocket(StructRNA):
+    pass
+
+
+class NodeTree(StructRNA):
+    pass
+
+
+class RenderEngine(StructRNA):
+    pass
+
+
+class Gizmo(StructRNA):
+    pass
+
+
+class GizmoGroup(StructRNA):
+    pass
+
+
+# bpy_extras.io_utils
+class ExportHelper:
+    filepath: make_property_function("StringProperty")(name="File Path", subtype='FILE_PATH')
+    check_existing: make_property_function("BoolProperty")(name="Check Existing", default=True, options={'HIDDEN'})
+
+    def invoke(self, context, event):
+        return {'RUNNING_MODAL'}
+
+
+class ImportHelper:
+    filepath: make_property_function("StringProperty")(name="File Path", subtype='FILE_PATH')
+
+    def invoke(self, context, event):
+        return {'RUNNING_MODAL'}
+
+
+# IDプロパティ
+# *************************************************************************************************
+# Blenderと同じく、配列はステップ付きのスライスで読めない
+class IDPropertyArray(list):
+    def __getitem__(self, key):
+        if isinstance(key, slice) and key.step not in (None, 1):
+            raise TypeError("only slices with step 1 supported")
+        return list.__getitem__(self, key)
+
+    def to_list(self):
+        return list(self)
+
+
+class IDPropertyGroup(dict):
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, to_id_property(value))
+
+    def to_dict(self):
+        return {key: value.to_dict() if isinstance(value, IDPropertyGroup) else value for key, value in self.items()}
+
+
+def to_id_property(value):
+    if isinstance(value, np.ndarray):
+        value = value.tolist()
+    elif isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, dict) and not isinstance(value, IDPropertyGroup):
+        group = IDPropertyGroup()
+        for key, item in value.items():
+            group[key] = item
+        return group
+    if isinstance(value, (list, tuple)):
+        if all(isinstance(item, (bool, int, float)) for item in value):
+            return IDPropertyArray(value)
+        return [to_id_property(item) for item in value]
+    return value
+
+
+# データブロック
+# *************************************************************************************************
+# 名前で引ける、追加順のコレクション(同じ名前は .001 を付けて重ならないようにする)
+class NamedCollection:
+    def __init__(self):
+        self.items = {}
+        self.counters = {}
+
+    def add_unique(self, item, name):
+        if name in self.items:
+            base = re.sub(r"\.\d{3,}$", "", name)
+            no = self.counters.get(base, 0)
+            while True:
+                no += 1
+                candidate = "%s.%03d" % (base, no)
+                if candidate not in self.items:
+                    break
+            self.counters[base] = no
+            name = candidate
+        item.name = name
+        self.items[name] = item
+        return item
+
+    def discard(self, item):
+        if self.items.get(item.name) is item:
+            del self.items[item.name]
+        if not self.items:
+            self.counters.clear()
+
+    def get(self, name, default=None):
+        return self.items.get(name, default)
+
+    def keys(self):
+        return self.items.keys()
+
+    def values(self):
+        return self.items.values()
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            return list(self.items.values())[key]
+        return self.items[key]
+
+    def __contains__(self, name):
+        return name in self.items
+
+    def __iter__(self):
+        return iter(list(self.items.values()))
+
+    def __len__(self):
+        return len(self.items)
+
+
+class ID(StructRNA):
+    object_type = None
+
+    def __init__(self, name):
+        self.name = name
+        self.id_properties = {}
+        self.animation_data = None
+        self.data_collection = None
+
+    def __getitem__(self, key):
+        return self.id_properties[key]
+
+    def __setitem__(self, key, value):
+        self.id_properties[key] = to_id_property(value)
+
+    def __delitem__(self, key):
+        del self.id_properties[key]
+
+    def __contains__(self, key):
+        return key in self.id_properties
+
+    def get(self, key, default=None):
+        return self.id_properties.get(key, default)
+
+    def keys(self):
+        return self.id_properties.keys()
+
+    def values(self):
+        return self.id_properties.values()
+
+    def items(self):
+        return self.id_properties.items()
+
+    @property
+    def original(self):
+        return self
+
+    is_evaluated = False
+
+    def evaluated_get(self, depsgraph):
+        return self
+
+    def animation_data_create(self):
+        if self.animation_data == None:
+            self.animation_data = AnimData()
+        return self.animation_data
+
+    def animation_data_clear(self):
+        self.animation_data = None
+
+    # 削除時に他のデータからの参照を外す
+    def remove_links(self):
+        pass
+
+    def __repr__(self):
+        return "bpy.data.%s[%r]" % (type(self).__name__.lower() + "s", self.name)
+
+
+# ドライバ
+class DriverTarget:
+    def __init__(self):
+        self.id = None
+        self.id_type = 'OBJECT'
+        self.data_path = ""
+        self.bone_target = ""
+        self.transform_type = 'LOC_X'
+        self.transform_space = 'WORLD_SPACE'
+        self.rotation_mode = 'AUTO'
+
+
+class DriverVariable:
+    def __init__(self):
+        self.name = "var"
+        self.type = 'SINGLE_PROP'
+        self.targets = [DriverTarget(), DriverTarget()]
+
+
+class DriverVariables(list):
+    def new(self):
+        variable = DriverVariable()
+        self.append(variable)
+        return variable
+
+    def remove(self, variable):
+        list.remove(self, variable)
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            for variable in self:
+                if variable.name == key:
+                    return variable
+            raise KeyError(key)
+        return list.__getitem__(self, key)
+
+
+class Driver:
+    def __init__(self):
+        self.type = 'SCRIPTED'
+        self.expression = ""
+        self.variables = DriverVariables()
+        self.use_self = False
+        self.is_valid = True
+
+
+class FCurve:
+    def __init__(self, owner, data_path, index):
+        self.owner = owner
+        self.path = data_path
+        self.array_index = index
+        self.driver = Driver()
+        self.mute = False
+        self.modifiers = []
+
+    # パスを変えたら検索用の表も付け替える
+    @property
+    def data_path(self):
+        return self.path
+
+    @data_path.setter
+    def data_path(self, value):
+        del self.owner.items[(self.path, self.array_index)]
+        self.path = value
+        self.owner.items[(value, self.array_index)] = self
+
+
+class FCurves:
+    def __init__(self):
+        self.items = {}
+
+    def new(self, data_path, index=0):
+        if (data_path, index) in self.items:
+            raise RuntimeError("F-Curve '%s[%d]' already exists" % (data_path, index))
+        fcurve = FCurve(self, data_path, index)
+        self.items[(data_path, index)] = fcurve
+        return fcurve
+
+    def find(self, data_path, index=0):
+        return self.items.get((data_path, index))
+
+    def remove(self, fcurve):
+        del self.items[(fcurve.data_path, fcurve.array_index)]
+
+    def __iter__(self):
+        return iter(list(self.items.values()))
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, index):
+        return list(self.items.values())[index]
+
+
+class AnimData:
+    def __init__(self):
+        self.action = None
+        self.drivers = FCurves()
+
+
+# Curve
+class SplinePoint:
+    def __init__(self, points, index):
+        self.points = points
+        self.index = index
+
+    @property
+    def co(self):
+        return Vector.view(self.points.co[self.index])
+
+    @co.setter
+    def co(self, value):
+        self.points.co[self.index] = tuple(value)
+
+    @property
+    def tilt(self):
+        return float(self.points.tilt[self.index])
+
+    @tilt.setter
+    def tilt(self, value):
+        self.points.tilt[self.index] = value
+
+    @property
+    def radius(self):
+        return float(self.points.radius[self.index])
+
+    @radius.setter
+    def radius(self, value):
+        self.points.radius[self.index] = value
+
+    def get_data_path(self, name):
+        spline = self.points.spline
+        return "splines[%d].points[%d].%s" % (spline.curve.splines.index(spline), self.index, name)
+
+    def driver_add(self, path, index=-1):
+        drivers = self.points.spline.curve.animation_data_create().drivers
+        data_path = self.get_data_path(path)
+        fcurve = drivers.find(data_path)
+        return fcurve if fcurve != None else drivers.new(data_path)
+
+    def driver_remove(self, path, index=-1):
+        animation_data = self.points.spline.curve.animation_data
+        if animation_data == None:
+            return False
+        fcurve = animation_data.drivers.find(self.get_data_path(path))
+        if fcurve == None:
+            return False
+        animation_data.drivers.remove(fcurve)
+        return True
+
+
+# foreach_get/foreach_set で読み書きできる属性と、1ポイント分の要素数
+SPLINE_POINT_ATTRIBUTES = {"co": 4, "tilt": 1, "radius": 1}
+
+
+class SplinePoints:
+    def __init__(self, spline):
+        self.spline = spline
+        self.co = np.array([[0.0, 0.0, 0.0, 1.0]], dtype=np.float32)
+        self.tilt = np.zeros(1, dtype=np.float32)
+        self.radius = np.ones(1, dtype=np.float32)
+
+    def add(self, count=1):
+        co = np.zeros((count, 4), dtype=np.float32)
+        co[:, 3] = 1.0
+        self.co = np.concatenate([self.co, co])
+        self.tilt = np.concatenate([self.tilt, np.zeros(count, dtype=np.float32)])
+        self.radius = np.concatenate([self.radius, np.ones(count, dtype=np.float32)])
+
+    # Blenderと同じく、配列の大きさが合わない時はエラーにする
+    def check_size(self, attribute, seq):
+        if len(seq) != len(self.tilt) * SPLINE_POINT_ATTRIBUTES[attribute]:
+            raise RuntimeError("internal error setting the array")
+
+    def foreach_get(self, attribute, seq):
+        self.check_size(attribute, seq)
+        seq[:] = getattr(self, attribute).ravel()
+
+    def foreach_set(self, attribute, seq):
+        self.check_size(attribute, seq)
+        values = getattr(self, attribute)
+        values[:] = np.asarray(seq, dtype=np.float32).reshape(values.shape)
+
+    def __len__(self):
+        return len(self.tilt)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return SplinePoint(self, index)
+
+    def __iter__(self):
+        return (SplinePoint(self, index) for index in range(len(self)))
+
+
+class Spline:
+    def __init__(self, curve, type):
+        self.curve = curve
+        self.type = type
+        self.points = SplinePoints(self)
+        self.bezier_points = []
+        self.use_cyclic_u = False
+        self.order_u = 4
+        self.resolution_u = 12
+
+
+class Splines(list):
+    def __init__(self, curve):
+        super().__init__()
+        self.curve = curve
+
+    def new(self, type):
+        spline = Spline(self.curve, type)
+        self.append(spline)
+        return spline
+
+    def remove(self, spline):
+        list.remove(self, spline)
+
+    def index(self, spline):
+        for no, item in enumerate(self):
+            if item is spline:
+                return no
+        raise ValueError(spline)
+
+    def __eq__(self, other):
+        return self is other
+
+    __hash__ = None
+
+
+# オブジェクトのデータ(利用数はそのデータを使っているオブジェクトの数)
+class ObjectData(ID):
+    @property
+    def users(self):
+        return sum(1 for obj in data.objects.values() if obj.data is self)
+
+
+class Curve(ObjectData):
+    object_type = 'CURVE'
+
+    def __init__(self, name, type='CURVE'):
+        super().__init__(name)
+        self.dimensions = '3D'
+        self.splines = Splines(self)
+
+    def update_tag(self, refresh=set()):
+        pass
+
+
+# Mesh
+class VertexGroupElement:
+    def __init__(self, group, weight):
+        self.group = group
+        self.weight = weight
+
+
+class MeshVertex:
+    def __init__(self, index, co):
+        self.index = index
+        self.co = Vector(co)
+        self.groups = []
+        self.select = False
+
+
+class Mesh(ObjectData):
+    object_type = 'MESH'
+
+    def __init__(self, name):
+        super().__init__(name)
+        self.vertices = []
+        self.edges = []
+        self.polygons = []
+
+    def from_pydata(self, vertices, edges, faces):
+        self.vertices = [MeshVertex(index, co) for index, co in enumerate(vertices)]
+        self.edges = [tuple(edge) for edge in edges]
+        self.polygons = [tuple(face) for face in faces]
+
+    def update(self):
+        pass
+
+
+class VertexGroup:
+    def __init__(self, owner, index, name):
+        self.owner = owner
+        self.index = index
+        self.name = name
+
+    def add(self, index, weight, type):
+        for vertex_index in index:
+            groups = self.owner.data.vertices[vertex_index].groups
+            element = next((element for element in groups if element.group == self.index), None)
+            if element == None:
+                if type != 'SUBTRACT':
+                    groups.append(VertexGroupElement(self.index, weight))
+            elif type == 'REPLACE':
+                element.weight = weight
+            elif type == 'ADD':
+                element.weight = min(element.weight + weight, 1.0)
+            else:
+                element.weight = max(element.weight - weight, 0.0)
+
+
+class VertexGroups(list):
+    def __init__(self, owner):
+        super().__init__()
+        self.owner = owner
+
+    def new(self, name="Group"):
+        group = VertexGroup(self.owner, len(self), name)
+        self.append(group)
+        return group
+
+    def get(self, name, default=None):
+        return next((group for group in self if group.name == name), default)
+
+    def __eq__(self, other):
+        return self is other
+
+    __hash__ = None
+
+
+# Armature(編集モードのボーンと同じものを bones にも見せる)
+class Bone:
+    def __init__(self, name):
+        self.name = name
+        self.head = (0.0, 0.0, 0.0)
+        self.tail = (0.0, 0.0, 1.0)
+        self.head_radius = 0.1
+        self.tail_radius = 0.05
+        self.envelope_distance = 0.25
+        self.envelope_weight = 1.0
+        self.use_deform = True
+        self.parent = None
+        self.roll = 0.0
+
+
+class Bones(NamedCollection):
+    def new(self, name):
+        return self.add_unique(Bone(name), name)
+
+    def remove(self, bone):
+        self.discard(bone)
+
+
+class Armature(ObjectData):
+    object_type = 'ARMATURE'
+
+    def __init__(self, name):
+        super().__init__(name)
+        self.bones = Bones()
+        self.edit_bones = self.bones
+
+
+class PoseBone:
+    def __init__(self, bone):
+        self.name = bone.name
+        self.bone = bone
+        self.constraints = Constraints()
+        self.location = Vector()
+        self.rotation_euler = Vector()
+        self.rotation_mode = 'QUATERNION'
+        self.matrix = Matrix()
+
+
+# ボーンは名前で引かれた時に作る(ボーン数分のループで毎回全体を作り直さないように)
+class PoseBones:
+    def __init__(self, armature_data):
+        self.armature_data = armature_data
+        self.items = {}
+
+    def get(self, name, default=None):
+        pose_bone = self.items.get(name)
+        if pose_bone == None or pose_bone.bone is not self.armature_data.bones.get(name):
+            bone = self.armature_data.bones.get(name)
+            if bone == None:
+                return default
+            pose_bone = self.items[name] = PoseBone(bone)
+        return pose_bone
+
+    def __getitem__(self, name):
+        pose_bone = self.get(name)
+        if pose_bone == None:
+            raise KeyError(name)
+        return pose_bone
+
+    def __iter__(self):
+        return iter([self.get(name) for name in self.armature_data.bones.keys()])
+
+    def __len__(self):
+        return len(self.armature_data.bones)
+
+
+class Pose:
+    def __init__(self, armature_data):
+        self.bones = PoseBones(armature_data)
+
+
+class Action(ID):
+    def __init__(self, name):
+        super().__init__(name)
+        self.fcurves = FCurves()
+
+
+# コンストレイントとモディファイア
+class ConstraintTarget:
+    def __init__(self):
+        self.target = None
+        self.subtarget = ""
+        self.weight = 0.0
+
+
+class ConstraintTargets(list):
+    def new(self):
+        target = ConstraintTarget()
+        self.append(target)
+        return target
+
+    def remove(self, target):
+        list.remove(self, target)
+
+    def __eq__(self, other):
+        return self is other
+
+    __hash__ = None
+
+
+class Constraint:
+    def __init__(self, type):
+        self.type = type
+        self.name = type.replace("_", " ").title()
+        self.enabled = True
+        self.mute = False
+        self.influence = 1.0
+        self.target = None
+        self.subtarget = ""
+        self.targets = ConstraintTargets()
+        self.inverse_matrix = Matrix()
+
+
+class Constraints(list):
+    def new(self, type):
+        constraint = Constraint(type)
+        self.append(constraint)
+        return constraint
+
+    def remove(self, constraint):
+        list.remove(self, constraint)
+
+    def get(self, name, default=None):
+        return next((constraint for constraint in self if constraint.name == name), default)
+
+    def __eq__(self, other):
+        return self is other
+
+    __hash__ = None
+
+
+class Modifier:
+    def __init__(self, name, type):
+        self.name = name
+        self.type = type
+        self.object = None
+        self.show_viewport = True
+        self.show_render = True
+        self.matrix_inverse = Matrix()
+        self.center = (0.0, 0.0, 0.0)
+        self.falloff_type = 'NONE'
+        self.falloff_radius = 0.0
+        self.strength = 1.0
+        self.vertex_indices = []
+        self.use_vertex_groups = True
+        self.use_bone_envelopes = False
+
+    def vertex_indices_set(self, indices):
+        self.vertex_indices = list(indices)
+
+
+class Modifiers(NamedCollection):
+    def new(self, name, type):
+        return self.add_unique(Modifier(name, type), name)
+
+    def remove(self, modifier):
+        if self.items.get(modifier.name) is not modifier:
+            raise ReferenceError("modifier not in this object")
+        self.discard(modifier)
+
+
+# Object
+def euler_axis_property(attribute):
+    def get(self):
+        return Vector.view(getattr(self, attribute))
+    def set(self, value):
+        getattr(self, attribute)[:] = tuple(value)[:3]
+    return property(get, set)
+
+
+class Object(ID):
+    def __init__(self, name, object_data):
+        super().__init__(name)
+        self.data = object_data
+        self.type = object_data.object_type if object_data != None else 'EMPTY'
+        self.parent = None
+        self.matrix_parent_inverse = Matrix()
+        self.location_values = np.zeros(3)
+        self.rotation_values = np.zeros(3)
+        self.scale_values = np.ones(3)
+        self.rotation_mode = 'XYZ'
+        self.users_collection = []
+        self.modifiers = Modifiers()
+        self.constraints = Constraints()
+        self.vertex_groups = VertexGroups(self)
+        self.pose = Pose(object_data) if self.type == 'ARMATURE' else None
+        self.mode = 'OBJECT'
+        self.select = False
+        self.hidden = False
+        self.empty_display_type = 'PLAIN_AXES'
+        self.empty_display_size = 1.0
+        self.show_in_front = False
+
+    location = euler_axis_property("location_values")
+    rotation_euler = euler_axis_property("rotation_values")
+    scale = euler_axis_property("scale_values")
+
+    @property
+    def users(self):
+        return len(self.users_collection)
+
+    # XYZオイラーとスケールと位置から作る
+    @property
+    def matrix_basis(self):
+        rx, ry, rz = self.rotation_values.tolist()
+        matrix = Matrix.Rotation(rz, 4, 'Z') @ Matrix.Rotation(ry, 4, 'Y') @ Matrix.Rotation(rx, 4, 'X')
+        matrix.values[:3, :3] *= self.scale_values
+        matrix.values[:3, 3] = self.location_values
+        return matrix
+
+    @property
+    def matrix_world(self):
+        if self.parent == None:
+            return self.matrix_basis
+        return self.parent.matrix_world @ self.matrix_parent_inverse @ self.matrix_basis
+
+    def select_set(self, state):
+        self.select = bool(state)
+
+    def select_get(self):
+        return self.select
+
+    def hide_set(self, state):
+        self.hidden = bool(state)
+
+    def hide_get(self):
+        return self.hidden
+
+    def visible_get(self):
+        return not self.hidden
+
+    def update_from_editmode(self):
+        return self.mode == 'EDIT'
+
+    def remove_links(self):
+        for collection in list(self.users_collection):
+            collection.objects.unlink(self)
+        if context.view_layer.objects.active is self:
+            context.view_layer.objects.active = None
+
+
+# コレクションとシーン
+class CollectionObjects:
+    def __init__(self, collection):
+        self.collection = collection
+        self.items = {}
+
+    def link(self, obj):
+        if id(obj) in self.items:
+            raise RuntimeError("Object '%s' already in collection '%s'" % (obj.name, self.collection.name))
+        self.items[id(obj)] = obj
+        obj.users_collection.append(self.collection)
+
+    def unlink(self, obj):
+        del self.items[id(obj)]
+        obj.users_collection[:] = [collection for collection in obj.users_collection if collection is not self.collection]
+
+    def __iter__(self):
+        return iter(list(self.items.values()))
+
+    def __len__(self):
+        return len(self.items)
+
+
+class CollectionChildren(list):
+    def link(self, collection):
+        self.append(collection)
+
+    def unlink(self, collection):
+        list.remove(self, collection)
+
+
+class Collection(ID):
+    def __init__(self, name):
+        super().__init__(name)
+        self.objects = CollectionObjects(self)
+        self.children = CollectionChildren()
+        self.hide_viewport = False
+
+    @property
+    def all_objects(self):
+        objects = {id(obj): obj for obj in self.objects}
+        for child in self.children:
+            objects.update((id(obj), obj) for obj in child.all_objects)
+        return list(objects.values())
+
+
+# シーンは1つだけなので、どこかのコレクションに入っているオブジェクトをシーンのオブジェクトとする
+class SceneObjects:
+    def __iter__(self):
+        return iter([obj for obj in data.objects.values() if obj.users_collection])
+
+    def __len__(self):
+        return sum(1 for obj in data.objects.values() if obj.users_collection)
+
+    def get(self, name, default=None):
+        obj = data.objects.get(name)
+        return obj if obj != None and obj.users_collection else default
+
+    def __getitem__(self, name):
+        obj = self.get(name)
+        if obj == None:
+            raise KeyError(name)
+        return obj
+
+
+class LayerObjects(SceneObjects):
+    def __init__(self):
+        self.active = None
+
+
+class ViewLayer:
+    def __init__(self):
+        self.name = "ViewLayer"
+        self.objects = LayerObjects()
+
+    def update(self):
+        pass
+
+
+class DepsgraphUpdate:
+    def __init__(self, block, transform=False, geometry=False):
+        self.id = block
+        self.is_updated_transform = transform
+        self.is_updated_geometry = geometry
+        self.is_updated_shading = False
+
+
+class Depsgraph:
+    def __init__(self, scene, view_layer):
+        self.scene = scene
+        self.view_layer = view_layer
+        self.updates = []
+
+    def id_eval_get(self, block):
+        return block
+
+    def update(self):
+        pass
+
+
+class Scene(ID):
+    def __init__(self, name):
+        super().__init__(name)
+        self.collection = Collection("Scene Collection")
+        self.objects = SceneObjects()
+        self.frame_current = 1
+        self.frame_start = 1
+        self.frame_end = 250
+        self.camera = None
+        self.render = types.SimpleNamespace(fps=24, fps_base=1.0, resolution_x=1920, resolution_y=1080, resolution_percentage=100, pixel_aspect_x=1.0, pixel_aspect_y=1.0)
+
+    # 評価はしないので、フレームを変えてハンドラを呼ぶだけ
+    def frame_set(self, frame, subframe=0.0):
+        self.frame_current = frame
+        depsgraph = context.evaluated_depsgraph_get()
+        for handler in list(handlers.frame_change_pre):
+            handler(self, depsgraph)
+        for handler in list(handlers.frame_change_post):
+            handler(self, depsgraph)
+
+
+# 評価はしないので、Blenderが編集やupdate_tagの後に呼ぶ depsgraph_update_post を、更新したデータを渡して呼ぶ
+def send_depsgraph_update(updates):
+    depsgraph = context.evaluated_depsgraph_get()
+    depsgraph.updates = updates
+    for handler in list(handlers.depsgraph_update_post):
+        handler(context.scene, depsgraph)
+
+
+# bpy.data
+# *************************************************************************************************
+class BlendDataCollection(NamedCollection):
+    def __init__(self, id_type):
+        super().__init__()
+        self.id_type = id_type
+
+    def new(self, name, *args):
+        block = self.add_unique(self.id_type(name, *args), name)
+        block.data_collection = self
+        return block
+
+    def remove(self, block, do_unlink=True, **keywords):
+        block.remove_links()
+        self.discard(block)
+
+
+class BlendData:
+    def __init__(self):
+        self.filepath = ""
+        self.objects = BlendDataCollection(Object)
+        self.curves = BlendDataCollection(Curve)
+        self.meshes = BlendDataCollection(Mesh)
+        self.armatures = BlendDataCollection(Armature)
+        self.actions = BlendDataCollection(Action)
+        self.collections = BlendDataCollection(Collection)
+        self.scenes = BlendDataCollection(Scene)
+
+    def batch_remove(self, ids):
+        for block in list(ids):
+            block.data_collection.remove(block)
+
+
+# bpy.context
+# *************************************************************************************************
+class Context:
+    def __init__(self, scene):
+        self.scene = scene
+        self.view_layer = ViewLayer()
+        self.screen = None  # バックグラウンドと同じくUIはない(再生中にするときはis_animation_playingを持つものを入れる)
+        self.window = None
+
+    @property
+    def active_object(self):
+        return self.view_layer.objects.active
+
+    object = active_object
+
+    @property
+    def selected_objects(self):
+        return [obj for obj in self.view_layer.objects if obj.select]
+
+    @property
+    def edit_object(self):
+        active = self.view_layer.objects.active
+        return active if active != None and active.mode == 'EDIT' else None
+
+    @property
+    def mode(self):
+        edit_object = self.edit_object
+        return 'OBJECT' if edit_object == None else 'EDIT_' + edit_object.type
+
+    def evaluated_depsgraph_get(self):
+        return Depsgraph(self.scene, self.view_layer)
+
+
+data = BlendData()
+context = Context(data.scenes.new("Scene"))
+
+
+# bpy.app / bpy.app.handlers / bpy.msgbus / bpy.path
+# *************************************************************************************************
+def persistent(function):
+    return function
+
+
+HANDLER_NAMES = (
+    "frame_change_pre", "frame_change_post", "depsgraph_update_pre", "depsgraph_update_post",
+    "load_pre", "load_post", "save_pre", "save_post", "undo_pre", "undo_post", "redo_pre", "redo_post",
+    "render_init", "render_pre", "render_post", "render_complete", "render_cancel",
+)
+
+handlers = types.ModuleType("bpy.app.handlers")
+handlers.persistent = persistent
+for name in HANDLER_NAMES:
+    setattr(handlers, name, [])
+
+
+msgbus_subscriptions = []
+
+def subscribe_rna(key, owner, args, notify, options=set()):
+    msgbus_subscriptions.append((key, owner, args, notify))
+
+def clear_by_owner(owner):
+    msgbus_subscriptions[:] = [subscription for subscription in msgbus_subscriptions if subscription[1] is not owner]
+
+def publish_rna(key):
+    for subscription_key, owner, args, notify in list(msgbus_subscriptions):
+        if subscription_key == key:
+            notify(*args)
+
+
+def abspath(path, start=None, library=None):
+    if path.startswith("//"):
+        return os.path.join(start if start != None else os.path.dirname(data.filepath), path[2:])
+    return path
+
+def basename(path):
+    return os.path.basename(path[2:] if path.startswith("//") else path)
+
+def clean_name(name, replace="_"):
+    return re.sub(r"[^A-Za-z0-9_]", replace, name)
+
+
+# bpy.utils / bpy.ops
+# *************************************************************************************************
+registered_classes = {}
+registered_operators = {}
+registered_panels = {}
+
+def register_class(cls):
+    if cls in registered_classes:
+        raise ValueError("register_class(...): already registered as a subclass '%s'" % cls.__name__)
+    if issubclass(cls, Operator):
+        if not re.match(r"^[a-z0-9_]+\.[a-z0-9_]+$", getattr(cls, "bl_idname", "")):
+            raise ValueError("register_class(...): invalid bl_idname '%s'" % getattr(cls, "bl_idname", ""))
+        registered_operators[cls.bl_idname] = cls
+    if issubclass(cls, Panel):
+        # 親パネルを先に登録しておかないとBlenderでもエラーになる
+        parent_id = getattr(cls, "bl_parent_id", None)
+        if parent_id != None and parent_id not in registered_panels:
+            raise RuntimeError("register_class(...): parent '%s' for '%s' not found" % (parent_id, cls.__name__))
+        registered_panels[getattr(cls, "bl_idname", cls.__name__)] = cls
+    registered_classes[cls] = True
+    cls.is_registered = True
+
+def unregister_class(cls):
+    if cls not in registered_classes:
+        raise RuntimeError("unregister_class(...): missing bl_rna attribute from '%s'" % cls.__name__)
+    del registered_classes[cls]
+    if issubclass(cls, Operator):
+        del registered_operators[cls.bl_idname]
+    if issubclass(cls, Panel):
+        del registered_panels[getattr(cls, "bl_idname", cls.__name__)]
+    cls.is_registered = False
+
+
+def mode_set(mode='OBJECT', toggle=False):
+    active = context.view_layer.objects.active
+    if active == None:
+        raise RuntimeError("Operator bpy.ops.object.mode_set.poll() failed, context is incorrect")
+    active.mode = mode
+    return {'FINISHED'}
+
+def save_mainfile(filepath="", **keywords):
+    data.filepath = filepath or data.filepath  # 保存はしない
+    return {'FINISHED'}
+
+BUILTIN_OPERATORS = {"object.mode_set": mode_set, "wm.save_mainfile": save_mainfile}
+
+
+# オペレータは登録したクラスから作って、プロパティを初期値と引数で埋めてからexecuteする
+class OperatorFunction:
+    def __init__(self, idname):
+        self.idname = idname
+
+    def get_class(self):
+        cls = registered_operators.get(self.idname)
+        if cls == None:
+            raise AttributeError("Calling operator \"bpy.ops.%s\" error, could not be found" % self.idname)
+        return cls
+
+    def poll(self):
+        cls = self.get_class()
+        return not hasattr(cls, "poll") or cls.poll(context)
+
+    def __call__(self, *args, **keywords):
+        if self.idname in BUILTIN_OPERATORS:
+            return BUILTIN_OPERATORS[self.idname](**keywords)
+        cls = self.get_class()
+        if hasattr(cls, "poll") and not cls.poll(context):
+            raise RuntimeError("Operator bpy.ops.%s.poll() failed, context is incorrect" % self.idname)
+        operator = cls.__new__(cls)
+        for name, value in get_annotation_defaults(cls).items():
+            setattr(operator, name, value)
+        for name, value in keywords.items():
+            setattr(operator, name, value)
+        return operator.execute(context)
+
+
+class OperatorModule:
+    def __init__(self, name):
+        self.name = name
+
+    def __getattr__(self, name):
+        return OperatorFunction(self.name + "." + name)
+
+
+class OperatorModules(types.ModuleType):
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return OperatorModule(name)
+
+
+# UILayout(描いた項目を数えるだけ)
+# *************************************************************************************************
+class UILayout:
+    def __init__(self):
+        self.items = []
+        self.enabled = True
+        self.active = True
+        self.alert = False
+        self.scale_x = 1.0
+        self.scale_y = 1.0
+        self.use_property_split = False
+        self.use_property_decorate = True
+
+    def add_layout(self):
+        layout = UILayout()
+        self.items.append(layout)
+        return layout
+
+    def row(self, align=False, heading="", **keywords):
+        return self.add_layout()
+
+    def column(self, align=False, heading="", **keywords):
+        return self.add_layout()
+
+    def box(self):
+        return self.add_layout()
+
+    def split(self, factor=0.0, align=False):
+        return self.add_layout()
+
+    def grid_flow(self, **keywords):
+        return self.add_layout()
+
+    def column_flow(self, columns=0, align=False):
+        return self.add_layout()
+
+    def label(self, text="", icon='NONE', **keywords):
+        self.items.append(("label", text))
+
+    # Blenderは登録されていないプロパティとオペレータを赤字で描くだけだが、ここではエラーにして気づけるようにする
+    def prop(self, data, property, **keywords):
+        if not hasattr(data, property):
+            raise AttributeError("property not found: %s.%s" % (type(data).__name__, property))
+        self.items.append(("prop", property))
+
+    def operator(self, operator, **keywords):
+        if operator not in registered_operators and operator not in BUILTIN_OPERATORS:
+            raise ValueError("unknown operator '%s'" % operator)
+        self.items.append(("operator", operator))
+        return types.SimpleNamespace()
+
+    def separator(self, factor=1.0):
+        self.items.append(("separator", ""))
+
+    def count(self):
+        return sum(item.count() if isinstance(item, UILayout) else 1 for item in self.items)
+
+
+# 登録順(親パネルが先)に、pollを通るパネルを全部開いた状態で描いて、描いた項目数を返す
+def draw_panels(context):
+    count = 0
+    for cls in list(registered_panels.values()):
+        if hasattr(cls, "poll") and not cls.poll(context):
+            continue
+        panel = cls.__new__(cls)
+        panel.layout = UILayout()
+        panel.draw(context)
+        count += panel.layout.count()
+    return count
+
+
+# sys.modules への登録
+# *************************************************************************************************
+def make_module(name, **attributes):
+    module = types.ModuleType(name)
+    module.__dict__.update(attributes)
+    return module
+
+
+def install():
+    if isinstance(sys.modules.get("bpy"), types.ModuleType) and getattr(sys.modules["bpy"], "fake", False):
+        return sys.modules["bpy"]
+
+    property_functions = {name: make_property_function(name) for name in PROPERTY_DEFAULTS}
+    props = make_module("bpy.props", _PropertyDeferred=PropertyDeferred, **property_functions)
+    bpy_types = make_module("bpy.types",
+        Operator=Operator, Panel=Panel, PropertyGroup=PropertyGroup, AddonPreferences=AddonPreferences, Header=Header, Menu=Menu,
+        Node=Node, NodeSocket=NodeSocket, NodeTree=NodeTree, UIList=UIList, RenderEngine=RenderEngine, Gizmo=Gizmo, GizmoGroup=GizmoGroup,
+        ID=ID, Object=Object, Scene=Scene, Collection=Collection, Curve=Curve, Mesh=Mesh, Armature=Armature, Action=Action,
+        LayerObjects=LayerObjects, ViewLayer=ViewLayer, Depsgraph=Depsgraph, UILayout=UILayout,
+    )
+    app = make_module("bpy.app",
+        version=(4, 2, 0), version_string="4.2.0 (fake_bpy)", binary_path="", background=True,
+        tempdir=tempfile.gettempdir() + os.sep, driver_namespace={}, handlers=handlers,
+    )
+    utils = make_module("bpy.utils", register_class=register_class, unregister_class=unregister_class)
+    path = make_module("bpy.path", abspath=abspath, basename=basename, clean_name=clean_name)
+    msgbus = make_module("bpy.msgbus", subscribe_rna=subscribe_rna, clear_by_owner=clear_by_owner, publish_rna=publish_rna)
+    ops = OperatorModules("bpy.ops")
+    bpy = make_module("bpy", fake=True, types=bpy_types, props=props, app=app, utils=utils, path=path, msgbus=msgbus, ops=ops, data=data, context=context)
+
+    io_utils = make_module("bpy_extras.io_utils", ExportHelper=ExportHelper, ImportHelper=ImportHelper)
+    bpy_extras = make_module("bpy_extras", io_utils=io_utils)
+
+    kdtree = make_module("mathutils.kdtree", KDTree=KDTree)
+    mathutils = make_module("mathutils", Vector=Vector, Matrix=Matrix, Euler=Vector, kdtree=kdtree)
+
+    sys.modules.update({
+        "bpy": bpy, "bpy.types": bpy_types, "bpy.props": props, "bpy.app": app, "bpy.app.handlers": handlers,
+        "bpy.utils": utils, "bpy.path": path, "bpy.msgbus": msgbus, "bpy.ops": ops,
+        "bpy_extras": bpy_extras, "bpy_extras.io_utils": io_utils,
+        "mathutils": mathutils, "mathutils.kdtree": kdtree,
+    })
+    return bpy